@@ -1,14 +1,32 @@
 # Imports from otehr files
 from app.errors import register_error_handlers
-from app.extensions import db, login_manager, migrate
+from app.extensions import db, login_manager, migrate_cli
+from app.filecache import cache_cli
+from app.analytics import analytics
+from app.apt import apt_cli
+from app.audit import audit_log
+from app.backup import backup_cli
+from app.compression import compression_cli
+from app.events import init_events
+from app.jobs import jobs_cli
+from app.manifests import manifests_cli
+from app import tasks  # noqa: F401 (registers the background jobs)
+from app import natsort  # noqa: F401 (registers the SQLite collation)
 from app.models import User, Role, user_datastore
+from app.packages import packages_cli
+from app.ratelimit import limiter
+from app.rbac import init_rbac
+from app.scrub import store_cli
+from app.search import search_cli
+from app.server import serve_command
+from app.stats import stats_cli
+from app.storage import init_storage
+from app.versions import versions_cli
+from app.startup import DeferredSetup, importtime_command
+from app.views.api import api
+from app.views.apt import apt
+from app.views.health import health
 from app.views.students import students
-from app.views.admin_pages import (
-    UserAdminView,
-    CourseAdminView,
-    UploadAdminView,
-    DownloadAdminView,
-)
 from app.forms import (
     DownloadForm,
     CourseSearchForm,
@@ -21,10 +39,7 @@ from app.forms import (
 from config import Config
 
 # Basic flask imports
-from flask import Flask, url_for
-
-# Imports for Admin page
-from flask_admin import Admin, helpers as admin_helpers
+from flask import Flask, request, url_for
 
 # Imports for Flask security
 from flask_security import Security, UsernameUtil
@@ -45,20 +60,35 @@ def create_app(config_class=Config):
 
     # Initialize Flask extensions here
     db.init_app(app)
+    init_storage(app)
     login_manager.init_app(app)
-    migrate.init_app(app, db)
-
-    button_text = "Admin"
-    admin = Admin(
-        app,
-        name=button_text,
-        base_template="master.html",
-        template_mode="bootstrap3",
-    )
+    limiter.init_app(app)
+    audit_log.init_app(app)
+    analytics.init_app(app)
+    init_rbac(app)
+    init_events(app)
 
     app.register_blueprint(students)
+    app.register_blueprint(api)
+    app.register_blueprint(apt)
+    app.register_blueprint(health)
     register_error_handlers(app)
 
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(packages_cli)
+    app.cli.add_command(compression_cli)
+    app.cli.add_command(versions_cli)
+    app.cli.add_command(apt_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(manifests_cli)
+    app.cli.add_command(cache_cli)
+    app.cli.add_command(backup_cli)
+    app.cli.add_command(store_cli)
+    app.cli.add_command(migrate_cli)
+    app.cli.add_command(importtime_command)
+    app.cli.add_command(serve_command)
+
     security = Security(
         app,
         user_datastore,
@@ -72,12 +102,12 @@ def create_app(config_class=Config):
     # The processor runs when the app is created.
     @security.context_processor
     def security_context_processor():
+        from flask_admin import helpers as admin_helpers
+
         search_form = CourseSearchForm()
         upload_form = UploadExerciseForm()
         download_form = DownloadForm()
-        return dict(
-            admin_base_template=admin.base_template,
-            admin_view=admin.index_view,
+        context = dict(
             # DO NOT RENAME/REMOVE the next two lines: Flask essential variables
             h=admin_helpers,  # !!!
             get_url=url_for,  # !!!
@@ -85,6 +115,15 @@ def create_app(config_class=Config):
             upload_form=upload_form,
             download_form=download_form,
         )
+        # With LAZY_ADMIN, Flask-Admin isn't set up before the first request
+        #   (a mail sent by a CLI command...): only the admin pages need it
+        if "admin" in app.extensions:
+            admin = app.extensions["admin"][0]
+            context.update(
+                admin_base_template=admin.base_template,
+                admin_view=admin.index_view,
+            )
+        return context
 
     @security.register_context_processor
     def security_register_processor():
@@ -97,6 +136,9 @@ def create_app(config_class=Config):
 
     @app.before_request
     def create_user():
+        # The readiness probe reports database errors itself
+        if request.blueprint == "health":
+            return
         existing_user = user_datastore.find_user(username="admin")
         if not existing_user:
             first_user = user_datastore.create_user(
@@ -109,10 +151,12 @@ def create_app(config_class=Config):
             user_datastore.add_role_to_user(first_user, admin_role)
             db.session.commit()
 
-    admin.add_view(UserAdminView(User, db.session, name="Users"))
-    admin.add_view(CourseAdminView(name="Courses", endpoint="course_admin"))
-    admin.add_view(UploadAdminView(name="Upload", endpoint="upload_admin"))
-    admin.add_view(DownloadAdminView(name="Download", endpoint="download_admin"))
+    # CLI commands and job workers never use the admin pages: set them up
+    #   before the first request only, unless asked to do it now.
+    if app.config["LAZY_ADMIN"]:
+        app.wsgi_app = DeferredSetup(app, init_admin)
+    else:
+        init_admin(app)
 
     # Redirect users that are not logged in to the default "login" view
     login_manager.login_view = "login"
@@ -126,3 +170,33 @@ def create_app(config_class=Config):
         return User.query.get(user_id)
 
     return app
+
+
+def init_admin(app):
+    """Register Flask-Admin and the admin views of the app."""
+    from flask_admin import Admin
+
+    from app.views.admin_pages import (
+        DashboardView,
+        UserAdminView,
+        CourseAdminView,
+        UploadAdminView,
+        DownloadAdminView,
+        AnalyticsAdminView,
+    )
+
+    button_text = "Admin"
+    admin = Admin(
+        app,
+        name=button_text,
+        base_template="master.html",
+        template_mode="bootstrap3",
+        index_view=DashboardView(),
+    )
+
+    admin.add_view(UserAdminView(User, db.session, name="Users"))
+    admin.add_view(CourseAdminView(name="Courses", endpoint="course_admin"))
+    admin.add_view(UploadAdminView(name="Upload", endpoint="upload_admin"))
+    admin.add_view(DownloadAdminView(name="Download", endpoint="download_admin"))
+    admin.add_view(AnalyticsAdminView(name="Analytics", endpoint="analytics_admin"))
+    return admin
@@ -0,0 +1,292 @@
+"""
+Download analytics: which exercises are hot, and the load of each course.
+
+Every download is added to the counters of its (minute, course, exercise)
+in the worker process: a few additions under an uncontended lock, no
+database write. The counters only grow with the number of exercises
+downloaded between two flushes, so no download is ever dropped. They are
+swapped out every ANALYTICS_FLUSH_INTERVAL seconds by the writer thread of
+app/audit.py, and summed into the "download_rollups" table with one upsert
+per resolution:
+    minute    kept ANALYTICS_MINUTE_RETENTION hours, for the last hour
+    hour      kept forever, for the longer windows
+
+Reports only read the rollups, so they cost the same whatever the number of
+downloads; they lag behind by up to one flush interval.
+"""
+
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, select
+
+from app.audit import EventBuffer
+from app.extensions import db
+from app.models import Course, DownloadRollup, Exercise, utcnow
+
+rollups = DownloadRollup.__table__
+
+UPSERT_ROWS = 1000
+
+PERIODS = ("minute", "hour")
+
+# Window name -> (resolution of the rollups read, length)
+WINDOWS = {
+    "1h": ("minute", timedelta(hours=1)),
+    "24h": ("hour", timedelta(days=1)),
+    "7d": ("hour", timedelta(days=7)),
+    "30d": ("hour", timedelta(days=30)),
+}
+
+
+def bucket_start(moment, period):
+    moment = moment.replace(second=0, microsecond=0)
+    if period == "hour":
+        moment = moment.replace(minute=0)
+    return moment
+
+
+def _upsert(connection, rows):
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    # Chunks, to stay below SQLite's limit of parameters per statement
+    for start in range(0, len(rows), UPSERT_ROWS):
+        statement = insert(rollups).values(rows[start : start + UPSERT_ROWS])
+        connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=["period", "bucket", "course_id", "exercise_id"],
+                set_={
+                    column: rollups.c[column] + statement.excluded[column]
+                    for column in ("downloads", "bytes_sent", "bytes_saved")
+                },
+            )
+        )
+
+
+class RollupSink:
+    """
+    Sum a batch of (minute, course, exercise, downloads, bytes sent, bytes
+    saved) counters into the minute and hour rollups.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def write(self, entries):
+        # Period -> (bucket, course, exercise) -> [downloads, sent, saved]
+        counts = {period: defaultdict(lambda: [0, 0, 0]) for period in PERIODS}
+        for minute, course_id, exercise_id, downloads, sent, saved in entries:
+            for period, counter in counts.items():
+                total = counter[(bucket_start(minute, period), course_id, exercise_id)]
+                total[0] += downloads
+                total[1] += sent
+                total[2] += saved
+
+        with self.app.app_context():
+            connection = db.session.connection()
+            for period, counter in counts.items():
+                _upsert(
+                    connection,
+                    [
+                        dict(
+                            period=period,
+                            bucket=bucket,
+                            course_id=course_id,
+                            exercise_id=exercise_id,
+                            downloads=downloads,
+                            bytes_sent=sent,
+                            bytes_saved=saved,
+                        )
+                        for (bucket, course_id, exercise_id), (
+                            downloads,
+                            sent,
+                            saved,
+                        ) in sorted(counter.items())
+                    ],
+                )
+            retention = timedelta(hours=self.app.config["ANALYTICS_MINUTE_RETENTION"])
+            connection.execute(
+                rollups.delete().where(
+                    rollups.c.period == "minute",
+                    rollups.c.bucket < utcnow() - retention,
+                )
+            )
+            db.session.commit()
+
+
+class DownloadCounters(EventBuffer):
+    """
+    An EventBuffer of the [downloads, sent, saved] counters of each (minute,
+    course, exercise): its length is the number of counters, not of downloads.
+    """
+
+    def _reset(self):
+        super()._reset()
+        self._events = {}
+
+    def _add(self, event):
+        *key, sent, saved = event
+        counts = self._events.setdefault(tuple(key), [0, 0, 0])
+        counts[0] += 1
+        counts[1] += sent
+        counts[2] += saved
+
+    def _take(self):
+        # Swap the counters out: new downloads are counted in a new dict
+        events, self._events = self._events, {}
+        return [(*key, *counts) for key, counts in events.items()]
+
+    def _requeue(self, events):
+        # Counters are merged back, never dropped: there is one per exercise
+        with self._condition:
+            for *key, downloads, sent, saved in events:
+                counts = self._events.setdefault(tuple(key), [0, 0, 0])
+                counts[0] += downloads
+                counts[1] += sent
+                counts[2] += saved
+            self._oldest = time.monotonic()
+
+
+class DownloadAnalytics:
+    """
+    Flask extension: the download counters of each app are kept in
+    app.extensions["analytics"].
+    """
+
+    def init_app(self, app):
+        app.extensions["analytics"] = DownloadCounters(
+            RollupSink(app),
+            # Counters are tiny: only the interval should trigger a flush
+            batch_size=app.config["ANALYTICS_BUFFER_SIZE"],
+            interval=app.config["ANALYTICS_FLUSH_INTERVAL"],
+            capacity=app.config["ANALYTICS_BUFFER_SIZE"],
+            background=app.config["ANALYTICS_BACKGROUND_THREAD"],
+        )
+
+    @staticmethod
+    def count_download(exercise, sent=None):
+        """
+        Count a download of "exercise" which sent "sent" bytes, the whole file
+        by default. Call it from every download route.
+        """
+        size = exercise.size or 0
+        sent = size if sent is None else sent
+        current_app.extensions["analytics"].put(
+            (
+                bucket_start(utcnow(), "minute"),
+                exercise.course_id,
+                exercise.exercise_id,
+                sent,
+                max(size - sent, 0),
+            )
+        )
+
+    @staticmethod
+    def flush():
+        """Write the counters of the current app to the rollups now."""
+        return current_app.extensions["analytics"].flush()
+
+
+analytics = DownloadAnalytics()
+
+
+# Reading
+
+
+def _window(window):
+    period, length = WINDOWS[window]
+    return and_(
+        rollups.c.period == period,
+        rollups.c.bucket > bucket_start(utcnow() - length, period),
+    )
+
+
+def top_exercises(window="24h", limit=10):
+    """The most downloaded exercises of the window, most downloaded first."""
+    downloads = func.sum(rollups.c.downloads).label("downloads")
+    top = (
+        select(
+            rollups.c.exercise_id,
+            downloads,
+            func.sum(rollups.c.bytes_sent).label("bytes_sent"),
+            func.sum(rollups.c.bytes_saved).label("bytes_saved"),
+        )
+        .where(_window(window))
+        .group_by(rollups.c.exercise_id)
+        .order_by(downloads.desc(), rollups.c.exercise_id)
+        .limit(limit)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(
+            top.c.exercise_id,
+            top.c.downloads,
+            top.c.bytes_sent,
+            top.c.bytes_saved,
+            Exercise.number,
+            Course.name,
+        )
+        .select_from(top)
+        .outerjoin(Exercise, Exercise.exercise_id == top.c.exercise_id)
+        .outerjoin(Course, Course.course_id == Exercise.course_id)
+        .order_by(top.c.downloads.desc(), top.c.exercise_id)
+    )
+    # Deleted exercises keep their counts, without a name
+    return [
+        {
+            "exercise_id": exercise_id,
+            "exercise": number,
+            "course": course,
+            "downloads": downloads,
+            "bytes_sent": sent,
+            "bytes_saved": saved,
+        }
+        for exercise_id, downloads, sent, saved, number, course in rows
+    ]
+
+
+def course_load(window="24h"):
+    """
+    The downloads of each course in the window, the bytes they sent, and
+    the downloads of its busiest minute (1h window) or hour (longer windows).
+    """
+    per_bucket = (
+        select(
+            rollups.c.course_id,
+            rollups.c.bucket,
+            func.sum(rollups.c.downloads).label("downloads"),
+            func.sum(rollups.c.bytes_sent).label("bytes_sent"),
+        )
+        .where(_window(window))
+        .group_by(rollups.c.course_id, rollups.c.bucket)
+        .subquery()
+    )
+    downloads = func.sum(per_bucket.c.downloads).label("downloads")
+    rows = db.session.execute(
+        select(
+            per_bucket.c.course_id,
+            Course.name,
+            downloads,
+            func.max(per_bucket.c.downloads),
+            func.sum(per_bucket.c.bytes_sent),
+        )
+        .select_from(per_bucket)
+        .outerjoin(Course, Course.course_id == per_bucket.c.course_id)
+        .group_by(per_bucket.c.course_id, Course.name)
+        .order_by(downloads.desc(), per_bucket.c.course_id)
+    )
+    return [
+        {
+            "course_id": course_id,
+            "course": name,
+            "downloads": total,
+            "peak": peak,
+            "bytes_sent": sent,
+        }
+        for course_id, name, total, peak, sent in rows
+    ]
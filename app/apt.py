@@ -0,0 +1,156 @@
+"""
+APT "flat repository" indexes for the .deb exercises of each course.
+
+For every course the files Packages, Packages.gz and Release are generated
+from the "packages" table into APT_INDEX_FOLDER/<course>/. A course is only
+rebuilt when one of its packages changes, is deleted (with its exercise, or
+when the exercise is replaced by another kind of file) or moves to another
+course, and files whose content didn't change are left untouched, so their
+ETag/Last-Modified stay valid.
+
+On a lab machine:
+    deb [trusted=yes] http://<server>/apt/<course> ./
+"""
+
+import gzip
+import hashlib
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.jobs import enqueue, enqueue_on_commit, task
+from app.models import Course, Package, utcnow
+from app.packages import package_indexed
+from config import basedir
+
+
+def index_folder(course_name):
+    return os.path.join(basedir, current_app.config["APT_INDEX_FOLDER"], course_name)
+
+
+def packages_stanza(package):
+    """Return the Packages entry of an indexed .deb exercise."""
+    exercise = package.exercise
+    fields = [
+        ("Package", package.name),
+        ("Version", package.version),
+        ("Architecture", package.architecture),
+        ("Installed-Size", package.installed_size),
+        ("Depends", package.depends),
+        # Relative to the course folder, which is the repository root
+        ("Filename", "./" + os.path.basename(exercise.exercise_path)),
+        ("Size", package.size),
+        ("SHA256", exercise.sha256),
+        ("Description", package.description),
+    ]
+    lines = []
+    for key, value in fields:
+        if value is None or value == "":
+            continue
+        # Continuation lines of multi-line fields start with a space
+        value = str(value).replace("\n", "\n ")
+        lines.append(f"{key}: {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_if_changed(path, content):
+    """Atomically replace "path" with "content"; return False if it was identical."""
+    try:
+        with open(path, "rb") as file:
+            if file.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def build_course_index(course):
+    """(Re)generate the APT index files of one course. Return True if they changed."""
+    packages = (
+        Package.query.filter_by(course_id=course.course_id)
+        .order_by(Package.name, Package.version_sort)
+        .all()
+    )
+    packages_file = "\n".join(packages_stanza(package) for package in packages).encode()
+    # mtime=0 keeps Packages.gz byte-identical for an identical Packages file
+    packages_gz = gzip.compress(packages_file, mtime=0)
+
+    folder = index_folder(course.name)
+    os.makedirs(folder, exist_ok=True)
+    changed = _write_if_changed(os.path.join(folder, "Packages"), packages_file)
+    changed |= _write_if_changed(os.path.join(folder, "Packages.gz"), packages_gz)
+    if not changed and os.path.exists(os.path.join(folder, "Release")):
+        return False
+
+    architectures = sorted({p.architecture for p in packages if p.architecture})
+    checksums = "".join(
+        f" {hashlib.sha256(content).hexdigest()} {len(content)} {name}\n"
+        for name, content in (("Packages", packages_file), ("Packages.gz", packages_gz))
+    )
+    release = (
+        f"Origin: {current_app.config['APT_ORIGIN']}\n"
+        f"Label: {course.name}\n"
+        f"Date: {utcnow().strftime('%a, %d %b %Y %H:%M:%S UTC')}\n"
+        f"Architectures: {' '.join(architectures) or 'all'}\n"
+        f"SHA256:\n{checksums}"
+    )
+    _write_if_changed(os.path.join(folder, "Release"), release.encode())
+    return True
+
+
+@task("rebuild_apt_index")
+def rebuild_apt_index(course_id):
+    course = db.session.get(Course, course_id)
+    if course is not None:
+        build_course_index(course)
+
+
+@package_indexed.connect
+def _schedule_rebuild(package):
+    # Only the course of the changed package needs a new index
+    enqueue("rebuild_apt_index", course_id=package.course_id)
+
+
+@event.listens_for(Session, "after_flush")
+def _schedule_left_courses(session, flush_context):
+    """Rebuild the courses a flushed package was deleted from or left."""
+    course_ids = set()
+    for obj in session.dirty | session.deleted:
+        if not isinstance(obj, Package):
+            continue
+        if obj in session.deleted:
+            course_ids.add(obj.course_id)
+        else:
+            course_ids.update(inspect(obj).attrs.course_id.history.deleted)
+
+    for course_id in sorted(course_ids - {None}):
+        enqueue_on_commit(session, "rebuild_apt_index", course_id=course_id)
+
+
+@click.group("apt", help="Manage the APT repository indexes of the courses.")
+def apt_cli():
+    pass
+
+
+@apt_cli.command("rebuild")
+@click.argument("courses", nargs=-1)
+@with_appcontext
+def rebuild_command(courses):
+    """Rebuild the indexes of the given courses (all of them by default)."""
+    query = Course.query.order_by(Course.name)
+    if courses:
+        query = query.filter(Course.name.in_(courses))
+
+    for course in query.all():
+        state = "updated" if build_course_index(course) else "unchanged"
+        click.echo(f"{course.name}: {state}")
@@ -0,0 +1,253 @@
+"""
+Optional ASGI server for exercise downloads.
+
+The Flask views keep doing the authentication and the form handling: once an
+exercise has been chosen, "handle_download" redirects the browser to this app
+with a short-lived signed token. The transfer itself then runs on an asyncio
+event loop, so hundreds of slow clients only cost a few open file handles
+instead of one WSGI worker each.
+
+Run it next to the Flask app with any ASGI server, e.g.:
+    uvicorn asgi:application --port 8001
+"""
+
+import asyncio
+import os
+import time
+from urllib.parse import quote
+
+from flask import current_app
+from flask_security import current_user
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+TOKEN_SALT = "exercise-download"
+
+
+def _serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT)
+
+
+def issue_download_token(exercise):
+    """Sign the exercise id and the requesting user for the async download server."""
+    user_id = getattr(current_user, "user_id", None)
+    return _serializer(current_app.config["SECRET_KEY"]).dumps(
+        {"exercise_id": exercise.exercise_id, "user_id": user_id}
+    )
+
+
+class Throttle:
+    """Token bucket capping the bandwidth of a single client (bytes per second)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.allowance = rate
+        self.last_check = time.monotonic()
+        self.users = 0
+
+    async def consume(self, nbytes):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.allowance = min(
+            self.rate, self.allowance + (now - self.last_check) * self.rate
+        )
+        self.last_check = now
+        self.allowance -= nbytes
+        # Went into debt: sleep until the bucket is back to zero
+        if self.allowance < 0:
+            await asyncio.sleep(-self.allowance / self.rate)
+
+
+class Slot(asyncio.Semaphore):
+    """The concurrent transfers of one exercise."""
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.users = 0  # requests holding or waiting for the slot
+
+
+class AsyncDownloadApp:
+    """ASGI application serving "GET /<token>" as an exercise file attachment."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        self.serializer = _serializer(config["SECRET_KEY"])
+        self.max_age = config["ASYNC_DOWNLOAD_TOKEN_MAX_AGE"]
+        self.chunk_size = config["ASYNC_DOWNLOAD_CHUNK_SIZE"]
+        self.rate_limit = config["ASYNC_DOWNLOAD_RATE_LIMIT"]
+        self.max_per_exercise = config["ASYNC_DOWNLOAD_MAX_PER_EXERCISE"]
+        self.queue_timeout = config["ASYNC_DOWNLOAD_QUEUE_TIMEOUT"]
+
+        # Both dictionaries are only touched from the event loop, so no locks
+        self.slots = {}  # exercise_id -> Slot
+        self.throttles = {}  # client key -> Throttle
+        self.active_transfers = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+
+        if scope["method"] not in ("GET", "HEAD"):
+            return await self._error(send, 405, "Method not allowed")
+
+        token = scope["path"].strip("/")
+        try:
+            claims = self.serializer.loads(token, max_age=self.max_age)
+        except SignatureExpired:
+            return await self._error(send, 410, "Download link expired")
+        except BadSignature:
+            return await self._error(send, 403, "Invalid download link")
+
+        # The database lookup is blocking, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        accept_encoding = dict(scope.get("headers", ())).get(b"accept-encoding", b"")
+        path, filename, encoding, vary = await loop.run_in_executor(
+            None,
+            self._resolve_path,
+            claims["exercise_id"],
+            parse_accept_header(accept_encoding.decode("latin-1"), Accept),
+        )
+        if path is None or not os.path.isfile(path):
+            return await self._error(send, 404, "Exercise not found")
+
+        exercise_id = claims["exercise_id"]
+        slot = self.slots.get(exercise_id)
+        if slot is None:
+            slot = self.slots[exercise_id] = Slot(self.max_per_exercise)
+        slot.users += 1
+        try:
+            await asyncio.wait_for(slot.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._leave_slot(exercise_id, slot)
+            return await self._error(
+                send, 503, "Too many downloads", [(b"retry-after", b"5")]
+            )
+        except BaseException:
+            # The client went away while waiting
+            self._leave_slot(exercise_id, slot)
+            raise
+
+        client = claims["user_id"] or (scope.get("client") or ("?",))[0]
+        throttle = self.throttles.get(client)
+        if throttle is None:
+            throttle = self.throttles[client] = Throttle(self.rate_limit)
+        throttle.users += 1
+        self.active_transfers += 1
+        try:
+            await self._send_file(scope, send, path, filename, throttle, encoding, vary)
+        finally:
+            self.active_transfers -= 1
+            throttle.users -= 1
+            if not throttle.users:
+                del self.throttles[client]
+            slot.release()
+            self._leave_slot(exercise_id, slot)
+
+    def _leave_slot(self, exercise_id, slot):
+        # Forget the slots nobody uses, or there would be one per exercise ever served
+        slot.users -= 1
+        if not slot.users:
+            del self.slots[exercise_id]
+
+    def _resolve_path(self, exercise_id, accept_encodings):
+        """
+        The local path of the exercise's file (or of the pre-compressed variant
+        the client takes), its download name, the variant's encoding, and
+        whether the response varies with the Accept-Encoding.
+        """
+        from app.compression import negotiate
+        from app.extensions import db
+        from app.helpers import exercise_download_name, exercise_file_path
+        from app.models import Exercise
+
+        with self.flask_app.app_context():
+            exercise = db.session.get(Exercise, exercise_id)
+            if exercise is None:
+                return None, None, None, False
+            encoding = negotiate(exercise, accept_encodings)
+            try:
+                path = exercise_file_path(exercise, encoding)
+            except FileNotFoundError:
+                return None, None, None, False
+            vary = bool(exercise.encodings)
+            return path, exercise_download_name(exercise), encoding, vary
+
+    async def _send_file(
+        self, scope, send, path, filename, throttle, encoding=None, vary=False
+    ):
+        size = os.path.getsize(path)
+        filename = quote(filename)
+        headers = [
+            (b"content-type", b"application/octet-stream"),
+            (b"content-length", str(size).encode()),
+            (
+                b"content-disposition",
+                f"attachment; filename*=UTF-8''{filename}".encode(),
+            ),
+        ]
+        if encoding is not None:
+            headers.append((b"content-encoding", encoding.encode()))
+        if vary:
+            headers.append((b"vary", b"Accept-Encoding"))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        if scope["method"] == "HEAD":
+            return await send({"type": "http.response.body", "body": b""})
+
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as file:
+            # Servers implementing the zero-copy extension can use sendfile()
+            #   directly, as long as we don't need to pace the transfer
+            if "http.response.zerocopysend" in scope.get("extensions", {}) and (
+                not throttle.rate
+            ):
+                return await send({"type": "http.response.zerocopysend", "file": file})
+
+            while True:
+                chunk = await loop.run_in_executor(None, file.read, self.chunk_size)
+                if not chunk:
+                    break
+                await throttle.consume(len(chunk))
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def _error(send, status, message, headers=()):
+        body = message.encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                    *headers,
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(flask_app=None):
+    """Build the ASGI download app, sharing config and models with "flask_app"."""
+    if flask_app is None:
+        from app import create_app
+
+        flask_app = create_app()
+    return AsyncDownloadApp(flask_app)
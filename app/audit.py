@@ -0,0 +1,314 @@
+"""
+Audit trail of the sensitive actions: logins, password resets, uploads and
+downloads.
+
+Recording an event must not cost the request a write: events are appended to
+an in-memory buffer and a background thread writes them in batches, as soon
+as AUDIT_BATCH_SIZE events are waiting or the oldest one has waited
+AUDIT_FLUSH_INTERVAL seconds. The batches go to AUDIT_SINK:
+    database    the "audit_events" table, one multi-row INSERT per batch
+    ndjson      one JSON object per line in AUDIT_NDJSON_FOLDER/audit.ndjson,
+                rotated beyond AUDIT_NDJSON_MAX_BYTES
+
+The buffer is written out when the process exits normally (atexit) and when a
+server worker stops (app/server.py), so a graceful shutdown loses nothing. A
+full buffer (the sink is slower than the requests, or failing) is written by
+the request adding to it; only when that fails too are the oldest events
+dropped. Without the background thread the requests write the batches
+themselves, and an interval of 0 writes every event right away (tests).
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from datetime import datetime
+
+from flask import current_app, has_request_context, request
+from flask_login import current_user, user_logged_in, user_logged_out
+from sqlalchemy import insert
+
+from app.extensions import db
+from app.models import AuditEvent, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Every buffer of the process, to flush them at exit and reset them after fork
+_buffers = weakref.WeakSet()
+
+
+class DatabaseSink:
+    """Write the events to the "audit_events" table of the app's database."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def write(self, events):
+        rows = [dict(event, details=json.dumps(event["details"])) for event in events]
+        # A context of its own: never the session of the request being served
+        with self.app.app_context():
+            db.session.execute(insert(AuditEvent), rows)
+            db.session.commit()
+
+
+class NDJSONSink:
+    """
+    Append the events to audit.ndjson, one JSON object per line. The file is
+    renamed to audit-<time>-<pid>.ndjson once it reaches max_bytes, and only
+    the newest "backups" of those are kept (0 keeps them all).
+    """
+
+    def __init__(self, folder, max_bytes, backups=0):
+        self.folder = folder
+        self.path = os.path.join(folder, "audit.ndjson")
+        self.max_bytes = max_bytes
+        self.backups = backups
+        os.makedirs(folder, exist_ok=True)
+
+    def write(self, events):
+        data = "".join(
+            json.dumps(event, default=_isoformat, separators=(",", ":")) + "\n"
+            for event in events
+        ).encode()
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size and size + len(data) > self.max_bytes:
+            self.rotate()
+        # One write() in append mode: the lines of concurrent workers don't mix
+        with open(self.path, "ab") as file:
+            file.write(data)
+
+    def rotate(self):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        try:
+            os.rename(
+                self.path,
+                os.path.join(self.folder, f"audit-{stamp}-{os.getpid()}.ndjson"),
+            )
+        except FileNotFoundError:
+            # Another worker rotated it first
+            return
+        if self.backups:
+            rotated = sorted(
+                name
+                for name in os.listdir(self.folder)
+                if name.startswith("audit-") and name.endswith(".ndjson")
+            )
+            for name in rotated[: -self.backups]:
+                os.remove(os.path.join(self.folder, name))
+
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def create_sink(app):
+    sink = app.config["AUDIT_SINK"]
+    if sink == "database":
+        return DatabaseSink(app)
+    if sink == "ndjson":
+        return NDJSONSink(
+            app.config["AUDIT_NDJSON_FOLDER"],
+            app.config["AUDIT_NDJSON_MAX_BYTES"],
+            app.config["AUDIT_NDJSON_BACKUPS"],
+        )
+    raise ValueError(f"Unknown AUDIT_SINK: {sink}")
+
+
+class EventBuffer:
+    """
+    The events waiting to be written, and the thread writing them in batches.
+    Writes are serialized, so the events reach the sink in recording order.
+    """
+
+    def __init__(
+        self, sink, batch_size=500, interval=1.0, capacity=10_000, background=True
+    ):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.interval = interval
+        self.capacity = capacity
+        self.background = background
+        self.dropped = 0
+        self._reset()
+        _buffers.add(self)
+
+    def _reset(self):
+        self._events = deque()
+        self._oldest = None  # time.monotonic() of the first waiting event
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._events)
+
+    def put(self, event):
+        with self._condition:
+            if not self._events:
+                self._oldest = time.monotonic()
+            self._add(event)
+            size = len(self._events)
+            # The thread waits for a first event, then for a full batch
+            if size == 1 or size >= self.batch_size:
+                self._condition.notify()
+            due = time.monotonic() - self._oldest >= self.interval
+        if self._closed or size >= self.capacity:
+            # Nobody else will write them (soon enough)
+            self.flush()
+        elif self.background:
+            self._start()
+        elif size >= self.batch_size or due:
+            self.flush()
+
+    def _add(self, event):
+        self._events.append(event)
+
+    def _take(self):
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+    def flush(self):
+        """Write every waiting event. Return False if the sink failed."""
+        with self._write_lock:
+            with self._condition:
+                events = self._take()
+                self._oldest = None
+            try:
+                while events:
+                    self.sink.write(events[: self.batch_size])
+                    del events[: self.batch_size]
+            except Exception:
+                logger.exception("Could not write %s audit events", len(events))
+                self._requeue(events)
+                return False
+        return True
+
+    def _requeue(self, events):
+        with self._condition:
+            self._events.extendleft(reversed(events))
+            self._oldest = time.monotonic()
+            overflow = len(self._events) - self.capacity
+            for _ in range(max(overflow, 0)):
+                self._events.popleft()
+            if overflow > 0:
+                self.dropped += overflow
+                logger.error("Dropped %s audit events: buffer full", overflow)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(
+                    target=self._run, name="audit-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if len(self._events) >= self.batch_size:
+                        break
+                    timeout = None
+                    if self._events:
+                        timeout = self._oldest + self.interval - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+            if not self.flush():
+                # Give a failing sink some time before retrying
+                time.sleep(self.interval)
+
+    def close(self, timeout=10):
+        """Stop the thread and write what is left. Safe to call twice."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        if self._events:
+            self.flush()
+
+
+@atexit.register
+def _close_all():
+    for buffer in list(_buffers):
+        buffer.close()
+
+
+def _forget_parent_events():
+    # The parent still holds (and will write) its events, and its locks may
+    #   have been taken by a thread which doesn't exist in the child
+    for buffer in list(_buffers):
+        buffer._reset()
+
+
+os.register_at_fork(after_in_child=_forget_parent_events)
+
+
+class AuditLog:
+    """
+    Flask extension: the buffer of each app is kept in app.extensions["audit"].
+    """
+
+    def init_app(self, app):
+        app.extensions["audit"] = EventBuffer(
+            create_sink(app),
+            batch_size=app.config["AUDIT_BATCH_SIZE"],
+            interval=app.config["AUDIT_FLUSH_INTERVAL"],
+            capacity=app.config["AUDIT_BUFFER_SIZE"],
+            background=app.config["AUDIT_BACKGROUND_THREAD"],
+        )
+        user_logged_in.connect(_logged_in, app)
+        user_logged_out.connect(_logged_out, app)
+
+    def record(self, action, target=None, user=None, **details):
+        """
+        Queue an event about "user" (by default the logged in one). The
+        keyword arguments are stored as its JSON details.
+        """
+        if user is None and has_request_context() and current_user.is_authenticated:
+            user = current_user
+        current_app.extensions["audit"].put(
+            {
+                "created_at": utcnow(),
+                "action": action,
+                "user_id": user.user_id if user is not None else None,
+                "username": user.username if user is not None else None,
+                "ip": request.remote_addr if has_request_context() else None,
+                "target": target,
+                "details": details,
+            }
+        )
+
+    @staticmethod
+    def flush():
+        """Write the events of the current app now."""
+        return current_app.extensions["audit"].flush()
+
+
+audit_log = AuditLog()
+
+
+def _logged_in(app, user, **kwargs):
+    audit_log.record("login", user=user)
+
+
+def _logged_out(app, user, **kwargs):
+    if user is not None and user.is_authenticated:
+        audit_log.record("logout", user=user)
@@ -0,0 +1,449 @@
+"""
+Snapshots of the SQLite database and of the uploaded files, taken while the
+app runs, and their restoration.
+
+"flask backup create" writes a snapshot to BACKUP_FOLDER/<date-time>/:
+    database.sqlite3   copied with the online backup API of SQLite, a few
+                       pages (BACKUP_PAGES_PER_STEP) at a time with a pause
+                       (BACKUP_STEP_SLEEP) in between. In WAL mode the copy
+                       reads one snapshot and never blocks the workers. In
+                       the default rollback journal mode, the database is
+                       only locked for reading during each step, but every
+                       commit in between starts the copy over: the steps
+                       grow after each restart, up to the whole file, which
+                       makes writers wait for the length of the copy.
+    uploads/           the upload folder, as hard links to its files. The
+                       storage replaces files (copy_atomically) instead of
+                       writing into them, so a link keeps the content it
+                       had, and costs no copy. Across file systems, files
+                       are copied, or linked to the unchanged ones of the
+                       previous snapshot.
+    snapshot.json      the size and SHA-256 of every file. The hashes of the
+                       files unchanged since the previous snapshot are
+                       taken from its snapshot.json.
+The database is copied first: uploads write their file before committing
+the exercise, so every exercise of the copy has its file in the snapshot.
+A file re-uploaded in between has newer content than the copy knows of,
+which "verify" reports.
+
+"flask backup verify" checks a snapshot: the integrity of the database and
+the hashes of the files. "flask backup restore" verifies it, then copies it
+back over the live database, with the backup API again, and the upload
+folder. Only the "local" storage is snapshotted: buckets are versioned by
+their own store.
+"""
+
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app.extensions import db
+from app.storage import key_from_path, upload_path
+from app.tasks import file_sha256
+from config import basedir
+
+DATABASE = "database.sqlite3"
+UPLOADS = "uploads"
+MANIFEST = "snapshot.json"
+TEMPORARY = ".tmp-"
+
+
+class BackupError(Exception):
+    """Raised when a snapshot can't be taken, verified or restored."""
+
+
+def backup_folder():
+    return os.path.join(basedir, current_app.config["BACKUP_FOLDER"])
+
+
+def database_path():
+    """The file of the app's SQLite database."""
+    # In the tests, the engine is replaced by a connection: both have .engine
+    url = db.engine.engine.url
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise BackupError("Only SQLite database files can be backed up.")
+    return url.database
+
+
+class _Restarted(Exception):
+    pass
+
+
+def copy_database(source, target, pages, sleep):
+    """
+    Copy the SQLite database file "source" into "target", "pages" pages at
+    a time, sleeping "sleep" seconds between two steps. Return the size of
+    the copy in bytes.
+    """
+    source_connection = sqlite3.connect(source, timeout=30, isolation_level=None)
+    try:
+        (journal_mode,) = source_connection.execute("PRAGMA journal_mode").fetchone()
+        if journal_mode == "wal":
+            # Steps reading from one snapshot never restart, and writers
+            #   don't wait for readers in WAL mode
+            source_connection.execute("BEGIN")
+            source_connection.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        while True:
+            try:
+                return _copy_pages(source_connection, target, pages, sleep)
+            except _Restarted as restarted:
+                # A commit between two steps starts the copy over: take
+                #   bigger steps, up to the whole file at once
+                total = restarted.args[0]
+                pages = pages * 4 if 0 < pages * 4 < total else -1
+    finally:
+        source_connection.close()
+
+
+def _copy_pages(source_connection, target, pages, sleep):
+    left = None
+
+    def pause(status, remaining, total):
+        nonlocal left
+        if left is not None and remaining >= left:
+            raise _Restarted(total)
+        left = remaining
+        # Called between two steps, while the source isn't locked
+        if remaining:
+            time.sleep(sleep)
+
+    target_connection = sqlite3.connect(target, timeout=30)
+    try:
+        source_connection.backup(target_connection, pages=pages, progress=pause)
+        (page_size,) = target_connection.execute("PRAGMA page_size").fetchone()
+        (page_count,) = target_connection.execute("PRAGMA page_count").fetchone()
+        return page_size * page_count
+    finally:
+        target_connection.close()
+
+
+def journal_mode(path):
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        return connection.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def check_database(path):
+    """Raise BackupError unless the SQLite file passes its integrity check."""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in connection.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as error:
+        raise BackupError(f"{path}: {error}") from error
+    finally:
+        connection.close()
+    if problems != ["ok"]:
+        raise BackupError(f"{path}: " + "; ".join(problems[:5]))
+
+
+def walk_order(key):
+    """Sort key of the keys, in the order walk_files() yields them."""
+    return key.split("/")
+
+
+def walk_files(root, prefix=""):
+    """
+    The keys and paths of the files under "root", in name order (see
+    walk_order), in-progress ones left out.
+    """
+    with os.scandir(root) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.name.startswith(TEMPORARY):
+                continue
+            key = f"{prefix}{entry.name}"
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path, f"{key}/")
+            elif entry.is_file(follow_symlinks=False):
+                yield key, entry.path
+
+
+def _link_or_copy(source, target):
+    """Link "target" to "source", or copy it there from another file system."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def list_snapshots(folder=None):
+    """The paths of the complete snapshots, oldest first."""
+    folder = folder or backup_folder()
+    if not os.path.isdir(folder):
+        return []
+    return [
+        os.path.join(folder, name)
+        for name in sorted(os.listdir(folder))
+        if not name.startswith(".")
+        and os.path.exists(os.path.join(folder, name, MANIFEST))
+    ]
+
+
+def _read_manifest(snapshot):
+    try:
+        with open(os.path.join(snapshot, MANIFEST)) as file:
+            return json.load(file)
+    except (OSError, ValueError) as error:
+        raise BackupError(f"{snapshot}: unreadable {MANIFEST}: {error}") from error
+
+
+def _unchanged(entry, stat):
+    if entry is None:
+        return False
+    return entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+
+def _snapshot_files(uploads, previous):
+    """
+    Link the upload folder into "uploads". Return the manifest entries of
+    the files, and how many were hashed.
+    """
+    old_files = previous["files"] if previous else {}
+    files, hashed = {}, 0
+    for key, path in walk_files(upload_path()):
+        target = os.path.join(uploads, *key.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        old = old_files.get(key)
+        try:
+            os.link(path, target)
+        except OSError:
+            # Another file system: link to the previous snapshot if unchanged
+            if _unchanged(old, os.stat(path)):
+                os.link(
+                    os.path.join(previous["path"], UPLOADS, *key.split("/")), target
+                )
+            else:
+                shutil.copy2(path, target)
+        # The stat and the hash are those of the snapshot's file: the upload
+        #   may have been replaced since
+        stat = os.stat(target)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if _unchanged(old, stat):
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = file_sha256(target)
+            hashed += 1
+        files[key] = entry
+    return files, hashed
+
+
+def create_snapshot(folder=None):
+    """Take a snapshot into "folder" (BACKUP_FOLDER). Return its manifest."""
+    config = current_app.config
+    folder = folder or backup_folder()
+    os.makedirs(folder, exist_ok=True)
+    name = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    if os.path.exists(os.path.join(folder, name)):
+        name += datetime.datetime.now().strftime(".%f")
+    path = os.path.join(folder, name)
+    snapshots = list_snapshots(folder)
+    previous = None
+    if snapshots:
+        previous = {**_read_manifest(snapshots[-1]), "path": snapshots[-1]}
+
+    # Written aside, then renamed: a snapshot is complete or absent
+    tmp_path = os.path.join(folder, f"{TEMPORARY}{name}")
+    os.makedirs(tmp_path)
+    try:
+        start = time.perf_counter()
+        database = os.path.join(tmp_path, DATABASE)
+        size = copy_database(
+            database_path(),
+            database,
+            config["BACKUP_PAGES_PER_STEP"],
+            config["BACKUP_STEP_SLEEP"],
+        )
+        check_database(database)
+        database_seconds = time.perf_counter() - start
+
+        files, hashed = {}, 0
+        if config["STORAGE_BACKEND"] == "local":
+            uploads = os.path.join(tmp_path, UPLOADS)
+            os.makedirs(uploads)
+            files, hashed = _snapshot_files(uploads, previous)
+        manifest = {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "database": {"size": size, "sha256": file_sha256(database)},
+            "files": files,
+            "stats": {
+                "database_seconds": round(database_seconds, 3),
+                "seconds": round(time.perf_counter() - start, 3),
+                "hashed": hashed,
+                "journal_mode": journal_mode(database_path()),
+            },
+        }
+        with open(os.path.join(tmp_path, MANIFEST), "w") as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return {**manifest, "path": path}
+
+
+def verify_snapshot(snapshot):
+    """
+    Check a snapshot. Raise BackupError if it is damaged, return the
+    warnings otherwise: the exercise files re-uploaded while it was taken.
+    """
+    manifest = _read_manifest(snapshot)
+    database = os.path.join(snapshot, DATABASE)
+    if not os.path.exists(database):
+        raise BackupError(f"{snapshot}: no {DATABASE}")
+    check_database(database)
+    if file_sha256(database) != manifest["database"]["sha256"]:
+        raise BackupError(f"{database}: the checksum doesn't match")
+
+    errors = []
+    for key, entry in manifest["files"].items():
+        path = os.path.join(snapshot, UPLOADS, *key.split("/"))
+        if not os.path.exists(path):
+            errors.append(f"{key}: missing")
+        elif file_sha256(path) != entry["sha256"]:
+            errors.append(f"{key}: the checksum doesn't match")
+    if errors:
+        raise BackupError(f"{snapshot}: " + "; ".join(errors))
+
+    warnings = []
+    if not manifest["files"]:
+        return warnings
+    connection = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    try:
+        rows = connection.execute(
+            "SELECT number, exercise_path, sha256 FROM exercises"
+        ).fetchall()
+    finally:
+        connection.close()
+    for number, exercise_path, sha256 in rows:
+        entry = manifest["files"].get(key_from_path(exercise_path))
+        if entry is None:
+            raise BackupError(f"{snapshot}: no file for exercise {number}")
+        if sha256 and entry["sha256"] != sha256:
+            warnings.append(f"exercise {number}: the file was replaced meanwhile")
+    return warnings
+
+
+def restore_snapshot(snapshot, database=None):
+    """
+    Copy a verified snapshot over the database (the app's unless given) and
+    the upload folder. The files uploaded since are left where they are.
+    """
+    config = current_app.config
+    verify_snapshot(snapshot)
+    manifest = _read_manifest(snapshot)
+    copy_database(
+        os.path.join(snapshot, DATABASE),
+        database or database_path(),
+        config["BACKUP_PAGES_PER_STEP"],
+        config["BACKUP_STEP_SLEEP"],
+    )
+    for key in manifest["files"]:
+        source = os.path.join(snapshot, UPLOADS, *key.split("/"))
+        target = upload_path(*key.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Swapped in whole, like the storage writes them
+        tmp_path = os.path.join(os.path.dirname(target), f"{TEMPORARY}restore")
+        _link_or_copy(source, tmp_path)
+        os.replace(tmp_path, target)
+    return manifest
+
+
+def _rate(size, seconds):
+    return f"{size / 1024**2 / max(seconds, 1e-6):.1f} MiB/s"
+
+
+@click.group("backup", help="Take and restore snapshots of the data.")
+def backup_cli():
+    pass
+
+
+@backup_cli.command("create")
+@with_appcontext
+def create_command():
+    """Snapshot the database and the uploaded files, without stopping the app."""
+    try:
+        manifest = create_snapshot()
+    except BackupError as error:
+        raise click.ClickException(str(error))
+    stats, size = manifest["stats"], manifest["database"]["size"]
+    files = sum(entry["size"] for entry in manifest["files"].values())
+    click.echo(f"Snapshot {manifest['path']}")
+    if stats["journal_mode"] != "wal":
+        click.echo(
+            "The database isn't in WAL mode: commits may have waited for the copy "
+            '(enable it with "PRAGMA journal_mode=WAL").',
+            err=True,
+        )
+    click.echo(
+        f"Database: {size / 1024**2:.1f} MiB in {stats['database_seconds']:.2f}s "
+        f"({_rate(size, stats['database_seconds'])})"
+    )
+    file_seconds = stats["seconds"] - stats["database_seconds"]
+    click.echo(
+        f"Files: {len(manifest['files'])} ({files / 1024**2:.1f} MiB, "
+        f"{stats['hashed']} hashed) in {file_seconds:.2f}s "
+        f"({_rate(files, file_seconds)})"
+    )
+
+
+@backup_cli.command("list")
+@with_appcontext
+def list_command():
+    """Show the snapshots, oldest first."""
+    for snapshot in list_snapshots():
+        manifest = _read_manifest(snapshot)
+        size = manifest["database"]["size"] + sum(
+            entry["size"] for entry in manifest["files"].values()
+        )
+        click.echo(
+            f"{os.path.basename(snapshot)}  {len(manifest['files'])} files, "
+            f"{size / 1024**2:.1f} MiB"
+        )
+
+
+def _snapshot_path(name):
+    path = name if os.path.isdir(name) else os.path.join(backup_folder(), name)
+    if not os.path.isdir(path):
+        raise click.ClickException(f"No snapshot {name}.")
+    return path
+
+
+@backup_cli.command("verify")
+@click.argument("snapshot")
+@with_appcontext
+def verify_command(snapshot):
+    """Check the database and the files of a snapshot."""
+    try:
+        warnings = verify_snapshot(_snapshot_path(snapshot))
+    except BackupError as error:
+        raise click.ClickException(str(error))
+    for warning in warnings:
+        click.echo(warning, err=True)
+    click.echo("The snapshot is intact.")
+
+
+@backup_cli.command("restore")
+@click.argument("snapshot")
+@click.confirmation_option(
+    prompt="This replaces the database and the uploaded files. Continue?"
+)
+@with_appcontext
+def restore_command(snapshot):
+    """Put a snapshot back in place of the database and the uploaded files."""
+    start = time.perf_counter()
+    try:
+        manifest = restore_snapshot(_snapshot_path(snapshot))
+    except BackupError as error:
+        raise click.ClickException(str(error))
+    click.echo(
+        f"Restored the database and {len(manifest['files'])} files "
+        f"in {time.perf_counter() - start:.2f}s."
+    )
@@ -0,0 +1,175 @@
+"""
+Pre-compressed variants of the exercise files.
+
+Once an upload has been post-processed ("exercise_processed"), a file with one
+of the COMPRESSION_EXTENSIONS and a size between COMPRESSION_MIN_SIZE and
+COMPRESSION_MAX_SIZE is compressed with each of the COMPRESSION_ENCODINGS, and
+the results are stored next to it as "<key>.zst" and "<key>.gz". A variant is
+kept only when it saves COMPRESSION_MIN_SAVING of the size at least: the
+encodings kept are listed in Exercise.encodings.
+
+The downloads sent by the app pick the variant preferred by the Accept-Encoding
+of the request, and send its bytes as they are with a Content-Encoding header:
+nothing is compressed while a student waits. zstd needs the "zstandard"
+package, and is skipped without it.
+"""
+
+import functools
+import gzip
+import logging
+import posixpath
+import shutil
+import tempfile
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app.extensions import db
+from app.models import Exercise
+from app.storage import CHUNK_SIZE, get_storage
+from app.tasks import exercise_processed
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the stored variants, by content coding
+SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+
+
+@functools.cache
+def supported(encoding):
+    """Whether this process can compress with "encoding"."""
+    if encoding == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            logger.info("zstandard is not installed: no zstd variants")
+            return False
+        return True
+    return encoding in SUFFIXES
+
+
+def variant_key(key, encoding):
+    """The storage key of the "encoding" variant of the file "key"."""
+    return key + SUFFIXES[encoding]
+
+
+def compress(encoding, source, target, level):
+    """Compress the stream "source" into the file "target"."""
+    if encoding == "gzip":
+        # No timestamp: the same file always gives the same bytes
+        with gzip.GzipFile(
+            fileobj=target, mode="wb", compresslevel=level, mtime=0
+        ) as file:
+            shutil.copyfileobj(source, file, CHUNK_SIZE)
+    elif encoding == "zstd":
+        import zstandard
+
+        zstandard.ZstdCompressor(level=level).copy_stream(source, target)
+    else:
+        raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def compressible(exercise):
+    config = current_app.config
+    extension = posixpath.splitext(exercise.exercise_path or "")[1][1:].lower()
+    return (
+        extension in config["COMPRESSION_EXTENSIONS"]
+        and exercise.size is not None
+        and config["COMPRESSION_MIN_SIZE"]
+        <= exercise.size
+        <= config["COMPRESSION_MAX_SIZE"]
+    )
+
+
+def compress_exercise(exercise):
+    """
+    Store the variants of the file of an exercise worth keeping, delete the
+    others, and list them in exercise.encodings. Return the encodings.
+    """
+    from app.helpers import exercise_file_path, exercise_key
+
+    config = current_app.config
+    storage = get_storage()
+    key = exercise_key(exercise)
+    encodings = []
+    if compressible(exercise):
+        path = exercise_file_path(exercise)
+        for encoding in config["COMPRESSION_ENCODINGS"]:
+            if not supported(encoding):
+                continue
+            with open(path, "rb") as source, tempfile.TemporaryFile() as target:
+                compress(
+                    encoding, source, target, config["COMPRESSION_LEVELS"][encoding]
+                )
+                if target.tell() > exercise.size * (
+                    1 - config["COMPRESSION_MIN_SAVING"]
+                ):
+                    continue
+                target.seek(0)
+                storage.save(variant_key(key, encoding), target)
+            encodings.append(encoding)
+
+    # Variants of an earlier upload would be sent for the new file
+    for encoding in SUFFIXES.keys() - set(encodings):
+        try:
+            storage.delete(variant_key(key, encoding))
+        except FileNotFoundError:
+            pass
+    exercise.encodings = " ".join(encodings) or None
+    return encodings
+
+
+@exercise_processed.connect
+def _compress_processed_exercise(exercise):
+    compress_exercise(exercise)
+    db.session.commit()
+
+
+def negotiate(exercise, accept_encodings):
+    """
+    The encoding of the variant to send for "accept_encodings" (the parsed
+    Accept-Encoding of the request), or None to send the file itself. The
+    client's qualities decide, then the order of COMPRESSION_ENCODINGS.
+    """
+    best, best_quality = None, 0
+    for encoding in (exercise.encodings or "").split():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+@click.group("compression", help="Manage the pre-compressed exercise files.")
+def compression_cli():
+    pass
+
+
+@compression_cli.command("backfill")
+@click.option(
+    "--all", "recompress", is_flag=True, help="Compress the files with variants too."
+)
+@with_appcontext
+def backfill_command(recompress):
+    """Compress the exercises processed before the variants existed."""
+    query = Exercise.query.filter(Exercise.size.isnot(None))
+    if not recompress:
+        query = query.filter(Exercise.encodings.is_(None))
+
+    compressed = failed = 0
+    for exercise in query.all():
+        if not compressible(exercise):
+            continue
+        try:
+            compress_exercise(exercise)
+        except OSError as error:
+            failed += 1
+            click.echo(f"{exercise.exercise_path}: {error}", err=True)
+            continue
+        compressed += 1
+        # Commit in batches to keep the transaction short
+        if compressed % 100 == 0:
+            db.session.commit()
+    db.session.commit()
+
+    click.echo(f"{compressed} exercises compressed, {failed} failed.")
@@ -0,0 +1,124 @@
+"""
+Pure Python reader for the metadata of Debian binary packages (.deb).
+
+A .deb is an "ar" archive holding "debian-binary", "control.tar.*" and
+"data.tar.*": only the "control" file inside the control tarball is read, so
+neither dpkg nor the package payload are needed.
+"""
+
+import io
+import re
+import tarfile
+
+AR_MAGIC = b"!<arch>\n"
+AR_HEADER_SIZE = 60
+
+
+class DebError(ValueError):
+    pass
+
+
+def iter_ar_members(file):
+    """Yield (name, data) for every member of an ar archive."""
+    if file.read(len(AR_MAGIC)) != AR_MAGIC:
+        raise DebError("Not an ar archive")
+
+    while True:
+        header = file.read(AR_HEADER_SIZE)
+        if not header:
+            return
+        if len(header) < AR_HEADER_SIZE or header[58:60] != b"`\n":
+            raise DebError("Truncated or corrupted ar header")
+
+        try:
+            name = header[0:16].decode("ascii").strip().rstrip("/")
+            size = int(header[48:58].decode("ascii").strip())
+        except ValueError as error:
+            # Not ASCII (UnicodeDecodeError is a ValueError), or not a number
+            raise DebError(f"Corrupted ar header: {error}") from error
+        data = file.read(size)
+        if len(data) < size:
+            raise DebError(f"Truncated ar member {name!r}")
+        # Members are aligned on even offsets
+        if size % 2:
+            file.read(1)
+        yield name, data
+
+
+def parse_control(text):
+    """Parse a deb822 control paragraph into a dictionary of fields."""
+    fields = {}
+    key = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if line[0] in " \t" and key:
+            # Continuation of a multi-line field (e.g. Description)
+            fields[key] += "\n" + line.strip()
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            key = key.strip()
+            fields[key] = value.strip()
+        else:
+            raise DebError(f"Invalid control line {line!r}")
+    return fields
+
+
+def read_control(file):
+    """Return the control fields of the .deb package opened as "file"."""
+    for name, data in iter_ar_members(file):
+        if not name.startswith("control.tar"):
+            continue
+        try:
+            # "r:*" detects gzip, xz, bzip2 and uncompressed tarballs
+            with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as control_tar:
+                for member in control_tar.getmembers():
+                    if member.name in ("control", "./control"):
+                        text = control_tar.extractfile(member).read()
+                        return parse_control(text.decode("utf-8"))
+        except tarfile.TarError as error:
+            raise DebError(f"Unreadable {name}: {error}") from error
+        except UnicodeDecodeError as error:
+            raise DebError(f"The control file isn't UTF-8: {error}") from error
+        raise DebError(f"No control file in {name}")
+    raise DebError("No control.tar member found")
+
+
+_VERSION_PART = re.compile(r"(\D*)(\d*)")
+
+
+def _order(char):
+    # dpkg ordering: "~" sorts before everything (even the end of the part),
+    #   then letters, then all the other characters
+    if char == "~":
+        return 1
+    if char.isalpha():
+        return 3 + ord(char)
+    return 3 + 256 + ord(char)
+
+
+def _encode_part(text):
+    encoded = []
+    for non_digits, digits in _VERSION_PART.findall(text):
+        if not (non_digits or digits):
+            continue
+        encoded.extend(chr(_order(char) + 0x20) for char in non_digits)
+        # End of the non-digit run (sorts after "~", before any character)
+        encoded.append(chr(2 + 0x20))
+        number = digits.lstrip("0")
+        encoded.append(chr(len(number) + 0x30) + number)
+    encoded.append(chr(2 + 0x20))
+    return "".join(encoded)
+
+
+def version_sort_key(version):
+    """
+    Encode a Debian version as a string that sorts like "dpkg --compare-versions",
+    so that the newest version can be found with a plain ORDER BY / MAX().
+    """
+    epoch, _, rest = version.partition(":") if ":" in version else ("0", "", version)
+    upstream, _, revision = rest.rpartition("-") if "-" in rest else (rest, "", "0")
+    epoch = epoch.lstrip("0")
+    return "".join(
+        [chr(len(epoch) + 0x30) + epoch, _encode_part(upstream), _encode_part(revision)]
+    )
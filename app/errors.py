@@ -10,6 +10,15 @@ def register_error_handlers(app):
     def page_not_found(e):
         return render_template("errors/404.html"), 404
 
+    # Keep the Retry-After header of the rate and concurrency limits
+    @app.errorhandler(429)
+    def too_many_requests(e):
+        return render_template("errors/429.html"), 429, e.get_headers()
+
+    @app.errorhandler(503)
+    def service_unavailable(e):
+        return render_template("errors/503.html"), 503, e.get_headers()
+
     @app.errorhandler(500)
     def internal_server_error(e):
         return render_template("errors/500.html"), 500
@@ -0,0 +1,273 @@
+"""
+Notifications of the changes to the exercises of a course.
+
+The manifest of a course (app/manifests.py) changes with its exercises: an
+upload by "save_exercise_file", the checksum "process_exercise" computes
+afterwards, a change of visibility... Once the change is committed, the new
+digest is published to the broker of the app, which wakes up the clients
+waiting on that course, and only them:
+
+    GET /api/courses/<id>/events          Server-Sent Events, when asked
+        for with "Accept: text/event-stream": a "manifest" event per change,
+        with the digest as its id. Browsers' EventSource reconnect on their
+        own after EVENTS_STREAM_SECONDS, sending Last-Event-ID.
+    GET /api/courses/<id>/events?since=<digest>    long polling: the digest
+        as soon as it differs from "since", or 204 after
+        EVENTS_LONG_POLL_SECONDS.
+
+Clients fetch /api/manifest, or sync (app/sync.py), only when told to.
+Every open stream or poll holds a worker thread: the "events" slots of
+RATELIMIT_CONCURRENCY cap them, and streams are closed after a while so
+that the slots go round.
+
+Brokers (EVENTS_BROKER):
+    local     the changes committed by this process only: one worker, tests
+    database  also reads the digests of the courses being waited on from
+              the "course_manifests" table every EVENTS_POLL_INTERVAL
+              seconds, in one query per process whatever the number of
+              clients, to see the changes committed by the other workers
+              and by the job workers
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import Response, current_app, has_app_context, jsonify, request
+from sqlalchemy import select
+
+from app.extensions import db
+from app.manifests import course_manifests, manifest_published, manifests
+from app.ratelimit import limiter
+
+logger = logging.getLogger(__name__)
+
+EVENT_STREAM = "text/event-stream"
+
+
+class LocalBroker:
+    """
+    The latest digest of each course, and the clients waiting for the next.
+    Each change of a course is numbered: a client only wakes up on changes
+    numbered after the position it started from, never on a digest the
+    broker held before, which may be older than the client's.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._positions = Counter()
+        # One condition per course being waited on, so that a change only
+        #   wakes up the clients of its course
+        self._conditions = {}
+        self._waiting = Counter()
+
+    def publish(self, course_id, digest):
+        with self._lock:
+            if self._digests.get(course_id) == digest:
+                return
+            self._digests[course_id] = digest
+            self._positions[course_id] += 1
+            condition = self._conditions.get(course_id)
+            if condition is not None:
+                condition.notify_all()
+
+    def awaited(self):
+        """The ids of the courses clients are waiting on."""
+        with self._lock:
+            return list(self._waiting)
+
+    def position(self, course_id):
+        """
+        The number of changes of a course published so far. Taken before the
+        client reads its digest, it lets wait() see the changes in between.
+        """
+        with self._lock:
+            return self._positions[course_id]
+
+    def _changed(self, course_id, digest, after):
+        return self._positions[course_id] > after and self._digests[course_id] != digest
+
+    def wait(self, course_id, digest, timeout, after=None):
+        """
+        Wait at most "timeout" seconds for a change of a course, published
+        after the position "after" (now by default), to a digest other than
+        "digest", the one the client has. Return the new digest and its
+        position, or None.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if after is None:
+                after = self._positions[course_id]
+            if self._changed(course_id, digest, after):
+                return self._digests[course_id], self._positions[course_id]
+            condition = self._conditions.get(course_id)
+            if condition is None:
+                condition = self._conditions[course_id] = threading.Condition(
+                    self._lock
+                )
+            self._waiting[course_id] += 1
+            self._watch()
+            try:
+                while not self._changed(course_id, digest, after):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    condition.wait(remaining)
+                return self._digests[course_id], self._positions[course_id]
+            finally:
+                self._waiting[course_id] -= 1
+                if not self._waiting[course_id]:
+                    del self._waiting[course_id]
+                    del self._conditions[course_id]
+
+    def _watch(self):
+        """Called with the lock held when a client starts waiting."""
+
+
+class DatabaseBroker(LocalBroker):
+    """
+    A LocalBroker also polling the manifests of the awaited courses, from a
+    thread running while there are clients waiting.
+    """
+
+    def __init__(self, app, interval):
+        super().__init__()
+        self.app = app
+        self.interval = interval
+        self._poller = None
+
+    def _watch(self):
+        # Started in the worker, never inherited from a fork
+        if self._poller is None or not self._poller.is_alive():
+            self._poller = threading.Thread(
+                target=self._run, name="events-poller", daemon=True
+            )
+            self._poller.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            course_ids = self.awaited()
+            if not course_ids:
+                with self._lock:
+                    if not self._waiting:
+                        self._poller = None
+                        return
+                continue
+            try:
+                self.poll(course_ids)
+            except Exception:
+                logger.exception("Polling the course manifests failed")
+
+    def poll(self, course_ids):
+        """Publish the digests of "course_ids" stored in the database."""
+        with self.app.app_context():
+            rows = db.session.execute(
+                select(manifests.c.course_id, manifests.c.digest).where(
+                    manifests.c.course_id.in_(course_ids)
+                )
+            ).all()
+        for course_id, digest in rows:
+            self.publish(course_id, digest)
+
+
+def create_broker(app):
+    kind = app.config["EVENTS_BROKER"]
+    if kind == "local":
+        return LocalBroker()
+    if kind == "database":
+        return DatabaseBroker(app, app.config["EVENTS_POLL_INTERVAL"])
+    raise ValueError(f"Unknown EVENTS_BROKER: {kind}")
+
+
+def init_events(app):
+    app.extensions["events"] = create_broker(app)
+
+
+def get_broker():
+    """The broker of the current app."""
+    return current_app.extensions["events"]
+
+
+@manifest_published.connect
+def _publish(course_id, digest):
+    # Commits outside of an app (scripts) have no one to notify
+    if has_app_context() and "events" in current_app.extensions:
+        get_broker().publish(course_id, digest)
+
+
+# Serving
+
+
+def _event(course_id, digest):
+    data = json.dumps({"course_id": course_id, "digest": digest})
+    return f"id: {digest}\nevent: manifest\ndata: {data}\n\n"
+
+
+def _stream(broker, course_id, digest, after, last_event_id, seconds, keepalive, retry):
+    deadline = time.monotonic() + seconds
+    yield f"retry: {int(retry * 1000)}\n\n"
+    if last_event_id != digest:
+        yield _event(course_id, digest)
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        changed = broker.wait(course_id, digest, min(remaining, keepalive), after)
+        if changed is None:
+            # Keeps the proxies from closing an idle connection
+            yield ": keepalive\n\n"
+        else:
+            digest, after = changed
+            yield _event(course_id, digest)
+
+
+def events_response(course):
+    """
+    The event stream of a course, or the answer to a long poll if the
+    client doesn't ask for a stream.
+    """
+    broker = get_broker()
+    course_id = course.course_id
+    # Before reading the digest: the changes committed meanwhile wake us up
+    after = broker.position(course_id)
+    [manifest] = course_manifests([course])
+    digest = manifest["digest"]
+    config = current_app.config
+    streaming = EVENT_STREAM in (value for value, _ in request.accept_mimetypes)
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    # Don't keep a connection of the pool while waiting
+    db.session.close()
+
+    if streaming:
+        response = Response(
+            _stream(
+                broker,
+                course_id,
+                digest,
+                after,
+                since,
+                config["EVENTS_STREAM_SECONDS"],
+                config["EVENTS_KEEPALIVE_SECONDS"],
+                config["EVENTS_RETRY_SECONDS"],
+            ),
+            mimetype=EVENT_STREAM,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        return limiter.hold("events", response)
+
+    if since == digest:
+        release = limiter.acquire("events")
+        try:
+            changed = broker.wait(
+                course_id, digest, config["EVENTS_LONG_POLL_SECONDS"], after
+            )
+        finally:
+            release()
+        if changed is None:
+            return Response(status=204)
+        digest, _ = changed
+    return jsonify(course_id=course_id, digest=digest)
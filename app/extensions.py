@@ -1,8 +1,38 @@
+import click
+from flask.cli import ScriptInfo
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
 
 db = SQLAlchemy()
 login_manager = LoginManager()
-migrate = Migrate()
+
+
+def init_migrate(app):
+    """
+    Set up Flask-Migrate and return its "db" command group.
+    It imports Alembic, which costs more than the rest of the app put
+    together, so it's only done when a "flask db" command actually runs.
+    """
+    from flask_migrate import Migrate
+    from flask_migrate.cli import db as db_cli_group
+
+    if "migrate" not in app.extensions:
+        Migrate(app, db)
+    return db_cli_group
+
+
+class MigrateGroup(click.Group):
+    """Stand-in for the "flask db" group, loading Flask-Migrate on first use."""
+
+    def _load(self, ctx):
+        return init_migrate(ctx.ensure_object(ScriptInfo).load_app())
+
+    def list_commands(self, ctx):
+        return self._load(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._load(ctx).get_command(ctx, name)
+
+
+migrate_cli = MigrateGroup("db", help="Perform database migrations.")
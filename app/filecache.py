@@ -0,0 +1,216 @@
+"""
+Bounded on-disk cache of the exercise files, in front of slow storage: the
+objects of an S3 bucket, or an UPLOAD_FOLDER on a network share.
+
+Entries are named after the storage key and a version of the content (its
+SHA-256 when known, else the ETag or mtime and size of the source), so a new
+upload never serves a stale copy and a hit costs no access to the storage.
+They are written to a temporary file and renamed: readers never see half a
+file, and the worker processes can share the folder.
+
+Eviction is least recently used, by bytes: a hit refreshes the mtime of the
+entry (at most once a minute), and once the folder outgrows FILE_CACHE_MAX_BYTES
+the oldest entries are deleted down to 90% of it. Hits, misses and evictions
+are counted per process ("flask cache stats", /api/cache).
+"""
+
+import hashlib
+import os
+import posixpath
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app.storage import copy_atomically
+
+# Seconds between two refreshes of the recency of an entry
+TOUCH_INTERVAL = 60
+# Eviction goes below the budget, so that it doesn't run on every miss
+LOW_WATERMARK = 0.9
+
+
+class FileCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self.bytes_fetched = 0
+        self._size = None  # bytes in the folder, as far as this process knows
+        self._lock = threading.Lock()
+        self._fetching = {}  # entry name -> lock, one fetch per entry at a time
+
+    def _entry(self, key, version):
+        # The extension is kept, for the MIME type of the responses
+        digest = hashlib.sha256(f"{key}\0{version}".encode()).hexdigest()[:40]
+        return digest + posixpath.splitext(key)[1]
+
+    def path(self, key, version, fetch):
+        """
+        Return the path of a local copy of "key" at "version", calling
+        fetch() for a readable stream of the content on a miss.
+        """
+        name = self._entry(key, version)
+        path = os.path.join(self.folder, name)
+        if self._hit(path):
+            return path
+
+        with self._lock:
+            fetch_lock = self._fetching.setdefault(name, threading.Lock())
+        with fetch_lock:
+            try:
+                # Another thread may have fetched it while we waited
+                if self._hit(path):
+                    return path
+                with fetch() as stream:
+                    size = copy_atomically(stream, path)
+            finally:
+                with self._lock:
+                    self._fetching.pop(name, None)
+            with self._lock:
+                self.misses += 1
+                self.bytes_fetched += size
+                if self._size is not None:
+                    self._size += size
+                over_budget = self._size is None or self._size > self.max_bytes
+        if over_budget:
+            self.evict(keep=path)
+        return path
+
+    def _hit(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        if now - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith(".tmp-") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries until under the budget."""
+        entries = sorted(self._scan())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size > self.max_bytes:
+            target = self.max_bytes * LOW_WATERMARK
+            for _, entry_size, path in entries:
+                if size <= target:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+                with self._lock:
+                    self.evictions += 1
+        with self._lock:
+            self._size = size
+
+    def clear(self):
+        for _, _, path in self._scan():
+            os.remove(path)
+        with self._lock:
+            self._size = 0
+
+    def stats(self):
+        entries = self._scan()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "bytes_fetched": self.bytes_fetched,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+                "pid": os.getpid(),
+            }
+
+
+def get_file_cache():
+    """The file cache of the current app, or None if it has none."""
+    return current_app.extensions.get("file_cache")
+
+
+def warm(window="24h", limit=50):
+    """Fetch the most downloaded exercises of the window into the cache."""
+    from app.analytics import top_exercises
+    from app.extensions import db
+    from app.helpers import exercise_file_path
+    from app.models import Exercise
+
+    warmed = 0
+    for top in top_exercises(window, limit=limit):
+        exercise = db.session.get(Exercise, top["exercise_id"])
+        if exercise is None:
+            continue
+        try:
+            exercise_file_path(exercise)
+        except FileNotFoundError:
+            continue
+        warmed += 1
+    return warmed
+
+
+@click.group("cache", help="Manage the cache of exercise files.")
+def cache_cli():
+    pass
+
+
+def _file_cache():
+    cache = get_file_cache()
+    if cache is None:
+        raise click.ClickException("The file cache is disabled (FILE_CACHE_LOCAL).")
+    return cache
+
+
+@cache_cli.command("stats")
+@with_appcontext
+def stats_command():
+    """Show the size of the cache."""
+    stats = _file_cache().stats()
+    click.echo(
+        f"{stats['entries']} files, {stats['bytes']} of {stats['max_bytes']} bytes"
+    )
+
+
+@cache_cli.command("warm")
+@click.option("--window", default="24h", show_default=True)
+@click.option("--limit", default=50, show_default=True)
+@with_appcontext
+def warm_command(window, limit):
+    """Fetch the most downloaded exercises into the cache."""
+    _file_cache()
+    click.echo(f"{warm(window, limit)} exercises cached.")
+
+
+@cache_cli.command("clear")
+@with_appcontext
+def clear_command():
+    """Delete every cached file."""
+    _file_cache().clear()
+    click.echo("Cache cleared.")
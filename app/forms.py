@@ -1,5 +1,3 @@
-import os
-
 from flask import current_app
 from flask_security import lookup_identity
 from flask_security.forms import LoginForm, RegisterForm
@@ -14,11 +12,18 @@ from wtforms import (
     StringField,
     SubmitField,
 )
-from wtforms.validators import DataRequired, EqualTo, Length, ValidationError
+from wtforms.validators import (
+    DataRequired,
+    EqualTo,
+    InputRequired,
+    Length,
+    ValidationError,
+)
 from wtforms_alchemy import QuerySelectField, QuerySelectMultipleField
 
 from app.models import Course, Role
-from config import Config, basedir
+from app.storage import get_storage
+from config import Config
 
 
 def username_validator(form, field):
@@ -74,6 +79,12 @@ class ExtendedLoginForm(LoginForm):
         return True
 
 
+class StudentLoginForm(FlaskForm):
+    username = StringField("Username", [InputRequired(), Length(min=4, max=20)])
+    password = PasswordField("Password", [InputRequired(), Length(min=8, max=20)])
+    submit = SubmitField("Login", render_kw={"class": "btn btn-primary"})
+
+
 class CourseSearchForm(FlaskForm):
     course_name = StringField("Course: ")
     selected_user = StringField("Exercise: ")
@@ -101,6 +112,4 @@ class UploadExerciseForm(FlaskForm):
         )
 
     def path_exists(self):
-        upload_path = os.path.join(basedir, Config.UPLOAD_FOLDER, self.courses.data)
-        print(upload_path)
-        return os.path.exists(upload_path)
+        return self.courses.data in get_storage().listdir()
@@ -1,11 +1,18 @@
+from app.analytics import analytics
+from app.audit import audit_log
+from app.compression import negotiate, variant_key
 from app.extensions import db
 from app.forms import UploadExerciseForm
-from app.models import Course, Exercise
-from flask import flash, session, send_file
-from config import basedir, Config
+from app.jobs import enqueue
+from app.manifests import course_exercises
+from app.models import Course, Exercise, User, UserCourse
+from app.ratelimit import limiter
+from flask import current_app, flash, redirect, request, session, send_file
+from app.storage import get_storage, key_from_path, storage_key
 from werkzeug.utils import secure_filename
+from dataclasses import dataclass
 import os
-import re
+import posixpath
 
 
 def process_download_form(download_form, courses):
@@ -25,35 +32,143 @@ def process_download_form(download_form, courses):
     if "selected_course" in session:
         # 1) Retrieve the selected course from the session
         selected_course = session["selected_course"]
-        # 2) Retrieve all exercises associated with the selected course and sort them by number
-        exercises = sorted(
-            Exercise.query.join(Course).filter(Course.name == selected_course).all(),
-            key=lambda exr: tuple(
-                int(part) if part.isdigit() else part
-                for part in re.findall(r"\d+|\D+", exr.number)
-            ),
-            reverse=False,
-        )
+        # 2) Read the exercises of the selected course from its manifest,
+        #   already sorted by number
+        exercises = course_exercises(selected_course)
     # Populate the number choices in the form with the sorted numbers
     # (empty list [] as default)
     download_form.exercise.choices = [
-        (exercise.number, exercise.number) for exercise in exercises
+        (exercise["number"], exercise["number"]) for exercise in exercises
     ]
 
     return exercises
 
 
+@dataclass
+class EnrollmentPage:
+    users: list  # (user_id, username), in enrollment order
+    has_previous: bool
+    has_next: bool
+
+    @property
+    def first_id(self):
+        return self.users[0][0] if self.users else None
+
+    @property
+    def last_id(self):
+        return self.users[-1][0] if self.users else None
+
+
+def enrollment_page(course, after=None, before=None, per_page=50):
+    """
+    One page of the students enrolled in "course", in user_id order, right
+    after or before the given user_id. The page is a range of the
+    (course_id, user_id) index: it costs the same at any depth and whatever
+    the size of the other courses.
+    """
+    query = (
+        db.select(UserCourse.user_id, User.username)
+        .join(User, User.user_id == UserCourse.user_id)
+        .where(UserCourse.course_id == course.course_id)
+    )
+    if before is not None:
+        query = query.where(UserCourse.user_id < before)
+        rows = db.session.execute(
+            query.order_by(UserCourse.user_id.desc()).limit(per_page + 1)
+        ).all()
+        users = [tuple(row) for row in reversed(rows[:per_page])]
+        return EnrollmentPage(users, len(rows) > per_page, True)
+
+    if after is not None:
+        query = query.where(UserCourse.user_id > after)
+    rows = db.session.execute(
+        query.order_by(UserCourse.user_id).limit(per_page + 1)
+    ).all()
+    users = [tuple(row) for row in rows[:per_page]]
+    return EnrollmentPage(users, after is not None, len(rows) > per_page)
+
+
+def exercise_key(exercise):
+    """Return the storage key of the file of an exercise."""
+    return key_from_path(exercise.exercise_path)
+
+
+def exercise_file_path(exercise, encoding=None):
+    """
+    Return a local path of the file stored for an exercise: a cached copy,
+    named after its content, when the storage has a file cache. With an
+    "encoding", the path of that pre-compressed variant of the file.
+    """
+    key = exercise_key(exercise)
+    if encoding is not None:
+        key = variant_key(key, encoding)
+    return get_storage().local_path(key, version=exercise.sha256)
+
+
+def exercise_download_name(exercise):
+    """Return the name under which the file of an exercise is downloaded."""
+    return posixpath.basename(exercise_key(exercise))
+
+
+def send_exercise_file(exercise, tag_version=False):
+    """
+    Send the file of an exercise as an attachment, as the pre-compressed
+    variant the client takes if there is one. With "tag_version", the ETag
+    is the SHA-256 of the file, suffixed with the encoding of a variant.
+    """
+    encoding = negotiate(exercise, request.accept_encodings)
+    etag = True
+    if tag_version and exercise.sha256:
+        etag = exercise.sha256 + (f".{encoding}" if encoding else "")
+    response = send_file(
+        path_or_file=exercise_file_path(exercise, encoding),
+        as_attachment=True,
+        download_name=exercise_download_name(exercise),
+        etag=etag,
+    )
+    if exercise.encodings:
+        response.vary.add("Accept-Encoding")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
 def handle_download(download_form):
 
     # If the form is submitted to initiate a download and the form data is valid...
     if download_form.submit.data and download_form.validate_on_submit():
         selected_exercise = download_form.exercise.data
+        # One client can't hog the workers with downloads
+        limiter.hit("download")
         # Retrieve the exercise corresponding to the selected number
         exercise = Exercise.query.filter_by(number=selected_exercise).first()
-        number_path = exercise.exercise_path
-        path = os.path.join(basedir, Config.UPLOAD_FOLDER, number_path)
-        # Send the exercise file to the user as an attachment for download
-        return send_file(path_or_file=path, as_attachment=True)
+        audit_log.record(
+            "exercise.download", target=f"{exercise.course.name}/{exercise.number}"
+        )
+
+        # Let the object store send the file when it can
+        if current_app.config["STORAGE_PRESIGNED_DOWNLOADS"]:
+            url = get_storage().url(exercise_key(exercise))
+            if url:
+                analytics.count_download(exercise)
+                return redirect(url)
+
+        # If the async download server is configured, hand the transfer over to it
+        # so that this worker is freed as soon as the redirect is sent
+        async_url = current_app.config.get("ASYNC_DOWNLOAD_URL")
+        if async_url:
+            from app.async_downloads import issue_download_token
+
+            token = issue_download_token(exercise)
+            analytics.count_download(exercise)
+            return redirect(f"{async_url.rstrip('/')}/{token}")
+
+        response = send_exercise_file(exercise)
+        # A 304 sends nothing, and sent=None would count the whole file
+        if response.status_code == 200:
+            analytics.count_download(exercise, sent=response.content_length)
+        # Cap the transfers in progress: a worker is busy until the end of each
+        return limiter.hold("transfer", response)
 
     return None
 
@@ -94,27 +209,40 @@ def save_exercise_file(upload_form, course_name, number):
         flash(f"Course {course_name} does not exist.")
         return False
 
-    course_folder = os.path.join(basedir, Config.UPLOAD_FOLDER, course_name)
-    filepath = os.path.join(course_folder, secure_filename(number.filename))
-    number.save(filepath)
+    key = storage_key(course_name, secure_filename(number.filename))
+    # Streamed: the upload is never held in memory
+    get_storage().save(key, number.stream)
 
     # Check if an exercise with the same number already exists
     existing_exercise = Exercise.query.filter_by(course=course, number=filename).first()
 
     if existing_exercise:
-        existing_exercise.exercise_path = filepath
+        existing_exercise.exercise_path = key
+        # The previous checksum and variants no longer match the file
+        existing_exercise.sha256 = existing_exercise.size = None
+        existing_exercise.encodings = None
         db.session.commit()
+        exercise = existing_exercise
         flash(
             f'The exercise "{number.filename}" has been successfully uploaded for the course "{course_name}".'
         )
     else:
-        new_exercise = Exercise(number=filename, course=course, exercise_path=filepath)
-        db.session.add(new_exercise)
+        exercise = Exercise(number=filename, course=course, exercise_path=key)
+        db.session.add(exercise)
         db.session.commit()
         flash(
-            f'The file "{number.filename}" has been uploaded into the folder "{basedir}/{Config.UPLOAD_FOLDER}/{course_name}/".'
+            f'The file "{number.filename}" has been uploaded into the folder "{course_name}/".'
         )
-    
+
+    audit_log.record(
+        "exercise.upload",
+        target=f"{course_name}/{exercise.number}",
+        replaced=existing_exercise is not None,
+    )
+
+    # Checksums and the other post-processing steps run in the background
+    enqueue("process_exercise", exercise_id=exercise.exercise_id)
+
     # Clear upload_form data after successful submission
     upload_form.courses.data = None
     upload_form.exercise.data = None
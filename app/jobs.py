@@ -0,0 +1,260 @@
+"""
+A small job queue stored in the application's database.
+
+Jobs are rows of the "jobs" table, so they survive restarts and can be shared
+by several worker processes ("flask jobs work"). For development a worker
+thread is started inside the web process on the first enqueue, and tests run
+the jobs inline (JOBS_INLINE).
+
+ORM events can't commit the session they are called from: they use
+"enqueue_on_commit", whose job is committed (and then run or handed to the
+worker) with the transaction being flushed.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import case, event, insert, update
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import Job, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Task name -> function, filled by the @task decorator
+TASKS = {}
+
+_worker_thread = None
+_worker_lock = threading.Lock()
+
+
+def task(name):
+    """Register a function as a job that can be enqueued by name."""
+
+    def decorator(func):
+        TASKS[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name, max_attempts=None, **payload):
+    """Store a new job and commit it, so that any worker can pick it up."""
+    if name not in TASKS:
+        raise KeyError(f"Unknown task {name!r}")
+
+    job = Job(
+        name=name,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts or current_app.config["JOBS_MAX_ATTEMPTS"],
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    if current_app.config["JOBS_INLINE"]:
+        run_job(job)
+    elif current_app.config["JOBS_BACKGROUND_THREAD"]:
+        start_worker_thread(current_app._get_current_object())
+
+    return job
+
+
+def enqueue_on_commit(session, name, max_attempts=None, **payload):
+    """Store a new job in the transaction being flushed, from an ORM event."""
+    if name not in TASKS:
+        raise KeyError(f"Unknown task {name!r}")
+
+    result = session.connection().execute(
+        insert(Job).values(
+            name=name,
+            payload=json.dumps(payload),
+            max_attempts=max_attempts or current_app.config["JOBS_MAX_ATTEMPTS"],
+        )
+    )
+    session.info.setdefault("enqueued_jobs", []).append(result.inserted_primary_key[0])
+
+
+@event.listens_for(Session, "after_commit")
+def _start_enqueued_jobs(session):
+    job_ids = session.info.pop("enqueued_jobs", None)
+    if not job_ids:
+        return
+
+    app = current_app._get_current_object()
+    if app.config["JOBS_INLINE"]:
+        # The committed session can't be used in this event: a new app
+        #   context runs the jobs with a session of its own
+        with app.app_context():
+            for job_id in job_ids:
+                run_job(db.session.get(Job, job_id))
+    elif app.config["JOBS_BACKGROUND_THREAD"]:
+        start_worker_thread(app)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_enqueued_jobs(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("enqueued_jobs", None)
+
+
+def claim_next_job():
+    """
+    Atomically mark the oldest due job as running and return it.
+    The conditional UPDATE makes sure that only one worker wins a given job.
+    """
+    now = utcnow()
+    lease = timedelta(seconds=current_app.config["JOBS_LEASE_SECONDS"])
+
+    # Jobs left "running" by a crashed worker go back to the queue, unless
+    #   they have used all their attempts: a job killing its worker (out of
+    #   memory...) would otherwise be claimed forever
+    out_of_attempts = Job.attempts >= Job.max_attempts
+    db.session.execute(
+        update(Job)
+        .where(Job.status == "running", Job.locked_at < now - lease)
+        .values(
+            status=case((out_of_attempts, "failed"), else_="queued"),
+            locked_at=None,
+            last_error=case(
+                (out_of_attempts, "The worker stopped while running the job."),
+                else_=Job.last_error,
+            ),
+        )
+    )
+
+    candidates = (
+        db.session.query(Job.job_id)
+        .filter(Job.status == "queued", Job.run_at <= now)
+        .order_by(Job.run_at)
+        .limit(5)
+        .all()
+    )
+    for (job_id,) in candidates:
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.job_id == job_id, Job.status == "queued")
+            .values(status="running", locked_at=now, attempts=Job.attempts + 1)
+        )
+        if claimed.rowcount == 1:
+            db.session.commit()
+            return db.session.get(Job, job_id)
+
+    db.session.commit()
+    return None
+
+
+def run_job(job):
+    """Run one claimed job, rescheduling it with a backoff if it fails."""
+    if job.status == "queued":
+        # Inline jobs have not been claimed by a worker
+        job.status = "running"
+        job.attempts += 1
+        db.session.commit()
+
+    try:
+        TASKS[job.name](**json.loads(job.payload))
+    except Exception:
+        db.session.rollback()
+        job.last_error = traceback.format_exc(limit=5)
+        if job.attempts < job.max_attempts:
+            job.status = "queued"
+            backoff = current_app.config["JOBS_RETRY_BACKOFF"] * 2 ** (job.attempts - 1)
+            job.run_at = utcnow() + timedelta(seconds=backoff)
+        else:
+            job.status = "failed"
+        logger.warning("Job %r failed (attempt %s)", job, job.attempts)
+    else:
+        job.status = "done"
+        job.last_error = None
+
+    job.locked_at = None
+    db.session.commit()
+    return job
+
+
+def work(app, poll_interval=1.0, stop_event=None, burst=False):
+    """Worker loop: claim and run jobs until stopped (or the queue is empty if burst)."""
+    with app.app_context():
+        while not (stop_event and stop_event.is_set()):
+            job = claim_next_job()
+            if job is not None:
+                run_job(job)
+                continue
+            if burst:
+                return
+            # Release the connection while idle
+            db.session.remove()
+            time.sleep(poll_interval)
+
+
+def start_worker_thread(app):
+    """Start the in-process worker thread once per process."""
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(
+                target=work,
+                args=(app, app.config["JOBS_POLL_INTERVAL"]),
+                name="jobs-worker",
+                daemon=True,
+            )
+            _worker_thread.start()
+
+
+@click.group("jobs", help="Manage the background job queue.")
+def jobs_cli():
+    pass
+
+
+@jobs_cli.command("work")
+@click.option("--processes", "-p", default=1, help="Number of worker processes.")
+@click.option("--burst", is_flag=True, help="Exit once the queue is empty.")
+@with_appcontext
+def work_command(processes, burst):
+    """Run queue workers in the foreground."""
+    from multiprocessing import get_context
+
+    poll_interval = current_app.config["JOBS_POLL_INTERVAL"]
+
+    if processes == 1:
+        return work(current_app._get_current_object(), poll_interval, burst=burst)
+
+    # Each process builds its own app, and with it its own database connections
+    db.engine.dispose()
+    context = get_context("fork" if hasattr(os, "fork") else "spawn")
+    workers = [
+        context.Process(target=_work_process, args=(poll_interval, burst))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def _work_process(poll_interval, burst):
+    from app import create_app
+
+    work(create_app(), poll_interval, burst=burst)
+
+
+@jobs_cli.command("status")
+@with_appcontext
+def status_command():
+    """Print how many jobs are in each status."""
+    rows = (
+        db.session.query(Job.status, db.func.count(Job.job_id))
+        .group_by(Job.status)
+        .all()
+    )
+    for status, count in rows:
+        click.echo(f"{status}: {count}")
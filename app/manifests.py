@@ -0,0 +1,240 @@
+"""
+Per-course manifests of the exercises: ids, numbers, file names, sizes,
+checksums and visibility, sorted by number, in the "course_manifests" table.
+
+A manifest is rebuilt in the transaction that changes the exercises of its
+course (an upload, the checksum computed by "process_exercise", a change of
+visibility in the admin...) by the ORM events at the bottom of this module.
+Reading the manifests of any number of courses is one query, and each
+process keeps them decoded by digest: the student pages never query the
+exercises. Rows written without the ORM are not seen: "flask manifests
+rebuild" recomputes every manifest, and courses without one are built on
+the fly in the meantime.
+
+Once the transaction is committed, "manifest_published" is sent with the
+id of each course whose manifest changed and its new digest: app/events.py
+pushes it to the clients waiting on the course.
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, event, inspect, insert, select
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import Course, CourseManifest, Exercise, utcnow
+from app.natsort import natural_key
+from app.tasks import signals
+
+exercises = Exercise.__table__
+manifests = CourseManifest.__table__
+
+# Attributes of an Exercise that change its course's manifest
+FIELDS = (
+    "number",
+    "size",
+    "sha256",
+    "flag_visible",
+    "exercise_path",
+    "course_id",
+    "course",
+)
+
+# Sent with the course_id and the new digest once a rebuilt manifest is committed
+manifest_published = signals.signal("manifest-published")
+
+# Decoded manifests of this process: course_id -> (digest, exercises)
+_decoded = {}
+
+
+def build_manifest(connection, course_id):
+    """Return the digest and JSON body of the manifest of a course."""
+    rows = connection.execute(
+        select(
+            exercises.c.exercise_id,
+            exercises.c.number,
+            exercises.c.size,
+            exercises.c.sha256,
+            exercises.c.flag_visible,
+            exercises.c.exercise_path,
+        ).where(exercises.c.course_id == course_id)
+    ).all()
+    entries = sorted(
+        (
+            {
+                "id": exercise_id,
+                "number": number or "",
+                "size": size,
+                "sha256": sha256,
+                "visible": bool(flag_visible),
+                # The name of the file in the course folder
+                "name": posixpath.basename((path or "").replace(os.sep, "/")),
+            }
+            for exercise_id, number, size, sha256, flag_visible, path in rows
+        ),
+        key=lambda entry: natural_key(entry["number"]),
+    )
+    body = json.dumps(entries, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()[:16], body
+
+
+def store_manifest(connection, course_id):
+    digest, body = build_manifest(connection, course_id)
+    connection.execute(delete(manifests).where(manifests.c.course_id == course_id))
+    connection.execute(
+        insert(manifests).values(
+            course_id=course_id, digest=digest, body=body, updated_at=utcnow()
+        )
+    )
+    return digest
+
+
+def _decode(course_id, digest, body):
+    cached = _decoded.get(course_id)
+    if cached is None or cached[0] != digest:
+        cached = (digest, json.loads(body))
+        _decoded[course_id] = cached
+    return cached[1]
+
+
+def course_manifests(courses):
+    """
+    The manifests of "courses", in the same order: dicts with the course_id,
+    the course name, the digest and the exercises.
+    """
+    courses = list(courses)
+    rows = {
+        row.course_id: row
+        for row in db.session.execute(
+            select(manifests.c.course_id, manifests.c.digest, manifests.c.body).where(
+                manifests.c.course_id.in_([course.course_id for course in courses])
+            )
+        )
+    }
+    result = []
+    for course in courses:
+        row = rows.get(course.course_id)
+        if row is None:
+            digest, body = build_manifest(db.session.connection(), course.course_id)
+        else:
+            digest, body = row.digest, row.body
+        result.append(
+            {
+                "course_id": course.course_id,
+                "course": course.name,
+                "digest": digest,
+                "exercises": _decode(course.course_id, digest, body),
+            }
+        )
+    return result
+
+
+def course_exercises(course_name):
+    """The manifest entries of the exercises of a course, by name."""
+    course = Course.query.filter_by(name=course_name).first()
+    if course is None:
+        return []
+    return course_manifests([course])[0]["exercises"]
+
+
+def manifests_etag(manifests_list):
+    """One ETag for a list of manifests: it changes when any of them does."""
+    digests = ",".join(
+        f"{manifest['course_id']}:{manifest['digest']}" for manifest in manifests_list
+    )
+    return hashlib.sha256(digests.encode()).hexdigest()[:32]
+
+
+# Rebuilding
+
+
+def _changed_exercise(session, obj):
+    if obj in session.dirty:
+        state = inspect(obj)
+        return any(state.attrs[field].history.has_changes() for field in FIELDS)
+    return isinstance(obj, Exercise)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_left_courses(session, flush_context, instances):
+    """
+    Note the courses the changed exercises are in before the flush: the
+    course they leave, if any, is not in the history once they were expired.
+    """
+    exercise_ids = [
+        obj.exercise_id
+        for obj in session.dirty | session.deleted
+        if isinstance(obj, Exercise)
+        and obj.exercise_id is not None
+        and (obj in session.deleted or _changed_exercise(session, obj))
+    ]
+    if exercise_ids:
+        session.info.setdefault("manifest_courses", set()).update(
+            session.connection().scalars(
+                select(exercises.c.course_id).where(
+                    exercises.c.exercise_id.in_(exercise_ids)
+                )
+            )
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _rebuild_changed_manifests(session, flush_context):
+    """
+    Rebuild the manifests of the courses whose exercises the flush changed.
+    The session still shows what was flushed, with the primary keys.
+    """
+    changed = session.info.pop("manifest_courses", set())
+    deleted = set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Course) and obj in session.deleted:
+            deleted.add(obj.course_id)
+        elif isinstance(obj, Exercise) and _changed_exercise(session, obj):
+            changed.add(obj.course_id)
+
+    connection = session.connection()
+    for course_id in deleted:
+        connection.execute(delete(manifests).where(manifests.c.course_id == course_id))
+    published = session.info.setdefault("published_manifests", {})
+    for course_id in sorted(changed - deleted - {None}):
+        published[course_id] = store_manifest(connection, course_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _send_published_manifests(session):
+    for course_id, digest in session.info.pop("published_manifests", {}).items():
+        manifest_published.send(course_id, digest=digest)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_published_manifests(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("published_manifests", None)
+
+
+def rebuild_manifests():
+    """Rebuild the manifest of every course. Return how many were built."""
+    connection = db.session.connection()
+    course_ids = db.session.scalars(select(Course.course_id)).all()
+    connection.execute(delete(manifests))
+    for course_id in course_ids:
+        store_manifest(connection, course_id)
+    db.session.commit()
+    return len(course_ids)
+
+
+@click.group("manifests", help="Manage the exercise manifests of the courses.")
+def manifests_cli():
+    pass
+
+
+@manifests_cli.command("rebuild")
+@with_appcontext
+def rebuild_command():
+    """Recompute the manifests of all the courses from the exercises."""
+    click.echo(f"{rebuild_manifests()} manifests rebuilt.")
@@ -1,12 +1,35 @@
 from app.extensions import db
 from flask_security import RoleMixin, UserMixin, SQLAlchemyUserDatastore
-from sqlalchemy import Boolean, Column, event, ForeignKey, Integer, String
-from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    event,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+)
+from sqlalchemy.orm import query_expression, relationship
+import json
 import uuid
 
 
+def utcnow():
+    # SQLite drops the timezone, so store naive UTC datetimes everywhere
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class UserRoles(db.Model):
     __tablename__ = "users_roles"
+    # Both ways: the roles of a user, the users of a role (Users admin filter)
+    __table_args__ = (
+        Index("ix_users_roles_user_role", "user_id", "role_id"),
+        Index("ix_users_roles_role_user", "role_id", "user_id"),
+    )
     id = Column(Integer(), primary_key=True)
     user_id = Column("user_id", Integer(), ForeignKey("users.user_id"))
     role_id = Column("role_id", Integer(), ForeignKey("roles.role_id"))
@@ -14,6 +37,12 @@ class UserRoles(db.Model):
 
 class UserCourse(db.Model):
     __tablename__ = "users_courses"
+    # Both ways: the courses of a user, the users of a course (read page by
+    #   page, see enrollment_page())
+    __table_args__ = (
+        Index("ix_users_courses_user_course", "user_id", "course_id"),
+        Index("ix_users_courses_course_user", "course_id", "user_id"),
+    )
     id = Column(Integer(), primary_key=True)
     user_id = Column(Integer(), ForeignKey("users.user_id"))
     course_id = Column(Integer(), ForeignKey("courses.course_id"))
@@ -25,6 +54,11 @@ class User(db.Model, UserMixin):
     username = Column(String(100), unique=True)
     password = Column(String(80))
     active = Column(Boolean())
+    # Users with the "application" role see the courses of their region
+    region = Column(String(50), index=True)
+    # Bumped whenever the permissions of the user change (see app/rbac.py),
+    #   which invalidates the permissions compiled into their session
+    rbac_version = Column(Integer, nullable=False, default=0)
     roles = relationship(
         "Role", secondary="users_roles", back_populates="users", lazy=True
     )
@@ -34,6 +68,10 @@ class User(db.Model, UserMixin):
         back_populates="users",
         lazy=True,
     )
+    # The names of the roles and courses, aggregated in SQL by the query of
+    #   the Users admin list (UserAdminView.get_query); None elsewhere
+    role_names = query_expression()
+    course_names = query_expression()
 
     fs_uniquifier = Column(
         String(255),
@@ -44,10 +82,14 @@ class User(db.Model, UserMixin):
     )
 
     def numbers(self):
-        if self.courses:
-            return ", ".join(exercise.number for exercise in self.courses.exercises)
-        else:
-            return ""
+        """The numbers of the exercises of all the user's courses."""
+        from app.manifests import course_manifests
+
+        return ", ".join(
+            exercise["number"]
+            for manifest in course_manifests(self.courses)
+            for exercise in manifest["exercises"]
+        )
 
     def __repr__(self):
         return self.username
@@ -70,6 +112,7 @@ class Course(db.Model):
     __tablename__ = "courses"
     course_id = Column(Integer, primary_key=True)
     name = Column(String(20), unique=True)
+    region = Column(String(50), index=True)
     users = relationship(
         "User", secondary="users_courses", back_populates="courses", lazy=True
     )
@@ -86,14 +129,237 @@ class Exercise(db.Model):
     number = Column(String(20))  # e.g. 8.0.122
     exercise_path = Column(String(255))
     flag_visible = Column(Boolean())
+    # Filled in asynchronously by the "process_exercise" job after each upload
+    sha256 = Column(String(64))
+    size = Column(Integer)
+    # Pre-compressed variants stored next to the file, e.g. "zstd gzip"
+    encodings = Column(String(32))
     course = relationship(
         "Course", back_populates="exercises", uselist=False, lazy=True
     )
+    package = relationship(
+        "Package",
+        back_populates="exercise",
+        uselist=False,
+        lazy=True,
+        cascade="all, delete-orphan",
+    )
+    versions = relationship(
+        "ExerciseVersion",
+        back_populates="exercise",
+        order_by="ExerciseVersion.version_id",
+        lazy=True,
+        cascade="all, delete-orphan",
+    )
+
+    # The manifests and the sync of a course look its exercises up
+    __table_args__ = (Index("ix_exercises_course_number", "course_id", "number"),)
 
     def __repr__(self):
         return f"{self.number}"
 
 
+class Package(db.Model):
+    """Control metadata of an uploaded .deb exercise, parsed once at upload time."""
+
+    __tablename__ = "packages"
+    package_id = Column(Integer, primary_key=True)
+    exercise_id = Column(
+        Integer, ForeignKey("exercises.exercise_id"), unique=True, nullable=False
+    )
+    # Copied from the exercise, so that per-course lookups don't need a join
+    course_id = Column(Integer, ForeignKey("courses.course_id"), nullable=False)
+    name = Column(String(100), nullable=False)  # "Package" field
+    version = Column(String(100), nullable=False)
+    # Sorts like dpkg versions, see app.debian.version_sort_key
+    version_sort = Column(String(255), nullable=False)
+    architecture = Column(String(20))
+    installed_size = Column(Integer)  # KiB, as declared by the package
+    size = Column(Integer)  # bytes of the .deb file
+    depends = Column(Text)
+    description = Column(Text)
+    exercise = relationship("Exercise", back_populates="package", lazy=True)
+
+    __table_args__ = (
+        Index("ix_packages_course_name_version", "course_id", "name", "version_sort"),
+        Index("ix_packages_name_version", "name", "version_sort"),
+    )
+
+    def __repr__(self):
+        return f"{self.name} {self.version} ({self.architecture})"
+
+
+class ExerciseVersion(db.Model):
+    """
+    A file an exercise has had, kept by app/versions.py once the upload is
+    processed, with the delta from the version before it when one pays off.
+    """
+
+    __tablename__ = "exercise_versions"
+    version_id = Column(Integer, primary_key=True)
+    exercise_id = Column(
+        Integer,
+        ForeignKey("exercises.exercise_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    sha256 = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    blob_key = Column(String(255), nullable=False)  # storage key of the copy
+    # Filled in by the "compute_exercise_delta" job
+    base_sha256 = Column(String(64))  # the version the delta applies to
+    delta_key = Column(String(255))
+    delta_size = Column(Integer)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+    exercise = relationship("Exercise", back_populates="versions", lazy=True)
+
+    __table_args__ = (
+        Index("ix_exercise_versions_exercise_sha256", "exercise_id", "sha256"),
+    )
+
+    def __repr__(self):
+        return f"{self.exercise_id}@{self.sha256[:12]}"
+
+
+class Job(db.Model):
+    __tablename__ = "jobs"
+    job_id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False)  # name of the registered task
+    payload = Column(Text, nullable=False, default="{}")  # JSON keyword arguments
+    status = Column(String(10), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    last_error = Column(Text)
+    run_at = Column(DateTime, nullable=False, default=utcnow)
+    locked_at = Column(DateTime)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+    updated_at = Column(DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    # Workers look for the oldest due job in a given status
+    __table_args__ = (Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+    def to_dict(self):
+        return {
+            "id": self.job_id,
+            "name": self.name,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "last_error": self.last_error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+    def __repr__(self):
+        return f"{self.name} #{self.job_id} ({self.status})"
+
+
+class CourseStats(db.Model):
+    """
+    Counters of a course, kept up to date by the ORM events of app/stats.py
+    so that dashboards never count rows. "flask stats rebuild" repairs them.
+    """
+
+    __tablename__ = "course_stats"
+    course_id = Column(
+        Integer, ForeignKey("courses.course_id", ondelete="CASCADE"), primary_key=True
+    )
+    enrollments = Column(Integer, nullable=False, default=0)
+    exercises = Column(Integer, nullable=False, default=0)
+    visible_exercises = Column(Integer, nullable=False, default=0)
+    course = relationship("Course", lazy=True)
+
+    @property
+    def hidden_exercises(self):
+        return self.exercises - self.visible_exercises
+
+    def to_dict(self):
+        return {
+            "course_id": self.course_id,
+            "course": self.course.name,
+            "enrollments": self.enrollments,
+            "exercises": self.exercises,
+            "visible_exercises": self.visible_exercises,
+            "hidden_exercises": self.hidden_exercises,
+        }
+
+
+class CourseManifest(db.Model):
+    """
+    The exercises of a course as the students see them, in JSON. Rebuilt by
+    the ORM events of app/manifests.py when they change, so that the student
+    pages never query the exercises. "flask manifests rebuild" repairs them.
+    """
+
+    __tablename__ = "course_manifests"
+    course_id = Column(
+        Integer, ForeignKey("courses.course_id", ondelete="CASCADE"), primary_key=True
+    )
+    digest = Column(String(16), nullable=False)  # of the body, for ETags and caches
+    body = Column(Text, nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=utcnow)
+
+
+class StatsCounter(db.Model):
+    """Application-wide counters (e.g. "users"), see CourseStats."""
+
+    __tablename__ = "stats_counters"
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class AuditEvent(db.Model):
+    """
+    Append-only trail of the sensitive actions (logins, uploads, downloads,
+    password resets), written in batches by app/audit.py.
+    """
+
+    __tablename__ = "audit_events"
+    event_id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+    action = Column(String(50), nullable=False)  # e.g. "exercise.download"
+    # Copied rather than referenced: the trail outlives deleted users
+    user_id = Column(Integer)
+    username = Column(String(100))
+    ip = Column(String(45))
+    target = Column(String(255))  # what the action was about
+    details = Column(Text, nullable=False, default="{}")  # JSON
+
+    __table_args__ = (
+        Index("ix_audit_events_created_at", "created_at"),
+        Index("ix_audit_events_action_created_at", "action", "created_at"),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.event_id,
+            "created_at": self.created_at.isoformat(),
+            "action": self.action,
+            "user_id": self.user_id,
+            "username": self.username,
+            "ip": self.ip,
+            "target": self.target,
+            "details": json.loads(self.details),
+        }
+
+
+class DownloadRollup(db.Model):
+    """
+    Downloads of an exercise per minute or per hour, flushed from the
+    counters of the worker processes by app/analytics.py. No foreign keys:
+    the history of deleted exercises and courses is kept.
+    """
+
+    __tablename__ = "download_rollups"
+    period = Column(String(6), primary_key=True)  # "minute" or "hour"
+    bucket = Column(DateTime, primary_key=True)  # start of the minute or hour
+    course_id = Column(Integer, primary_key=True)
+    exercise_id = Column(Integer, primary_key=True)
+    downloads = Column(Integer, nullable=False, default=0)
+    bytes_sent = Column(BigInteger, nullable=False, default=0)
+    # Bytes the deltas and compressed variants spared, against whole files
+    bytes_saved = Column(BigInteger, nullable=False, default=0)
+
+
 # Generate a random fs_uniquifier: users cannot login without it
 @event.listens_for(User, "before_insert")
 def before_insert_listener(mapper, connection, target):
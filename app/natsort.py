@@ -0,0 +1,92 @@
+"""
+Natural ordering of exercise numbers and user names: "1.2" < "1.10" < "2",
+"user9" < "user10".
+
+natural_key() is the key for Python sorts. It is memoized, since the same
+numbers and names are sorted on every request, and type-safe: text and
+numbers always alternate, starting with (possibly empty) text, so a number
+is never compared with a string.
+
+For SQL, every SQLite connection gets the same order as the natsort_key()
+function, which encodes it as a plain string, and as the NATURAL collation.
+natural_order() sorts with the function: it runs once per row, while the
+collation calls back into Python for every comparison (about 4x slower on
+100k rows, see benchmarks/natsort.py).
+"""
+
+import re
+import sqlite3
+from functools import lru_cache
+
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+
+from app.extensions import db
+
+_DIGITS = re.compile(r"(\d+)")
+
+# Distinct values remembered: all the exercise numbers of a large instance
+CACHE_SIZE = 2**17
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def natural_key(value):
+    """
+    Sort key: the text and number parts, then the value itself, so that
+    "01" and "1" still have a stable order.
+    """
+    parts = _DIGITS.split(value)
+    for i in range(1, len(parts), 2):
+        parts[i] = int(parts[i])
+    return tuple(parts), value
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def natural_sort_key(value):
+    """
+    Encode natural_key(value) as a string with the same order: each text part
+    ends with "\\x01", each number is prefixed with its length.
+    """
+    encoded = []
+    for i, part in enumerate(_DIGITS.split(value)):
+        if i % 2:
+            number = part.lstrip("0")
+            encoded.append(chr(len(number) + 0x30) + number)
+        else:
+            encoded.append(part + "\x01")
+    encoded.append("\x00" + value)
+    return "".join(encoded)
+
+
+def natural_compare(left, right):
+    """Compare two strings in natural order, like a SQLite collation."""
+    left, right = natural_key(left), natural_key(right)
+    return (left > right) - (left < right)
+
+
+@event.listens_for(Engine, "connect")
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_collation("NATURAL", natural_compare)
+        dbapi_connection.create_function(
+            "natsort_key", 1, natural_sort_key, deterministic=True
+        )
+
+
+def _in_sql():
+    return db.session.get_bind().dialect.name == "sqlite"
+
+
+def natural_order(column):
+    """
+    ORDER BY expression sorting "column" naturally on SQLite, in the plain
+    order of the database elsewhere.
+    """
+    return func.natsort_key(column) if _in_sql() else column
+
+
+def natural_sorted(query, column):
+    """The rows of "query" sorted naturally by "column", in SQL when possible."""
+    if _in_sql():
+        return query.order_by(natural_order(column)).all()
+    return sorted(query.all(), key=lambda row: natural_key(getattr(row, column.key)))
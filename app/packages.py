@@ -0,0 +1,139 @@
+"""
+Index of the .deb packages uploaded as exercises.
+
+The control metadata is parsed once, when the upload is post-processed, and
+stored in the "packages" table: version lookups then never open the files.
+"""
+
+import logging
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func
+
+from app.debian import DebError, read_control, version_sort_key
+from app.extensions import db
+from app.models import Exercise, Package
+from app.tasks import exercise_processed, signals
+
+logger = logging.getLogger(__name__)
+
+# Sent with the Package once its row has been committed
+package_indexed = signals.signal("package-indexed")
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def index_package(exercise):
+    """
+    Read the control fields of a .deb exercise into its Package row.
+    Returns None for any other kind of file, after deleting the Package row
+    left by a .deb it replaced.
+    """
+    from app.helpers import exercise_file_path
+
+    path = exercise_file_path(exercise)
+    if not path.endswith(".deb"):
+        if exercise.package is not None:
+            db.session.delete(exercise.package)
+        return None
+
+    with open(path, "rb") as file:
+        fields = read_control(file)
+        size = file.seek(0, 2)
+
+    package = exercise.package or Package(exercise=exercise)
+    package.course_id = exercise.course_id
+    package.name = fields.get("Package", exercise.number)
+    package.version = fields.get("Version", exercise.number)
+    package.version_sort = version_sort_key(package.version)
+    package.architecture = fields.get("Architecture")
+    package.installed_size = _to_int(fields.get("Installed-Size"))
+    package.size = size
+    package.depends = fields.get("Depends")
+    package.description = fields.get("Description")
+    db.session.add(package)
+    return package
+
+
+@exercise_processed.connect
+def _index_uploaded_package(exercise):
+    try:
+        package = index_package(exercise)
+    except DebError as error:
+        # A broken package won't get better by retrying the job
+        logger.warning("Cannot read the metadata of %s: %s", exercise, error)
+        return
+    db.session.commit()
+    if package is not None:
+        package_indexed.send(package)
+
+
+def latest_packages(course_id):
+    """Return the newest version of every package of a course, in one query."""
+    newest = (
+        db.session.query(
+            Package.name, func.max(Package.version_sort).label("version_sort")
+        )
+        .filter(Package.course_id == course_id)
+        .group_by(Package.name)
+        .subquery()
+    )
+    return (
+        Package.query.join(
+            newest,
+            and_(
+                Package.course_id == course_id,
+                Package.name == newest.c.name,
+                Package.version_sort == newest.c.version_sort,
+            ),
+        )
+        .order_by(Package.name)
+        .all()
+    )
+
+
+def package_versions(name, course_id=None):
+    """Return every indexed version of a package, oldest first."""
+    query = Package.query.filter(Package.name == name)
+    if course_id is not None:
+        query = query.filter(Package.course_id == course_id)
+    return query.order_by(Package.version_sort).all()
+
+
+@click.group("packages", help="Manage the index of uploaded .deb packages.")
+def packages_cli():
+    pass
+
+
+@packages_cli.command("backfill")
+@click.option(
+    "--all", "reindex", is_flag=True, help="Re-read packages already indexed."
+)
+@with_appcontext
+def backfill_command(reindex):
+    """Index the .deb exercises uploaded before the index existed."""
+    query = Exercise.query.filter(Exercise.exercise_path.like("%.deb"))
+    if not reindex:
+        query = query.outerjoin(Package).filter(Package.package_id.is_(None))
+
+    indexed = failed = 0
+    for exercise in query.all():
+        try:
+            index_package(exercise)
+        except (OSError, DebError) as error:
+            failed += 1
+            click.echo(f"{exercise.exercise_path}: {error}", err=True)
+            continue
+        indexed += 1
+        # Commit in batches to keep the transaction short
+        if indexed % 100 == 0:
+            db.session.commit()
+    db.session.commit()
+
+    click.echo(f"{indexed} packages indexed, {failed} failed.")
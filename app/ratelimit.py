@@ -0,0 +1,250 @@
+"""
+Admission control for the expensive endpoints: logins and downloads.
+
+Two independent mechanisms:
+
+- rate limits: a token bucket per limit and client (user, IP or login name).
+  A client whose bucket is empty gets "429 Too Many Requests" with a
+  Retry-After header, and doesn't cost anything else;
+- concurrency limits: a semaphore per expensive operation (password hashing,
+  file transfers) in each worker process. A request which doesn't get a slot
+  within RATELIMIT_QUEUE_TIMEOUT gets "503 Service Unavailable".
+
+The buckets live in RATELIMIT_STORAGE:
+    memory://                 one set of buckets per process
+    sqlite:///<path>          shared by all the processes of a host
+    redis://<host>:<port>/0   shared by all hosts (needs the redis package)
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, request
+from flask_login import current_user
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from werkzeug.wsgi import ClosingIterator
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# POSTs to these endpoints check a password
+LOGIN_ENDPOINTS = {"students.login", "security.login"}
+
+
+def parse_limit(limit):
+    """Parse "10/minute" into (refill rate per second, bucket size)."""
+    count, period = limit.split("/")
+    return int(count) / PERIODS[period.strip()], int(count)
+
+
+def _refill(tokens, updated, rate, burst, now):
+    return min(burst, tokens + max(now - updated, 0) * rate)
+
+
+class MemoryBackend:
+    """Token buckets in a dictionary: each process counts on its own."""
+
+    PRUNE_EVERY = 1000  # takes between two deletions of the full buckets
+
+    def __init__(self):
+        # {key: (tokens, updated, time at which the bucket is full again)}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def take(self, key, rate, burst, now=None):
+        """Take a token; return 0 or, if there is none, the seconds to wait."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                # A full bucket is the same as none: keys posted by anyone (login
+                #   names) must not pile up
+                self._buckets = {
+                    bucket_key: bucket
+                    for bucket_key, bucket in self._buckets.items()
+                    if bucket[2] > now
+                }
+
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = _refill(tokens, updated, rate, burst, now)
+            wait = (1 - tokens) / rate if tokens < 1 else 0
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return wait
+
+
+class SQLiteBackend:
+    """
+    Token buckets in a SQLite file, shared by the workers of a host.
+    Each take() is a single UPSERT, so it needs no explicit transaction.
+    """
+
+    PRUNE_EVERY = 1000  # takes between two deletions of the idle buckets
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        # One connection per thread, and never one inherited from a fork
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def take(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now
+        params = {"key": key, "rate": rate, "burst": burst, "now": now}
+        connection = self._connection()
+        taken = connection.execute(
+            "INSERT INTO buckets (key, tokens, updated) VALUES (:key, :burst - 1, :now) "
+            "ON CONFLICT (key) DO UPDATE SET"
+            " tokens = min(:burst, tokens + max(:now - updated, 0) * :rate) - 1,"
+            " updated = :now "
+            "WHERE min(:burst, tokens + max(:now - updated, 0) * :rate) >= 1 "
+            "RETURNING tokens",
+            params,
+        ).fetchone()
+
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            # A bucket idle for a day is full again anyway
+            connection.execute("DELETE FROM buckets WHERE updated < ?", (now - 86400,))
+
+        if taken is not None:
+            return 0
+        (tokens,) = connection.execute(
+            "SELECT min(:burst, tokens + max(:now - updated, 0) * :rate) "
+            "FROM buckets WHERE key = :key",
+            params,
+        ).fetchone()
+        return (1 - tokens) / rate
+
+
+class RedisBackend:
+    """Token buckets in Redis, updated atomically by a Lua script."""
+
+    SCRIPT = """
+    local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+    local wait = 0
+    if tokens < 1 then
+        wait = (1 - tokens) / rate
+    else
+        tokens = tokens - 1
+    end
+    redis.call("HSET", KEYS[1], "tokens", tokens, "updated", now)
+    redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._take = redis.Redis.from_url(url).register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now
+        return float(self._take(keys=[f"ratelimit:{key}"], args=[rate, burst, now]))
+
+
+def create_backend(url):
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///") :])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackend(url)
+    if url == "memory://":
+        return MemoryBackend()
+    raise ValueError(f"Unknown RATELIMIT_STORAGE: {url}")
+
+
+class RateLimiter:
+    """
+    Flask extension: the buckets and semaphores of each app are kept in
+    app.extensions["ratelimit"].
+    """
+
+    def init_app(self, app):
+        app.extensions["ratelimit"] = {
+            "backend": create_backend(app.config["RATELIMIT_STORAGE"]),
+            "slots": {
+                name: threading.BoundedSemaphore(size)
+                for name, size in app.config["RATELIMIT_CONCURRENCY"].items()
+            },
+        }
+        app.before_request(_admit_login)
+        app.teardown_request(_release_login_slot)
+
+    @staticmethod
+    def client_key():
+        """The logged in user, or the IP address of anonymous clients."""
+        if current_user.is_authenticated:
+            return f"user:{current_user.user_id}"
+        return f"ip:{request.remote_addr}"
+
+    def hit(self, name, key=None):
+        """Count a request against the limit "name"; raise 429 when over it."""
+        if not current_app.config["RATELIMIT_ENABLED"]:
+            return
+        rate, burst = parse_limit(current_app.config["RATELIMITS"][name])
+        backend = current_app.extensions["ratelimit"]["backend"]
+        wait = backend.take(f"{name}:{key or self.client_key()}", rate, burst)
+        if wait:
+            raise TooManyRequests(retry_after=math.ceil(wait))
+
+    def acquire(self, name):
+        """Take a slot of the operation "name"; raise 503 when none frees up."""
+        if not current_app.config["RATELIMIT_ENABLED"]:
+            return lambda: None
+        slot = current_app.extensions["ratelimit"]["slots"][name]
+        timeout = current_app.config["RATELIMIT_QUEUE_TIMEOUT"]
+        if not slot.acquire(timeout=timeout):
+            raise ServiceUnavailable(retry_after=max(1, math.ceil(timeout)))
+        return slot.release
+
+    def hold(self, name, response):
+        """Keep a slot of "name" until the response has been sent."""
+        try:
+            release = self.acquire(name)
+        except ServiceUnavailable:
+            response.close()
+            raise
+        # Not call_on_close(): it's skipped for send_file's direct passthrough
+        response.response = ClosingIterator(response.response, release)
+        return response
+
+
+limiter = RateLimiter()
+
+
+def _admit_login():
+    if request.method != "POST" or request.endpoint not in LOGIN_ENDPOINTS:
+        return
+    limiter.hit("login", f"ip:{request.remote_addr}")
+    # Also per account, against guesses spread over many addresses
+    username = request.form.get("username", "").strip().lower()
+    if username:
+        limiter.hit("login_account", username)
+    # Hashing the password is what makes a login expensive
+    g.release_login_slot = limiter.acquire("password_hash")
+
+
+def _release_login_slot(exception=None):
+    release = g.pop("release_login_slot", None)
+    if release is not None:
+        release()
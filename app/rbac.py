@@ -0,0 +1,238 @@
+"""
+Role-based access control, compiled into a bit mask and a set.
+
+Each role grants a set of permissions (ROLE_PERMISSIONS). The first check of
+a request compiles the roles of the user into one integer, kept in the
+session next to the identity, and the courses they may reach into a set of
+ids, kept in a cache of each process by (user id, version): it would grow
+with the courses in a cookie. Later checks, in this request and the next
+ones, are a bit test and a set lookup: the roles and courses are read again
+only when User.rbac_version changes, which the ORM events at the bottom of
+this module take care of.
+
+Course scopes are the enrolled courses of a user, plus every course of their
+region for the "application" role, or all of them for the administrators.
+"""
+
+import collections
+import enum
+import threading
+import zlib
+from collections import namedtuple
+from functools import wraps
+
+from flask import current_app, g
+from flask import session as flask_session
+from flask_login import current_user
+from sqlalchemy import event, inspect, select, union, update
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import Course, Role, User, UserCourse, UserRoles
+
+
+class Permission(enum.IntFlag):
+    ADMIN = 1  # the admin pages and the API
+    DOWNLOAD = 2  # download the exercises of the courses in scope
+    UPLOAD = 4  # upload exercises from the profile page
+    JOBS = 8  # follow the background jobs
+    ALL_COURSES = 16  # every course is in scope
+    REGION_COURSES = 32  # the courses of the user's region are in scope
+
+
+ROLE_PERMISSIONS = {
+    "administrator": Permission.ADMIN | Permission.JOBS | Permission.ALL_COURSES,
+    "teacher": Permission.UPLOAD | Permission.JOBS,
+    "student": Permission.DOWNLOAD,
+    "application": Permission.DOWNLOAD | Permission.REGION_COURSES,
+}
+
+# Sessions compiled with another table are compiled again
+_TABLE_VERSION = zlib.crc32(repr(sorted(ROLE_PERMISSIONS.items())).encode())
+
+SESSION_KEY = "_rbac"
+
+
+class Grants(namedtuple("Grants", ["permissions", "scope"])):
+    """The compiled permissions and course scope (a frozenset) of a user."""
+
+    def can(self, permission):
+        return self.permissions & permission == permission
+
+    def can_access_course(self, course_id):
+        return bool(self.permissions & Permission.ALL_COURSES) or (
+            course_id in self.scope
+        )
+
+    def course_ids(self):
+        return self.scope
+
+
+NO_GRANTS = Grants(0, frozenset())
+
+
+class ScopeCache:
+    """
+    The course scopes of the recent users, by (user id, version): the least
+    recently used are forgotten first.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._scopes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            scope = self._scopes.get(key)
+            if scope is not None:
+                self._scopes.move_to_end(key)
+            return scope
+
+    def put(self, key, scope):
+        with self._lock:
+            self._scopes[key] = scope
+            self._scopes.move_to_end(key)
+            if len(self._scopes) > self.size:
+                self._scopes.popitem(last=False)
+
+
+def compile_grants(user):
+    """Read the roles and course scope of "user", through indexed lookups."""
+    permissions = Permission(0)
+    role_names = db.session.scalars(
+        select(Role.name)
+        .join(UserRoles, UserRoles.role_id == Role.role_id)
+        .where(UserRoles.user_id == user.user_id)
+    )
+    for name in role_names:
+        permissions |= ROLE_PERMISSIONS.get(name, 0)
+
+    scope = frozenset()
+    if not permissions & Permission.ALL_COURSES:
+        course_ids = select(UserCourse.course_id).where(
+            UserCourse.user_id == user.user_id
+        )
+        if permissions & Permission.REGION_COURSES and user.region:
+            course_ids = union(
+                course_ids,
+                select(Course.course_id).where(Course.region == user.region),
+            )
+        scope = frozenset(db.session.scalars(course_ids))
+    return Grants(int(permissions), scope)
+
+
+def grants(user=None):
+    """The Grants of "user" (the current user by default), compiled once."""
+    if user is None:
+        user = current_user
+    if not user.is_authenticated or not user.is_active:
+        return NO_GRANTS
+
+    # [identity, its version, the table version, permissions]
+    key = [user.fs_uniquifier, user.rbac_version, _TABLE_VERSION]
+    cached = g.get("rbac_grants")
+    if cached is None or cached[0] != key:
+        scopes = current_app.extensions["rbac_scopes"]
+        scope_key = (user.user_id, user.rbac_version)
+        in_session = flask_session.get(SESSION_KEY)
+        scope = scopes.get(scope_key)
+        if not in_session or in_session[:3] != key or scope is None:
+            permissions, scope = compile_grants(user)
+            flask_session[SESSION_KEY] = key + [permissions]
+            scopes.put(scope_key, scope)
+        else:
+            permissions = in_session[3]
+        cached = (key, Grants(permissions, scope))
+        g.rbac_grants = cached
+    return cached[1]
+
+
+def can(permission, user=None):
+    return grants(user).can(permission)
+
+
+def can_access_course(course_id, user=None):
+    return grants(user).can_access_course(course_id)
+
+
+def courses_in_scope(user=None):
+    """The courses the user may reach, by name."""
+    user_grants = grants(user)
+    query = Course.query.order_by(Course.name)
+    if user_grants.can(Permission.ALL_COURSES):
+        return query.all()
+    return query.filter(Course.course_id.in_(user_grants.course_ids())).all()
+
+
+def permission_required(permission):
+    """Decorator: the view needs every bit of "permission"."""
+
+    def wrapper(view):
+        @wraps(view)
+        def decorated_view(*args, **kwargs):
+            if not can(permission):
+                # The same response as the roles_required() of Flask-Security
+                security = current_app.extensions["security"]
+                return security._unauthz_handler(
+                    permission_required.__name__, [permission.name]
+                )
+            return current_app.ensure_sync(view)(*args, **kwargs)
+
+        return decorated_view
+
+    return wrapper
+
+
+def init_rbac(app):
+    app.extensions["rbac_scopes"] = ScopeCache(app.config["RBAC_SCOPE_CACHE_SIZE"])
+    app.jinja_env.globals.update(can=can, Permission=Permission)
+
+
+# Invalidation
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_changed_users(session, flush_context, instances):
+    """
+    Bump the version of the users whose roles, enrollments or region change,
+    whichever side of the relationships the change is made on, and of those
+    of the deleted courses: their ids may be given to new courses.
+    """
+    users, regions = set(), set()
+    for obj in session.deleted:
+        if isinstance(obj, Course):
+            users.update(obj.users)
+            if obj.region:
+                regions.add(obj.region)
+    for obj in session.new | session.dirty:
+        state = inspect(obj)
+        if isinstance(obj, User):
+            if any(
+                state.attrs[attribute].history.has_changes()
+                for attribute in ("roles", "courses", "region")
+            ):
+                users.add(obj)
+        elif isinstance(obj, (Role, Course)):
+            history = state.attrs["users"].history
+            users.update(history.added)
+            users.update(history.deleted)
+            if isinstance(obj, Course):
+                region = state.attrs["region"].history
+                regions.update(filter(None, [*region.added, *region.deleted]))
+    for user in users:
+        if user not in session.deleted:
+            user.rbac_version = (user.rbac_version or 0) + 1
+    session.info["rbac_regions"] = regions
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_region_users(session, flush_context):
+    """A course entering or leaving a region changes the scope of its users."""
+    regions = session.info.pop("rbac_regions", set())
+    if regions:
+        session.connection().execute(
+            update(User.__table__)
+            .where(User.__table__.c.region.in_(regions))
+            .values(rbac_version=User.__table__.c.rbac_version + 1)
+        )
@@ -0,0 +1,306 @@
+"""
+Checks that the upload folder and the database agree.
+
+"flask store verify" goes through the upload folder one top folder (course)
+at a time, in name order, and compares its files with what the rows of the
+course point to:
+    the files of the exercises     size and SHA-256, once processed
+    their compressed variants      present
+    the copies of their versions   size and SHA-256
+    the deltas between versions    size
+It reports the files missing (downloads of them fail), those that differ
+from their checksum, and the orphans: files no row points to. Files being
+uploaded (".tmp-*") are left out.
+
+Only the files with a known checksum are read, by a pool of
+SCRUB_WORKERS threads (hashlib releases the GIL), a few at a time so that
+memory stays bounded whatever the size of the tree; files bigger than
+SCRUB_MMAP_MIN_SIZE are mapped instead of read. The rows of one course are
+held at a time. Every SCRUB_CHECKPOINT_EVERY files and after each folder,
+the last file checked is saved to SCRUB_CHECKPOINT: "--resume" starts
+right after it.
+"""
+
+import collections
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_, select
+
+from app.backup import TEMPORARY, walk_files, walk_order
+from app.compression import variant_key
+from app.extensions import db
+from app.models import Course, Exercise, ExerciseVersion
+from app.storage import key_from_path, upload_path
+from app.tasks import file_sha256
+from config import basedir
+
+exercises = Exercise.__table__
+versions = ExerciseVersion.__table__
+
+KINDS = ("missing", "mismatch", "orphan")
+
+
+def expected_files(course_id):
+    """
+    The files the rows of a course point to: {key: (sha256, size, what)},
+    None standing for what isn't known.
+    """
+    expected = {}
+    for number, path, sha256, size, encodings in db.session.execute(
+        select(
+            exercises.c.number,
+            exercises.c.exercise_path,
+            exercises.c.sha256,
+            exercises.c.size,
+            exercises.c.encodings,
+        ).where(exercises.c.course_id == course_id)
+    ):
+        key = key_from_path(path)
+        expected[key] = (sha256, size, f"exercise {number}")
+        for encoding in (encodings or "").split():
+            expected[variant_key(key, encoding)] = (
+                None,
+                None,
+                f"{encoding} variant of exercise {number}",
+            )
+    for number, sha256, size, blob_key, delta_key, delta_size in db.session.execute(
+        select(
+            exercises.c.number,
+            versions.c.sha256,
+            versions.c.size,
+            versions.c.blob_key,
+            versions.c.delta_key,
+            versions.c.delta_size,
+        )
+        .join(exercises, exercises.c.exercise_id == versions.c.exercise_id)
+        .where(exercises.c.course_id == course_id)
+    ):
+        # Copies are named after their content, and shared
+        expected.setdefault(
+            blob_key, (sha256, size, f"version {sha256[:12]} of exercise {number}")
+        )
+        if delta_key:
+            expected[delta_key] = (None, delta_size, f"delta of exercise {number}")
+    return expected
+
+
+def referenced_keys(name):
+    """The keys in the folder "name" a row of any course points to."""
+    exercise_paths = db.session.scalars(
+        select(exercises.c.exercise_path).where(
+            or_(
+                exercises.c.exercise_path.startswith(f"{name}/", autoescape=True),
+                # Older rows hold absolute paths
+                exercises.c.exercise_path.startswith(
+                    os.path.join(upload_path(name), ""), autoescape=True
+                ),
+            )
+        )
+    )
+    keys = {key_from_path(path) for path in exercise_paths}
+    for blob_key, delta_key in db.session.execute(
+        select(versions.c.blob_key, versions.c.delta_key).where(
+            or_(
+                versions.c.blob_key.startswith(f"{name}/", autoescape=True),
+                versions.c.delta_key.startswith(f"{name}/", autoescape=True),
+            )
+        )
+    ):
+        keys.update([blob_key, delta_key])
+    return keys
+
+
+class Scrubber:
+    """Compares the folders of the upload folder with the rows, one at a time."""
+
+    def __init__(self, root, workers, mmap_min_size):
+        self.root = root
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="scrub")
+        # Files being hashed at a time: they bound the memory used
+        self.window = 2 * workers
+        self.mmap_min_size = mmap_min_size
+        self.counts = collections.Counter()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def _checked(self, file):
+        key, size, problem, hashing = file
+        self.counts["files"] += 1
+        self.counts["bytes"] += size
+        if hashing is not None:
+            future, sha256, what = hashing
+            self.counts["hashed"] += 1
+            if future.result() != sha256:
+                problem = "mismatch", key, f"{what}: the SHA-256 doesn't match"
+        if problem is not None:
+            yield problem
+        yield "checked", key, None
+
+    def folder(self, name, course_id, after=None):
+        """
+        Yield the problems of the folder "name" as (kind, key, detail), the
+        rows of the course "course_id" (None if there is none) being right,
+        and ("checked", key, None) once the files up to "key" are checked.
+        The files up to "after" are skipped: a previous run checked them.
+        """
+        remaining = expected_files(course_id) if course_id is not None else {}
+        referenced = None
+        path = os.path.join(self.root, name)
+        files = walk_files(path, f"{name}/") if os.path.isdir(path) else ()
+        # The files being checked, in walk order
+        pending = collections.deque()
+        for key, file_path in files:
+            entry = remaining.pop(key, None)
+            if after is not None and walk_order(key) <= walk_order(after):
+                continue
+            size = os.stat(file_path).st_size
+            problem = hashing = None
+            if entry is None:
+                if referenced is None:
+                    # One query for the folder, and only if there are strays
+                    referenced = referenced_keys(name)
+                if key not in referenced:
+                    problem = "orphan", key, f"{size} bytes"
+            else:
+                sha256, expected_size, what = entry
+                if expected_size is not None and size != expected_size:
+                    detail = f"{what}: {size} bytes, {expected_size} expected"
+                    problem = "mismatch", key, detail
+                elif sha256:
+                    future = self.pool.submit(
+                        file_sha256, file_path, mmap_min_size=self.mmap_min_size
+                    )
+                    hashing = future, sha256, what
+            pending.append((key, size, problem, hashing))
+            # Report in order, without waiting unless the window is full
+            while pending and (
+                len(pending) > self.window
+                or pending[0][3] is None
+                or pending[0][3][0].done()
+            ):
+                yield from self._checked(pending.popleft())
+        while pending:
+            yield from self._checked(pending.popleft())
+
+        for key, (_, _, what) in sorted(remaining.items()):
+            # Rows may point to files in the folder of another course
+            if key.split("/")[0] == name or not os.path.exists(
+                os.path.join(self.root, *key.split("/"))
+            ):
+                yield "missing", key, what
+
+
+def _folders(root):
+    """(name, course_id) of the courses and of the top folders, by name."""
+    names = dict(db.session.execute(select(Course.name, Course.course_id)).all())
+    if os.path.isdir(root):
+        for entry in os.scandir(root):
+            if not entry.name.startswith(TEMPORARY):
+                names.setdefault(entry.name, None)
+    return sorted(names.items())
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(path, checkpoint):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def verify_store(resume=False, report=None, workers=None):
+    """
+    Compare the upload folder with the database, calling "report" with each
+    problem. Return the counts of files, bytes, files hashed and problems.
+    """
+    config = current_app.config
+    checkpoint_path = os.path.join(basedir, config["SCRUB_CHECKPOINT"])
+    checkpoint = _read_checkpoint(checkpoint_path) if resume else None
+    root = upload_path()
+    scrubber = Scrubber(
+        root, workers or config["SCRUB_WORKERS"], config["SCRUB_MMAP_MIN_SIZE"]
+    )
+    if checkpoint:
+        scrubber.counts.update(checkpoint["counts"])
+
+    def save(name, after):
+        _write_checkpoint(
+            checkpoint_path,
+            {"folder": name, "after": after, "counts": dict(scrubber.counts)},
+        )
+
+    try:
+        for name, course_id in _folders(root):
+            after = None
+            if checkpoint:
+                if name < checkpoint["folder"]:
+                    continue
+                if name == checkpoint["folder"]:
+                    # The whole folder if no file is named
+                    if checkpoint["after"] is None:
+                        continue
+                    after = checkpoint["after"]
+            if os.path.isfile(os.path.join(root, name)):
+                scrubber.counts["files"] += 1
+                problems = [("orphan", name, "outside of the course folders")]
+            else:
+                problems = scrubber.folder(name, course_id, after)
+            checked = 0
+            for kind, key, detail in problems:
+                if kind == "checked":
+                    checked += 1
+                    if checked % config["SCRUB_CHECKPOINT_EVERY"] == 0:
+                        save(name, key)
+                    continue
+                scrubber.counts[kind] += 1
+                if report is not None:
+                    report(kind, key, detail)
+            save(name, None)
+    finally:
+        scrubber.close()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return scrubber.counts
+
+
+@click.group("store", help="Check the uploaded files.")
+def store_cli():
+    pass
+
+
+@store_cli.command("verify")
+@click.option("--resume", is_flag=True, help="Start after the last file checked.")
+@click.option("--workers", type=int, help="Files hashed in parallel.")
+@with_appcontext
+def verify_command(resume, workers):
+    """Report the missing, damaged and orphaned files of the upload folder."""
+    if current_app.config["STORAGE_BACKEND"] != "local":
+        raise click.ClickException("Only the local storage can be verified.")
+    start = time.perf_counter()
+    counts = verify_store(
+        resume=resume,
+        report=lambda kind, key, detail: click.echo(f"{kind:8} {key}  {detail}"),
+        workers=workers,
+    )
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f"{counts['files']} files ({counts['bytes'] / 1024**2:.1f} MiB), "
+        f"{counts['hashed']} hashed in {elapsed:.1f}s: "
+        + ", ".join(f"{counts[kind]} {kind}" for kind in KINDS)
+    )
+    if any(counts[kind] for kind in KINDS):
+        raise SystemExit(1)
@@ -0,0 +1,455 @@
+"""
+Prefix and fuzzy search over usernames, course names and exercise numbers.
+
+SQLite uses two FTS5 tables: "search_index" (word prefixes, ranked with bm25)
+and "search_trigram" (the labels sharing trigrams with the query, ranked by
+trigram similarity like pg_trgm does, used as the fuzzy fallback when no
+prefix matches). On PostgreSQL a plain table with a pg_trgm GIN index is used
+instead. Both are kept in sync by the mapper events at the bottom of this
+module, inside the same transaction as the change that triggered them.
+"""
+
+import re
+from dataclasses import dataclass
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect, text
+
+from app.extensions import db
+from app.models import Course, Exercise, User
+
+# The kind of a document is encoded in the low bits of its row id, so that
+#   every update or delete is a primary key lookup
+KINDS = {"user": 1, "course": 2, "exercise": 3}
+KIND_NAMES = {code: kind for kind, code in KINDS.items()}
+
+
+# The fuzzy fallback of SQLite: how similar a label must be to the query (the
+#   default of pg_trgm), and how many labels sharing trigrams are compared
+SIMILARITY_THRESHOLD = 0.3
+FUZZY_CANDIDATES = 200
+
+
+def _rowid(kind, ref_id):
+    return ref_id * 4 + KINDS[kind]
+
+
+def _trigrams(string):
+    """The trigrams of the words of "string", padded the way pg_trgm does."""
+    trigrams = set()
+    for word in re.findall(r"\w+", string.lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def similarity(a, b):
+    """The share of trigrams "a" and "b" have in common, from 0 to 1."""
+    a, b = _trigrams(a), _trigrams(b)
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+@dataclass
+class SearchResult:
+    kind: str
+    id: int
+    label: str
+    detail: str
+    score: float
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "id": self.id,
+            "label": self.label,
+            "detail": self.detail,
+        }
+
+
+@dataclass
+class SearchPage:
+    results: list
+    page: int
+    per_page: int
+    has_next: bool
+
+    def to_dict(self):
+        return {
+            "results": [result.to_dict() for result in self.results],
+            "page": self.page,
+            "per_page": self.per_page,
+            "has_next": self.has_next,
+        }
+
+
+class SQLiteSearch:
+    create_statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "label, detail UNINDEXED, "
+        "tokenize=\"unicode61 remove_diacritics 2 tokenchars '.#+_-'\", "
+        "prefix='1 2 3')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_trigram USING fts5("
+        "label, content='search_index', content_rowid='rowid', tokenize='trigram')",
+    ]
+    drop_statements = [
+        "DROP TABLE IF EXISTS search_trigram",
+        "DROP TABLE IF EXISTS search_index",
+    ]
+
+    def delete(self, connection, rowid):
+        old = connection.execute(
+            text("SELECT label FROM search_index WHERE rowid = :rowid"),
+            {"rowid": rowid},
+        ).scalar()
+        if old is None:
+            return
+        # External content tables need the old value to remove its trigrams
+        connection.execute(
+            text(
+                "INSERT INTO search_trigram(search_trigram, rowid, label) "
+                "VALUES ('delete', :rowid, :label)"
+            ),
+            {"rowid": rowid, "label": old},
+        )
+        connection.execute(
+            text("DELETE FROM search_index WHERE rowid = :rowid"), {"rowid": rowid}
+        )
+
+    def upsert(self, connection, rowid, label, detail):
+        self.delete(connection, rowid)
+        params = {"rowid": rowid, "label": label, "detail": detail}
+        connection.execute(
+            text(
+                "INSERT INTO search_index(rowid, label, detail) "
+                "VALUES (:rowid, :label, :detail)"
+            ),
+            params,
+        )
+        connection.execute(
+            text("INSERT INTO search_trigram(rowid, label) VALUES (:rowid, :label)"),
+            params,
+        )
+
+    def bulk_insert(self, connection, rows):
+        """Insert new documents into the (empty) index, without the upsert lookups."""
+        if rows:
+            connection.execute(
+                text(
+                    "INSERT INTO search_index(rowid, label, detail) "
+                    "VALUES (:rowid, :label, :detail)"
+                ),
+                rows,
+            )
+        return len(rows)
+
+    def finish_rebuild(self, connection):
+        # Build the trigram index from its content table in one pass
+        connection.execute(
+            text(
+                "INSERT INTO search_trigram(rowid, label) "
+                "SELECT rowid, label FROM search_index"
+            )
+        )
+
+    def set_detail(self, connection, rowids_sql, params, detail):
+        connection.execute(
+            text(
+                f"UPDATE search_index SET detail = :detail WHERE rowid IN ({rowids_sql})"
+            ),
+            {**params, "detail": detail},
+        )
+
+    @staticmethod
+    def _quoted_words(query):
+        # Quote every word, so that user input can't inject FTS5 syntax
+        return ['"' + word.replace('"', '""') + '"' for word in query.split()]
+
+    def query(self, connection, query, kind_codes, limit, offset):
+        words = self._quoted_words(query)
+        kind_filter = "AND (i.rowid % 4) IN ({})".format(
+            ", ".join(str(code) for code in kind_codes)
+        )
+        # Ranking means scoring every match: 1-2 letter prefixes match too many
+        #   documents for that, so they are returned in index order instead
+        order = "ORDER BY score, length(i.label)" if len(query) >= 3 else ""
+        rows = connection.execute(
+            text(
+                "SELECT i.rowid, i.label, i.detail, bm25(search_index) AS score "
+                f"FROM search_index AS i WHERE search_index MATCH :match {kind_filter} "
+                f"{order} LIMIT :limit OFFSET :offset"
+            ),
+            {
+                "match": " ".join(f"{word}*" for word in words),
+                "limit": limit,
+                "offset": offset,
+            },
+        ).all()
+        if rows or len(query) < 3:
+            return rows
+        if offset and self._has_prefix_match(connection, words, kind_filter):
+            # Past the last page of the prefix matches
+            return rows
+
+        # Nothing starts with the query: rank the labels sharing trigrams with
+        #   it (those sharing the most first) by similarity
+        query_lower = query.lower()
+        trigrams = {query_lower[i : i + 3] for i in range(len(query_lower) - 2)}
+        candidates = connection.execute(
+            text(
+                "SELECT i.rowid, i.label, i.detail "
+                "FROM search_trigram AS t JOIN search_index AS i ON i.rowid = t.rowid "
+                f"WHERE search_trigram MATCH :match {kind_filter} "
+                "ORDER BY t.rank LIMIT :candidates"
+            ),
+            {
+                "match": " OR ".join(
+                    '"' + trigram.replace('"', '""') + '"' for trigram in trigrams
+                ),
+                "candidates": FUZZY_CANDIDATES,
+            },
+        ).all()
+        rows = []
+        for rowid, label, detail in candidates:
+            score = similarity(query, label)
+            if score >= SIMILARITY_THRESHOLD:
+                # Lower is better, like bm25
+                rows.append((rowid, label, detail, -score))
+        rows.sort(key=lambda row: (row[3], len(row[1])))
+        return rows[offset : offset + limit]
+
+    @staticmethod
+    def _has_prefix_match(connection, words, kind_filter):
+        return (
+            connection.execute(
+                text(
+                    "SELECT 1 FROM search_index AS i WHERE search_index MATCH :match "
+                    f"{kind_filter} LIMIT 1"
+                ),
+                {"match": " ".join(f"{word}*" for word in words)},
+            ).first()
+            is not None
+        )
+
+
+class PostgresSearch(SQLiteSearch):
+    create_statements = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE TABLE IF NOT EXISTS search_index ("
+        "rowid BIGINT PRIMARY KEY, label TEXT NOT NULL, detail TEXT)",
+        "CREATE INDEX IF NOT EXISTS ix_search_index_label_trgm "
+        "ON search_index USING gin (lower(label) gin_trgm_ops)",
+    ]
+    drop_statements = ["DROP TABLE IF EXISTS search_index"]
+
+    def finish_rebuild(self, connection):
+        connection.execute(text("ANALYZE search_index"))
+
+    def delete(self, connection, rowid):
+        connection.execute(
+            text("DELETE FROM search_index WHERE rowid = :rowid"), {"rowid": rowid}
+        )
+
+    def upsert(self, connection, rowid, label, detail):
+        connection.execute(
+            text(
+                "INSERT INTO search_index(rowid, label, detail) "
+                "VALUES (:rowid, :label, :detail) "
+                "ON CONFLICT (rowid) DO UPDATE SET label = :label, detail = :detail"
+            ),
+            {"rowid": rowid, "label": label, "detail": detail},
+        )
+
+    def query(self, connection, query, kind_codes, limit, offset):
+        # Prefix matches first, then the most similar trigram matches
+        return connection.execute(
+            text(
+                "SELECT rowid, label, detail, "
+                "CASE WHEN lower(label) LIKE :prefix THEN 0 ELSE 1 END "
+                "- similarity(lower(label), :query) AS score "
+                "FROM search_index "
+                "WHERE (lower(label) LIKE :prefix OR lower(label) % :query) "
+                "AND (rowid % 4) = ANY(:kinds) "
+                "ORDER BY score, length(label) LIMIT :limit OFFSET :offset"
+            ),
+            {
+                "query": query.lower(),
+                "prefix": query.lower().replace("%", r"\%").replace("_", r"\_") + "%",
+                "kinds": list(kind_codes),
+                "limit": limit,
+                "offset": offset,
+            },
+        ).all()
+
+
+BACKENDS = {"sqlite": SQLiteSearch(), "postgresql": PostgresSearch()}
+
+# Engines on which the search tables are known to exist
+_ready_engines = set()
+
+
+def _backend(connection):
+    backend = BACKENDS.get(connection.dialect.name)
+    if backend is None:
+        return None
+
+    engine_key = str(connection.engine.url)
+    if engine_key not in _ready_engines:
+        # Databases created before the search feature have no index yet:
+        #   "flask search rebuild" creates and fills it
+        if not inspect(connection).has_table("search_index"):
+            return None
+        _ready_engines.add(engine_key)
+    return backend
+
+
+def create_search_tables(connection):
+    backend = BACKENDS.get(connection.dialect.name)
+    if backend is not None:
+        for statement in backend.create_statements:
+            connection.execute(text(statement))
+
+
+def suggestions(query, kind, limit=5):
+    """Return the labels of the best matches, e.g. for a "Did you mean" message."""
+    return [result.label for result in search(query, [kind], per_page=limit).results]
+
+
+def search(query, kinds=None, page=1, per_page=20):
+    """Return one page of documents matching "query", best matches first."""
+    query = (query or "").strip()
+    page = max(page, 1)
+    if not query:
+        return SearchPage([], page, per_page, False)
+
+    kind_codes = [KINDS[kind] for kind in (kinds or KINDS)]
+    connection = db.session.connection()
+    backend = _backend(connection)
+    if backend is None:
+        return SearchPage([], page, per_page, False)
+
+    # Ask for one more row than needed to know if there is a next page
+    rows = backend.query(
+        connection, query, kind_codes, per_page + 1, (page - 1) * per_page
+    )
+    results = [
+        SearchResult(KIND_NAMES[rowid % 4], rowid // 4, label, detail, score)
+        for rowid, label, detail, score in rows[:per_page]
+    ]
+    return SearchPage(results, page, per_page, len(rows) > per_page)
+
+
+def _documents():
+    """Yield (kind, id, label, detail) for every searchable row."""
+    for user_id, username in db.session.query(User.user_id, User.username):
+        yield "user", user_id, username, None
+    for course_id, name in db.session.query(Course.course_id, Course.name):
+        yield "course", course_id, name, None
+    rows = db.session.query(Exercise.exercise_id, Exercise.number, Course.name).join(
+        Course
+    )
+    for exercise_id, number, course_name in rows:
+        yield "exercise", exercise_id, number, course_name
+
+
+def rebuild_index():
+    """Drop, recreate and refill the search tables. Return the number of documents."""
+    connection = db.session.connection()
+    backend = BACKENDS[connection.dialect.name]
+    for statement in backend.drop_statements:
+        connection.execute(text(statement))
+    create_search_tables(connection)
+
+    count = 0
+    batch = []
+    for kind, ref_id, label, detail in _documents():
+        if label:
+            batch.append(
+                {"rowid": _rowid(kind, ref_id), "label": label, "detail": detail}
+            )
+        if len(batch) == 10_000 or not label:
+            count += backend.bulk_insert(connection, batch)
+            batch = []
+    count += backend.bulk_insert(connection, batch)
+    backend.finish_rebuild(connection)
+    db.session.commit()
+    return count
+
+
+@event.listens_for(db.metadata, "after_create")
+def _after_create(target, connection, **kwargs):
+    create_search_tables(connection)
+
+
+def _changed(target, *attributes):
+    state = inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in attributes)
+
+
+def _sync(kind, attribute, watched, detail=None):
+    def after_insert(mapper, connection, target):
+        backend = _backend(connection)
+        label = getattr(target, attribute)
+        if backend is not None and label:
+            backend.upsert(
+                connection,
+                _rowid(kind, mapper.primary_key_from_instance(target)[0]),
+                label,
+                detail(connection, target) if detail else None,
+            )
+
+    def after_update(mapper, connection, target):
+        # Most updates (passwords, checksums...) don't touch the indexed columns
+        if _changed(target, *watched):
+            after_insert(mapper, connection, target)
+
+    def after_delete(mapper, connection, target):
+        backend = _backend(connection)
+        if backend is not None:
+            ref_id = mapper.primary_key_from_instance(target)[0]
+            backend.delete(connection, _rowid(kind, ref_id))
+
+    return after_insert, after_update, after_delete
+
+
+def _exercise_course_name(connection, exercise):
+    return connection.execute(
+        text("SELECT name FROM courses WHERE course_id = :course_id"),
+        {"course_id": exercise.course_id},
+    ).scalar()
+
+
+for model, kind, attribute, watched, detail in [
+    (User, "user", "username", ["username"], None),
+    (Course, "course", "name", ["name"], None),
+    (Exercise, "exercise", "number", ["number", "course_id"], _exercise_course_name),
+]:
+    after_insert, after_update, after_delete = _sync(kind, attribute, watched, detail)
+    event.listen(model, "after_insert", after_insert)
+    event.listen(model, "after_update", after_update)
+    event.listen(model, "after_delete", after_delete)
+
+
+@event.listens_for(Course, "after_update")
+def _rename_course_exercises(mapper, connection, target):
+    # The course name is shown next to every exercise of the course
+    backend = _backend(connection)
+    if backend is not None and _changed(target, "name"):
+        backend.set_detail(
+            connection,
+            "SELECT exercise_id * 4 + 3 FROM exercises WHERE course_id = :course_id",
+            {"course_id": target.course_id},
+            target.name,
+        )
+
+
+@click.group("search", help="Manage the search index.")
+def search_cli():
+    pass
+
+
+@search_cli.command("rebuild")
+@with_appcontext
+def rebuild_command():
+    """Recreate the search index from the users, courses and exercises tables."""
+    click.echo(f"{rebuild_index()} documents indexed.")
@@ -0,0 +1,268 @@
+"""
+Production server: pre-forked worker processes sharing one preloaded app.
+
+"flask serve" runs the app under gunicorn when it's installed (the settings
+are those of gunicorn.conf.py), or under PreforkServer, a small stdlib
+fallback with the same behaviour:
+
+- the app, its models, admin views and templates are loaded once in the
+  master, and the workers share that memory copy-on-write;
+- every worker drops the database connections inherited from the master;
+- SIGHUP replaces the workers one at a time, each new worker being ready
+  before an old one is stopped; SIGTERM/SIGINT let the running requests
+  finish before exiting.
+
+The master keeps the code it loaded at startup: restart it to deploy new code.
+"""
+
+import gc
+import logging
+import os
+import select
+import signal
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import click
+from flask.cli import pass_script_info
+from sqlalchemy.orm import configure_mappers
+
+from app.extensions import db
+from app.startup import DeferredSetup
+
+logger = logging.getLogger(__name__)
+
+
+def worker_count():
+    """The usual 2 * CPUs + 1 sync workers, counting only the usable CPUs."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return 2 * cpus + 1
+
+
+def preload(app):
+    """Do in the master the setup every worker would otherwise repeat."""
+    if isinstance(app.wsgi_app, DeferredSetup):
+        app.wsgi_app.run()
+    with app.app_context():
+        configure_mappers()
+        # Compile the templates of the app (the cache is shared after fork)
+        for name in app.jinja_loader.list_templates():
+            app.jinja_env.get_template(name)
+        # No connection may be shared between processes
+        for engine in db.engines.values():
+            engine.dispose()
+    # Keep the garbage collector from touching (and so copying) the
+    #   preloaded objects in the workers
+    gc.freeze()
+
+
+def after_fork(app):
+    """Drop the connection pools inherited from the master, without closing them."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def worker_exit(app):
+    """
+    Write what a stopping worker still holds in memory: the audit events and
+    the download counters.
+    """
+    app.extensions["audit"].close()
+    app.extensions["analytics"].close()
+
+
+class _RequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+class _Server(WSGIServer):
+    request_queue_size = 128
+
+
+class PreforkServer:
+    """Stdlib pre-fork HTTP server: one request at a time per worker process."""
+
+    def __init__(self, app, host="127.0.0.1", port=8000, workers=None, timeout=30):
+        self.app = app
+        self.workers = workers or worker_count()
+        self.graceful_timeout = timeout
+        self.server = make_server(
+            host, port, app, server_class=_Server, handler_class=_RequestHandler
+        )
+        # Workers wait for connections (and their accept() race) at most a
+        #   second, so that they notice a signal between two requests
+        self.server.socket.settimeout(1)
+        self.server.timeout = 1
+        self.address = "http://%s:%s" % self.server.server_address[:2]
+        self.pids = set()
+        self._stopping = False
+        self._reload = False
+
+    def run(self):
+        """Start the workers and supervise them until SIGTERM/SIGINT."""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._schedule_reload)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                self.reload()
+            self.reap()
+            time.sleep(0.2)
+
+        for pid in self.pids:
+            self._kill(pid, signal.SIGTERM)
+        self._wait(self.pids, self.graceful_timeout)
+        self.server.server_close()
+
+    def spawn(self, timeout=None):
+        """Fork a worker and wait until it is ready to accept requests."""
+        ready, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready)
+            self._worker(ready_w)
+        os.close(ready_w)
+        if select.select([ready], [], [], timeout or self.graceful_timeout)[0]:
+            os.read(ready, 1)
+        else:
+            logger.warning("Worker %s is not ready yet", pid)
+        os.close(ready)
+        self.pids.add(pid)
+        return pid
+
+    def reload(self):
+        """Replace the workers one at a time, so that some are always serving."""
+        logger.info("Reloading %s workers", len(self.pids))
+        for pid in list(self.pids):
+            self.spawn()
+            self.pids.discard(pid)
+            self._kill(pid, signal.SIGTERM)
+            self._wait({pid}, self.graceful_timeout)
+
+    def reap(self):
+        """Collect the workers which died and replace them."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.pids:
+                self.pids.discard(pid)
+                logger.warning("Worker %s exited with status %s", pid, status)
+                if not self._stopping:
+                    self.spawn()
+
+    def _wait(self, pids, timeout):
+        deadline = time.monotonic() + timeout
+        pids = set(pids)
+        while pids:
+            for pid in list(pids):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    pids.discard(pid)
+            if time.monotonic() > deadline:
+                for pid in pids:
+                    self._kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                return
+            time.sleep(0.05)
+
+    @staticmethod
+    def _kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _schedule_reload(self, signum, frame):
+        self._reload = True
+
+    def _worker(self, ready):
+        """Body of a worker process: it never returns into the master's code."""
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, self._stop)
+            signal.signal(signal.SIGINT, self._stop)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            master = os.getppid()
+            after_fork(self.app)
+            os.write(ready, b"1")
+            os.close(ready)
+
+            while not self._stopping and os.getppid() == master:
+                self.server.handle_request()
+        except BaseException:
+            logger.exception("Worker %s crashed", os.getpid())
+            status = 1
+        finally:
+            # os._exit() skips the atexit handlers
+            worker_exit(self.app)
+            os._exit(status)
+
+
+def run_gunicorn(app, bind, workers, timeout):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", bind)
+            self.cfg.set("workers", workers)
+            self.cfg.set("graceful_timeout", timeout)
+            self.cfg.set("preload_app", True)
+            self.cfg.set("post_fork", lambda server, worker: after_fork(app))
+            self.cfg.set("worker_exit", lambda server, worker: worker_exit(app))
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+@click.command("serve")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8000, show_default=True)
+@click.option("--workers", "-w", type=int, help="Default: SERVER_WORKERS.")
+@click.option(
+    "--server",
+    type=click.Choice(["auto", "gunicorn", "stdlib"]),
+    default="auto",
+    show_default=True,
+    help="gunicorn if it's installed, the stdlib fallback otherwise.",
+)
+@pass_script_info
+def serve_command(info, host, port, workers, server):
+    """Run the app under a pre-forking production server."""
+    app = info.load_app()
+    workers = workers or app.config["SERVER_WORKERS"] or worker_count()
+    timeout = app.config["SERVER_GRACEFUL_TIMEOUT"]
+    preload(app)
+
+    if server != "stdlib":
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            if server == "gunicorn":
+                raise click.ClickException("gunicorn is not installed.")
+        else:
+            return run_gunicorn(app, f"{host}:{port}", workers, timeout)
+
+    prefork = PreforkServer(app, host, port, workers, timeout)
+    click.echo(f"Serving on {prefork.address} with {workers} workers")
+    prefork.run()
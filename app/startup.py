@@ -0,0 +1,98 @@
+"""
+Startup cost of the application.
+
+Parts of the app which only matter once requests are served (the admin views)
+are set up right before the first request instead of in create_app, so CLI
+commands and worker processes don't pay for them. "flask importtime" measures
+where the rest of the startup time goes.
+"""
+
+import subprocess
+import sys
+import threading
+from collections import namedtuple
+
+import click
+
+ImportTime = namedtuple("ImportTime", "name self_us cumulative_us depth")
+
+# Run in a fresh interpreter: the CLI process has already imported everything
+_PROBE = """\
+import time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+class DeferredSetup:
+    """
+    WSGI middleware calling "setup(app)" once, right before the first request
+    is dispatched (Flask refuses new routes after that).
+    """
+
+    def __init__(self, app, setup):
+        self.app = app
+        self.setup = setup
+        self.wsgi_app = app.wsgi_app
+        self.done = False
+        self._lock = threading.Lock()
+
+    def run(self):
+        with self._lock:
+            if not self.done:
+                self.setup(self.app)
+                self.done = True
+
+    def __call__(self, environ, start_response):
+        if not self.done:
+            self.run()
+        return self.wsgi_app(environ, start_response)
+
+
+def parse_importtime(output):
+    """Parse the report written to stderr by "python -X importtime"."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append(
+            ImportTime(name.strip(), int(self_us), int(cumulative_us), depth)
+        )
+    return imports
+
+
+def measure_startup():
+    """
+    Import the app and call create_app in a new interpreter.
+    Return (import seconds, create_app seconds, [ImportTime, ...]).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_seconds, create_seconds = map(float, result.stdout.split()[-2:])
+    return import_seconds, create_seconds, parse_importtime(result.stderr)
+
+
+@click.command("importtime")
+@click.option("--top", default=15, show_default=True, help="Packages to list.")
+def importtime_command(top):
+    """Measure the cold start of the app and list the slowest imports."""
+    import_seconds, create_seconds, imports = measure_startup()
+
+    click.echo(
+        f"import app: {import_seconds * 1000:.0f} ms, "
+        f"create_app(): {create_seconds * 1000:.0f} ms"
+    )
+    # Top-level packages only: their cumulative time includes their submodules
+    packages = [i for i in imports if "." not in i.name]
+    packages.sort(key=lambda i: i.cumulative_us, reverse=True)
+    for item in packages[:top]:
+        click.echo(f"{item.cumulative_us / 1000:8.1f} ms  {item.name}")
@@ -0,0 +1,294 @@
+"""
+Materialized statistics: enrollments and exercises per course, number of users.
+
+The counters live in the "course_stats" and "stats_counters" tables and are
+updated by ORM events, with "x = x + delta" statements in the transaction of
+the change itself, so reading them never counts rows.
+
+Enrollments are made through the User.courses / Course.users relationships,
+whose "secondary" rows don't go through the UserCourse mapper: they are
+counted from the relationship history of the flushed objects instead.
+Rows written without the ORM (raw SQL, bulk inserts) are not counted, and
+databases created before this module have no counters: "flask stats
+rebuild" recomputes them all.
+"""
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, inspect, insert, select, update
+from sqlalchemy.orm import Session, contains_eager
+
+from app.extensions import db
+from app.models import Course, CourseStats, Exercise, StatsCounter, User, UserCourse
+
+course_stats = CourseStats.__table__
+counters = StatsCounter.__table__
+users_courses = UserCourse.__table__
+exercises = Exercise.__table__
+
+
+def _fresh_course_stats(course_id=None):
+    """SELECT the counters of the courses, computed from the tables."""
+
+    def count(table, *conditions):
+        return (
+            select(func.count())
+            .where(table.c.course_id == Course.__table__.c.course_id, *conditions)
+            .scalar_subquery()
+        )
+
+    query = select(
+        Course.__table__.c.course_id,
+        count(users_courses),
+        count(exercises),
+        count(exercises, exercises.c.flag_visible.is_(True)),
+    )
+    if course_id is not None:
+        query = query.where(Course.__table__.c.course_id == course_id)
+    return query
+
+
+def _fresh_users_count():
+    return select(func.count()).select_from(User.__table__)
+
+
+def _add_to_course(connection, course_id, **deltas):
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if course_id is None or not deltas:
+        return
+    connection.execute(
+        update(course_stats)
+        .where(course_stats.c.course_id == course_id)
+        .values({name: course_stats.c[name] + delta for name, delta in deltas.items()})
+    )
+
+
+def _add_users(connection, delta):
+    connection.execute(
+        update(counters)
+        .where(counters.c.name == "users")
+        .values(value=counters.c.value + delta)
+    )
+
+
+def _old_value(target, attribute):
+    """The value of "attribute" before the flush."""
+    history = inspect(target).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attribute)
+
+
+@event.listens_for(counters, "after_create")
+def _create_counters(target, connection, **kwargs):
+    connection.execute(insert(counters).values(name="users", value=0))
+
+
+# Courses
+
+
+@event.listens_for(Course, "after_insert")
+def _course_created(mapper, connection, target):
+    connection.execute(insert(course_stats).values(course_id=target.course_id))
+
+
+@event.listens_for(Course, "after_delete")
+def _course_deleted(mapper, connection, target):
+    # Not left to ON DELETE CASCADE: SQLite only applies it with foreign keys on
+    connection.execute(
+        course_stats.delete().where(course_stats.c.course_id == target.course_id)
+    )
+
+
+# Exercises
+
+
+@event.listens_for(Exercise, "after_insert")
+def _exercise_created(mapper, connection, target):
+    _add_to_course(
+        connection,
+        target.course_id,
+        exercises=1,
+        visible_exercises=int(bool(target.flag_visible)),
+    )
+
+
+@event.listens_for(Exercise, "after_update")
+def _exercise_updated(mapper, connection, target):
+    old_course = _old_value(target, "course_id")
+    old_visible = bool(_old_value(target, "flag_visible"))
+    visible = bool(target.flag_visible)
+    if old_course == target.course_id and old_visible == visible:
+        return
+    _add_to_course(
+        connection, old_course, exercises=-1, visible_exercises=-int(old_visible)
+    )
+    _add_to_course(
+        connection, target.course_id, exercises=1, visible_exercises=int(visible)
+    )
+
+
+@event.listens_for(Exercise, "after_delete")
+def _exercise_deleted(mapper, connection, target):
+    _add_to_course(
+        connection,
+        _old_value(target, "course_id"),
+        exercises=-1,
+        visible_exercises=-int(bool(_old_value(target, "flag_visible"))),
+    )
+
+
+# Users and enrollments
+
+
+@event.listens_for(User, "after_insert")
+def _user_created(mapper, connection, target):
+    _add_users(connection, 1)
+
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, target):
+    _add_users(connection, -1)
+
+
+@event.listens_for(UserCourse, "after_insert")
+def _enrollment_created(mapper, connection, target):
+    _add_to_course(connection, target.course_id, enrollments=1)
+
+
+@event.listens_for(UserCourse, "after_delete")
+def _enrollment_deleted(mapper, connection, target):
+    _add_to_course(connection, _old_value(target, "course_id"), enrollments=-1)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_enrollments(session, flush_context, instances):
+    """
+    Collect the (user, course) links the flush will add and remove. Both
+    sides of the relationship may show the same link: sets merge them.
+    """
+    added, removed = set(), set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, User):
+            attribute, pair = "courses", lambda other: (obj, other)
+        elif isinstance(obj, Course):
+            attribute, pair = "users", lambda other: (other, obj)
+        else:
+            continue
+
+        state = inspect(obj)
+        if obj in session.deleted:
+            # Every remaining link of a deleted object goes with it
+            history = state.attrs[attribute].load_history()
+            removed.update(map(pair, [*history.unchanged, *history.deleted]))
+        else:
+            history = state.attrs[attribute].history
+            added.update(map(pair, history.added))
+            removed.update(map(pair, history.deleted))
+    session.info["enrollment_changes"] = (added, removed)
+
+
+@event.listens_for(Session, "after_flush")
+def _count_enrollments(session, flush_context):
+    added, removed = session.info.pop("enrollment_changes", (set(), set()))
+    deltas = {}
+    for links, delta in ((added, 1), (removed, -1)):
+        for user, course in links:
+            # A deleted course takes its counters with it
+            if course not in session.deleted:
+                deltas[course.course_id] = deltas.get(course.course_id, 0) + delta
+
+    for course_id, delta in sorted(deltas.items()):
+        _add_to_course(session.connection(), course_id, enrollments=delta)
+
+
+# Reading
+
+
+def totals():
+    """Return the application-wide numbers, in a single query."""
+    users = select(counters.c.value).where(counters.c.name == "users").scalar_subquery()
+    row = db.session.execute(
+        select(
+            func.coalesce(users, 0),
+            func.count(),
+            func.coalesce(func.sum(course_stats.c.enrollments), 0),
+            func.coalesce(func.sum(course_stats.c.exercises), 0),
+            func.coalesce(func.sum(course_stats.c.visible_exercises), 0),
+        ).select_from(course_stats)
+    ).one()
+    users, courses, enrollments, exercises_count, visible = row
+    return {
+        "users": users,
+        "courses": courses,
+        "enrollments": enrollments,
+        "exercises": exercises_count,
+        "visible_exercises": visible,
+        "hidden_exercises": exercises_count - visible,
+    }
+
+
+def courses_stats(course_ids=None):
+    """Return the CourseStats of every course (or of the given ones), by name."""
+    query = CourseStats.query.join(Course).options(contains_eager(CourseStats.course))
+    if course_ids is not None:
+        query = query.filter(CourseStats.course_id.in_(course_ids))
+    return query.order_by(Course.name).all()
+
+
+# Repairing
+
+
+def rebuild_stats():
+    """Recompute every counter from the tables. Return how many were wrong."""
+    connection = db.session.connection()
+    fresh = {
+        row[0]: tuple(row[1:]) for row in connection.execute(_fresh_course_stats())
+    }
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in connection.execute(
+            select(
+                course_stats.c.course_id,
+                course_stats.c.enrollments,
+                course_stats.c.exercises,
+                course_stats.c.visible_exercises,
+            )
+        )
+    }
+    repaired = sum(
+        fresh.get(course_id) != stored.get(course_id)
+        for course_id in fresh.keys() | stored.keys()
+    )
+
+    connection.execute(course_stats.delete())
+    connection.execute(
+        insert(course_stats).from_select(
+            ["course_id", "enrollments", "exercises", "visible_exercises"],
+            _fresh_course_stats(),
+        )
+    )
+
+    users = connection.execute(_fresh_users_count()).scalar()
+    stored_users = connection.execute(
+        select(counters.c.value).where(counters.c.name == "users")
+    ).scalar()
+    if users != stored_users:
+        repaired += 1
+        connection.execute(counters.delete().where(counters.c.name == "users"))
+        connection.execute(insert(counters).values(name="users", value=users))
+
+    db.session.commit()
+    return repaired
+
+
+@click.group("stats", help="Manage the dashboard statistics.")
+def stats_cli():
+    pass
+
+
+@stats_cli.command("rebuild")
+@with_appcontext
+def rebuild_command():
+    """Recompute the statistics counters from the tables."""
+    click.echo(f"{rebuild_stats()} counters repaired.")
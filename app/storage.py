@@ -0,0 +1,255 @@
+"""
+Where the uploaded exercise files are kept.
+
+Files are addressed by keys like "<course>/<file name>", whatever the backend
+selected by STORAGE_BACKEND:
+    local   the UPLOAD_FOLDER of this host (or a network share)
+    s3      a bucket of an S3-compatible object store (AWS, MinIO...), needs
+            boto3. Downloads are redirected to presigned URLs, so the store
+            sends the bytes; the app itself reads through app/filecache.py.
+
+Upload, download and listing all go through get_storage(), so the app runs
+the same on one node with a local folder and on many nodes sharing a bucket.
+"""
+
+import os
+import posixpath
+import shutil
+import tempfile
+from urllib.parse import quote
+
+from flask import current_app
+
+from config import basedir
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def upload_path(*parts):
+    """Return the absolute path of "parts" inside the configured upload folder."""
+    return os.path.join(basedir, current_app.config["UPLOAD_FOLDER"], *parts)
+
+
+def storage_key(*parts):
+    """Join "parts" into a key, refusing anything that could escape the store."""
+    key = posixpath.join(*parts)
+    if (
+        not key
+        or "\\" in key
+        or key.startswith("/")
+        or posixpath.normpath(key) != key.rstrip("/")
+        or ".." in key.split("/")
+    ):
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return key
+
+
+def key_from_path(path):
+    """
+    The key of an Exercise.exercise_path. Older rows hold absolute paths,
+    which have to be inside UPLOAD_FOLDER: the key of a path outside of it
+    starts with "..", and storage_key() refuses it.
+    """
+    if os.path.isabs(path):
+        path = os.path.relpath(path, upload_path())
+    return path.replace(os.sep, "/")
+
+
+def copy_atomically(stream, path, chunk_size=CHUNK_SIZE):
+    """Write "stream" to "path" through a temporary file: never half a file."""
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            shutil.copyfileobj(stream, file, chunk_size)
+            size = file.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return size
+
+
+class LocalStorage:
+    """
+    Files in a folder: UPLOAD_FOLDER unless another root is given. With a
+    FileCache, local_path() returns copies on the cache's (faster) disk.
+    """
+
+    def __init__(self, root=None, cache=None):
+        self.root = root
+        self.cache = cache
+
+    def _path(self, key):
+        return os.path.join(self.root or upload_path(), *key.split("/"))
+
+    def local_path(self, key, version=None):
+        """
+        A path of the file on this host, for send_file() and friends.
+        "version" (e.g. the SHA-256 of the content) spares the cache a stat().
+        """
+        if self.cache is None:
+            return self._path(key)
+        return self.cache.path(
+            key, version or self.version(key), lambda: self.open(key)
+        )
+
+    def version(self, key):
+        stat = os.stat(self._path(key))
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def save(self, key, stream):
+        """Stream "stream" into the file "key". Return the number of bytes."""
+        return copy_atomically(stream, self._path(key))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def listdir(self, prefix=""):
+        """The names of the files and folders right under "prefix"."""
+        path = self._path(prefix) if prefix else self.root or upload_path()
+        return sorted(name for name in os.listdir(path) if not name.startswith("."))
+
+    def makedirs(self, prefix):
+        os.makedirs(self._path(prefix), exist_ok=True)
+
+    def delete(self, key):
+        os.remove(self._path(key))
+
+    def url(self, key, filename=None):
+        """No direct URL: the app sends the file itself."""
+        return None
+
+
+class S3Storage:
+    """
+    Files in an S3 bucket, under "prefix". A key "course/" (an empty object)
+    stands for an empty course folder.
+    """
+
+    def __init__(self, bucket, prefix="", client=None, cache=None, expires=300):
+        if client is None:
+            import boto3
+
+            client = boto3.client(
+                "s3", endpoint_url=current_app.config["STORAGE_S3_ENDPOINT_URL"]
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache = cache
+        self.expires = expires
+
+    def _name(self, key):
+        return self.prefix + key
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._name(key))
+        except self.client.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def local_path(self, key, version=None):
+        if self.cache is None:
+            raise RuntimeError("S3Storage needs a FileCache for local paths")
+        return self.cache.path(
+            key, version or self.version(key), lambda: self.open(key)
+        )
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._name(key))["Body"]
+
+    def save(self, key, stream):
+        # upload_fileobj() sends large files in parts, never all in memory
+        self.client.upload_fileobj(stream, self.bucket, self._name(key))
+        return self._head(key)["ContentLength"]
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def version(self, key):
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        return head["ETag"].strip('"')
+
+    def listdir(self, prefix=""):
+        prefix = self._name(prefix.rstrip("/") + "/" if prefix else "")
+        names, token = set(), None
+        while True:
+            page = self.client.list_objects_v2(
+                Bucket=self.bucket,
+                Prefix=prefix,
+                Delimiter="/",
+                **({"ContinuationToken": token} if token else {}),
+            )
+            for folder in page.get("CommonPrefixes", []):
+                names.add(folder["Prefix"][len(prefix) :].rstrip("/"))
+            for item in page.get("Contents", []):
+                names.add(item["Key"][len(prefix) :])
+            if not page.get("IsTruncated"):
+                break
+            token = page["NextContinuationToken"]
+        names.discard("")
+        return sorted(names)
+
+    def makedirs(self, prefix):
+        self.client.put_object(
+            Bucket=self.bucket, Key=self._name(prefix.rstrip("/") + "/"), Body=b""
+        )
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._name(key))
+
+    def url(self, key, filename=None):
+        """A presigned URL, valid for "expires" seconds, to download the file."""
+        filename = quote(filename or posixpath.basename(key))
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._name(key),
+                "ResponseContentDisposition": f"attachment; filename*=UTF-8''{filename}",
+            },
+            ExpiresIn=self.expires,
+        )
+
+
+def create_storage(app, cache=None):
+    backend = app.config["STORAGE_BACKEND"]
+    if backend == "local":
+        return LocalStorage(cache=cache)
+    if backend == "s3":
+        with app.app_context():
+            return S3Storage(
+                app.config["STORAGE_S3_BUCKET"],
+                prefix=app.config["STORAGE_S3_PREFIX"],
+                cache=cache,
+                expires=app.config["STORAGE_PRESIGNED_EXPIRES"],
+            )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+def init_storage(app):
+    from app.filecache import FileCache
+
+    # Remote files always need local copies, local ones only on slow disks
+    cache = None
+    if app.config["STORAGE_BACKEND"] != "local" or app.config["FILE_CACHE_LOCAL"]:
+        cache = FileCache(
+            os.path.join(basedir, app.config["FILE_CACHE_FOLDER"]),
+            app.config["FILE_CACHE_MAX_BYTES"],
+        )
+        app.extensions["file_cache"] = cache
+    app.extensions["storage"] = create_storage(app, cache)
+
+
+def get_storage():
+    """The storage backend of the current app."""
+    return current_app.extensions["storage"]
@@ -0,0 +1,76 @@
+"""
+Mirroring of course folders by the lab machines.
+
+A client posts the exercises of a course it has, as {"number": sha256}, to
+/api/courses/<id>/sync and gets what to do to match the server:
+    add      the manifest entries of the exercises it lacks
+    update   those whose file has changed
+    delete   the numbers it has that the course no longer does
+    pending  the numbers it has whose new upload isn't hashed yet: ask again
+The plan is computed from the manifest of the course (app/manifests.py),
+without reading the exercises table nor any file.
+
+It then posts the numbers to add and update to /api/courses/<id>/files, and
+gets all the files in one streamed tar archive: the members are named like
+the files of the course folder, and carry the number and the SHA-256 of the
+exercise in the "EXERCISE.number" and "EXERCISE.sha256" PAX headers.
+"""
+
+import os
+import tarfile
+import time
+
+TAR_BLOCK = 512
+CHUNK_SIZE = 64 * 1024
+
+
+def plan_sync(entries, have):
+    """
+    The changes turning the files "have" ({number: sha256}) into the
+    manifest entries of a course.
+    """
+    plan = {"add": [], "update": [], "delete": [], "pending": [], "unchanged": 0}
+    numbers = set()
+    for entry in entries:
+        number = entry["number"]
+        numbers.add(number)
+        if number not in have:
+            plan["add"].append(entry)
+        elif entry["sha256"] is None:
+            plan["pending"].append(number)
+        elif entry["sha256"] != have[number]:
+            plan["update"].append(entry)
+        else:
+            plan["unchanged"] += 1
+    plan["delete"] = sorted(set(have) - numbers)
+    return plan
+
+
+def _member_header(name, size, pax_headers):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = int(time.time())
+    info.pax_headers = pax_headers
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def tar_stream(files, chunk_size=CHUNK_SIZE):
+    """
+    Yield a tar archive of "files", (name, path, PAX headers) tuples, one
+    chunk at a time: the files are read as the archive is sent.
+    """
+    for name, path, pax_headers in files:
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            yield _member_header(name, size, pax_headers)
+            remaining = size
+            while remaining:
+                chunk = file.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise OSError(f"{path} was truncated while sent")
+                remaining -= len(chunk)
+                yield chunk
+        yield b"\0" * (-size % TAR_BLOCK)
+    # The end of the archive: two empty blocks
+    yield b"\0" * (2 * TAR_BLOCK)
@@ -0,0 +1,60 @@
+"""
+Jobs run by the queue in app/jobs.py.
+
+"process_exercise" is enqueued by "save_exercise_file" after every upload, so
+that the expensive post-processing doesn't delay the teacher's response.
+Other parts of the app can hook into it through the "exercise_processed" signal.
+"""
+
+import hashlib
+import mmap
+import os
+
+from blinker import Namespace
+
+from app.extensions import db
+from app.jobs import task
+from app.models import Exercise
+
+signals = Namespace()
+
+# Sent with the Exercise once its file has been post-processed
+exercise_processed = signals.signal("exercise-processed")
+
+
+def file_sha256(path, chunk_size=1024 * 1024, mmap_min_size=None):
+    """
+    Hash a file without loading it in memory. Files of "mmap_min_size" bytes
+    or more are mapped instead of read, which saves copying them.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if mmap_min_size is not None and size and size >= mmap_min_size:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                digest.update(mapped)
+        else:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@task("process_exercise")
+def process_exercise(exercise_id):
+    """Compute the checksum and size of an uploaded exercise file."""
+    from app.helpers import exercise_file_path
+
+    exercise = db.session.get(Exercise, exercise_id)
+    if exercise is None:
+        # The exercise has been deleted in the meantime: nothing to do
+        return
+
+    path = exercise_file_path(exercise)
+    with open(path, "rb") as file:
+        exercise.size = file.seek(0, 2)
+    exercise.sha256 = file_sha256(path)
+    db.session.commit()
+
+    exercise_processed.send(exercise)
@@ -0,0 +1,273 @@
+"""
+History of the files of the exercises, and binary deltas between versions.
+
+A teacher re-uploading an exercise replaces its file. Once an upload has been
+processed ("exercise_processed"), a copy of the file is kept under
+"<course>/.versions/<sha256><extension>" with an ExerciseVersion row, and the
+"compute_exercise_delta" job computes the delta from the version before it.
+
+Clients holding a version name it in If-None-Match when they download the
+file from /api/exercises/<id>/file, and take deltas with "A-IM: exdelta"
+(the delta encoding of RFC 3229): the answer is 304 for the current version,
+226 with the delta for the one before it, or the whole file.
+
+A delta copies the byte ranges the new file shares with the old one, and
+includes the bytes in between. Both files are cut into chunks after each
+newline byte, lines of text and about 256 bytes of compressed data, and the
+chunks are matched with difflib: an insertion only changes the chunks around
+it. The format, compressed with zlib:
+
+    b"EXD1", the SHA-256 of the base and of the result (32 bytes each), then
+    b"C" offset length     copy "length" bytes of the base from "offset"
+    b"I" length data       insert the "length" bytes of "data"
+    until the end, the numbers being 8-byte unsigned big-endian integers.
+
+apply_delta() is the reference implementation for the clients.
+"""
+
+import difflib
+import hashlib
+import io
+import itertools
+import posixpath
+import struct
+import zlib
+
+import click
+from flask import Response, current_app, request, send_file
+from flask.cli import with_appcontext
+from werkzeug.http import quote_etag
+
+from app.extensions import db
+from app.jobs import enqueue, task
+from app.models import Exercise, ExerciseVersion
+from app.storage import get_storage, storage_key
+from app.tasks import exercise_processed
+
+DELTA_FORMAT = "exdelta"
+MAGIC = b"EXD1"
+HEADER = struct.Struct(">4s32s32s")
+COPY = struct.Struct(">cQQ")
+INSERT = struct.Struct(">cQ")
+
+
+class DeltaError(ValueError):
+    """Raised when a delta can't be applied to the given base."""
+
+
+def _chunks(data):
+    return data.splitlines(keepends=True)
+
+
+def make_delta(base, target):
+    """The delta turning the bytes "base" into the bytes "target"."""
+    base_chunks, target_chunks = _chunks(base), _chunks(target)
+    offsets = list(itertools.accumulate(map(len, base_chunks), initial=0))
+    parts = [
+        HEADER.pack(
+            MAGIC, hashlib.sha256(base).digest(), hashlib.sha256(target).digest()
+        )
+    ]
+    matcher = difflib.SequenceMatcher(None, base_chunks, target_chunks)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            parts.append(COPY.pack(b"C", offsets[i1], offsets[i2] - offsets[i1]))
+        elif j2 > j1:
+            data = b"".join(target_chunks[j1:j2])
+            parts += [INSERT.pack(b"I", len(data)), data]
+    return zlib.compress(b"".join(parts), 9)
+
+
+def apply_delta(base, delta):
+    """Rebuild the file a delta was made for, from its base."""
+    try:
+        data = zlib.decompress(delta)
+        magic, base_sha256, target_sha256 = HEADER.unpack_from(data)
+    except (zlib.error, struct.error) as error:
+        raise DeltaError(f"Not a delta: {error}") from error
+    if magic != MAGIC:
+        raise DeltaError("Not a delta")
+    if hashlib.sha256(base).digest() != base_sha256:
+        raise DeltaError("The delta applies to another version")
+
+    parts, position = [], HEADER.size
+    while position < len(data):
+        instruction = data[position : position + 1]
+        if instruction == b"C":
+            _, offset, length = COPY.unpack_from(data, position)
+            parts.append(base[offset : offset + length])
+            position += COPY.size
+        elif instruction == b"I":
+            _, length = INSERT.unpack_from(data, position)
+            position += INSERT.size
+            parts.append(data[position : position + length])
+            position += length
+        else:
+            raise DeltaError(f"Unknown instruction {instruction!r}")
+    target = b"".join(parts)
+    if hashlib.sha256(target).digest() != target_sha256:
+        raise DeltaError("The result doesn't match its checksum")
+    return target
+
+
+# Recording the versions
+
+
+def version_key(exercise, sha256):
+    """The storage key of the copy of a version of the file of an exercise."""
+    from app.helpers import exercise_key
+
+    folder, name = posixpath.split(exercise_key(exercise))
+    return storage_key(folder, ".versions", sha256 + posixpath.splitext(name)[1])
+
+
+def record_version(exercise):
+    """
+    Keep a copy of the current file of a processed exercise as its latest
+    version. Return the new ExerciseVersion, or None if the file is unchanged.
+    """
+    from app.helpers import exercise_file_path
+
+    latest = exercise.versions[-1] if exercise.versions else None
+    if exercise.sha256 is None or (latest and latest.sha256 == exercise.sha256):
+        return None
+
+    storage = get_storage()
+    key = version_key(exercise, exercise.sha256)
+    # Copies are named after their content: an upload of a former version
+    #   finds it there already
+    if not storage.exists(key):
+        with open(exercise_file_path(exercise), "rb") as file:
+            storage.save(key, file)
+    version = ExerciseVersion(
+        exercise=exercise, sha256=exercise.sha256, size=exercise.size, blob_key=key
+    )
+    db.session.add(version)
+    return version
+
+
+@exercise_processed.connect
+def _record_processed_version(exercise):
+    version = record_version(exercise)
+    db.session.commit()
+    if version is not None and len(exercise.versions) > 1:
+        enqueue("compute_exercise_delta", version_id=version.version_id)
+
+
+def _read(key):
+    with get_storage().open(key) as file:
+        return file.read()
+
+
+@task("compute_exercise_delta")
+def compute_exercise_delta(version_id):
+    """Store the delta from the version before "version_id" to it, if it pays."""
+    version = db.session.get(ExerciseVersion, version_id)
+    if version is None:
+        return
+    previous = (
+        ExerciseVersion.query.filter(
+            ExerciseVersion.exercise_id == version.exercise_id,
+            ExerciseVersion.version_id < version.version_id,
+        )
+        .order_by(ExerciseVersion.version_id.desc())
+        .first()
+    )
+    config = current_app.config
+    if previous is None or (
+        max(previous.size, version.size) > config["DELTA_MAX_SIZE"]
+    ):
+        return
+
+    delta = make_delta(_read(previous.blob_key), _read(version.blob_key))
+    if len(delta) > version.size * config["DELTA_MAX_RATIO"]:
+        return
+    folder = posixpath.dirname(version.blob_key)
+    key = storage_key(folder, f"{previous.sha256[:16]}-{version.sha256[:16]}.delta")
+    get_storage().save(key, io.BytesIO(delta))
+    version.base_sha256 = previous.sha256
+    version.delta_key = key
+    version.delta_size = len(delta)
+    db.session.commit()
+
+
+# Serving
+
+
+def held_versions():
+    """The SHA-256 of the versions the client names in If-None-Match."""
+    # The ETags of the compressed variants are "<sha256>.<encoding>"
+    tags = request.if_none_match.as_set(include_weak=True)
+    return {tag.split(".")[0] for tag in tags}
+
+
+def accepts_delta():
+    instance_manipulations = request.headers.get("A-IM", "")
+    return DELTA_FORMAT in (
+        value.split(";")[0].strip().lower()
+        for value in instance_manipulations.split(",")
+    )
+
+
+def delta_response(exercise):
+    """
+    Answer a client holding the current version of the file of an exercise
+    (304), or the one before it if it takes deltas (226 and the delta).
+    Return None when the whole file has to be sent.
+    """
+    from app.helpers import exercise_download_name
+
+    held = held_versions()
+    if exercise.sha256 is None or not held:
+        return None
+    if exercise.sha256 in held:
+        response = Response(status=304)
+        response.set_etag(exercise.sha256)
+        return response
+    if not accepts_delta():
+        return None
+
+    version = (
+        ExerciseVersion.query.filter_by(
+            exercise_id=exercise.exercise_id, sha256=exercise.sha256
+        )
+        .order_by(ExerciseVersion.version_id.desc())
+        .first()
+    )
+    if version is None or version.delta_key is None or version.base_sha256 not in held:
+        return None
+    response = send_file(
+        get_storage().local_path(version.delta_key, version=version.sha256),
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"{exercise_download_name(exercise)}.{DELTA_FORMAT}",
+        etag=exercise.sha256,
+        conditional=False,
+    )
+    response.status_code = 226
+    response.headers["IM"] = DELTA_FORMAT
+    response.headers["Delta-Base"] = quote_etag(version.base_sha256)
+    # Caches unaware of RFC 3229 must not store a delta as the file
+    response.headers["Cache-Control"] = "no-store, im"
+    return response
+
+
+@click.group("versions", help="Manage the history of the exercise files.")
+def versions_cli():
+    pass
+
+
+@versions_cli.command("list")
+@click.argument("exercise_id", type=int)
+@with_appcontext
+def list_command(exercise_id):
+    """Show the versions of an exercise, oldest first."""
+    exercise = db.session.get(Exercise, exercise_id)
+    if exercise is None:
+        raise click.ClickException(f"No exercise {exercise_id}.")
+    for version in exercise.versions:
+        delta = f", delta of {version.delta_size} bytes" if version.delta_key else ""
+        click.echo(
+            f"{version.created_at:%Y-%m-%d %H:%M} {version.sha256[:12]} "
+            f"{version.size} bytes{delta}"
+        )
@@ -1,18 +1,19 @@
-import os
-import re
-
-from flask import flash, redirect, session, url_for
-from flask_admin.base import BaseView, expose
+from flask import current_app, flash, redirect, request, session, url_for
+from flask_admin.base import AdminIndexView, BaseView, expose
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import BaseSQLAFilter
 from flask_login import login_required
-from flask_security import current_user, hash_password, roles_required
+from flask_security import hash_password
 from app.helpers import (
     process_download_form,
     handle_download,
     handle_course_selection,
     validate_upload_form,
     save_exercise_file,
+    enrollment_page,
 )
+from app.analytics import WINDOWS, course_load, top_exercises
+from app.audit import audit_log
 from app.extensions import db
 from app.forms import (
     CourseSearchForm,
@@ -20,18 +21,85 @@ from app.forms import (
     ExtendedRegisterForm,
     UploadExerciseForm,
 )
-from app.models import Course, User, Role
-from config import Config, basedir
+from app.models import Course, Role, User, UserCourse, UserRoles
+from app.rbac import Permission, can, permission_required
+from app.search import suggestions
+from app.stats import courses_stats, totals
+from app.storage import get_storage
+from sqlalchemy import func, inspect, select
+from sqlalchemy.orm import with_expression
+
+
+def flash_suggestions(query, kind):
+    """Point the user to the closest matches after a search miss."""
+    labels = suggestions(query, kind)
+    if labels:
+        flash(f"Did you mean: {', '.join(labels)}?", "error")
+
+
+class DashboardView(AdminIndexView):
+    @expose("/")
+    def index(self):
+        # Read from the materialized counters: two queries, whatever the data
+        if can(Permission.ADMIN):
+            return self.render(
+                "admin/index.html", totals=totals(), courses_stats=courses_stats()
+            )
+        return self.render("admin/index.html")
+
+
+# Separates the names aggregated by _joined_names()
+NAME_SEPARATOR = "\x1f"
+
+
+def _joined_names(target, link):
+    """
+    Correlated subquery: the names of the roles or courses ("target") linked
+    to each user by "link", in one string.
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        aggregate = func.string_agg(target.name, NAME_SEPARATOR)
+    else:
+        aggregate = func.group_concat(target.name, NAME_SEPARATOR)
+    primary_key = inspect(target).primary_key[0]
+    return (
+        select(aggregate)
+        .join(link, getattr(link, primary_key.name) == primary_key)
+        .where(link.user_id == User.user_id)
+        .scalar_subquery()
+    )
+
+
+class NameFilter(BaseSQLAFilter):
+    """
+    The users linked to the role or course of the given name. A semi-join on
+    the (role_id, user_id) or (course_id, user_id) index: never duplicates.
+    """
+
+    def __init__(self, target, link, name):
+        super().__init__(User.user_id, name)
+        self.target = target
+        self.link = link
+        self.key_name = name
+
+    def apply(self, query, value, alias=None):
+        primary_key = inspect(self.target).primary_key[0]
+        return query.filter(
+            User.user_id.in_(
+                select(self.link.user_id)
+                .join(self.target, getattr(self.link, primary_key.name) == primary_key)
+                .where(self.target.name == value)
+            )
+        )
+
+    def operation(self):
+        return "equals"
 
 
 class UserAdminView(ModelView):
     # Customized from BaseView
     def is_accessible(self):
-        return (
-            current_user.is_active
-            and current_user.is_authenticated
-            and any(role.name == "administrator" for role in current_user.roles)
-        )
+        return can(Permission.ADMIN)
 
     # Customized from BaseView
     def _handle_view(self, name):
@@ -39,39 +107,97 @@ class UserAdminView(ModelView):
             return redirect(url_for("security.login"))
 
     @staticmethod
-    def _display_roles(view, context, model, name):
-        return ", ".join([role.name.capitalize() for role in model.roles])
-
-    @staticmethod
-    def _display_courses(view, context, model, name):
-        return ", ".join([course.name.capitalize() for course in model.courses])
+    def _display_names(view, context, model, name):
+        names = getattr(model, name)
+        if not names:
+            return ""
+        return ", ".join(sorted(n.capitalize() for n in names.split(NAME_SEPARATOR)))
 
     # Attribute of the ModelView class
     # Customize the display of the columns
-    column_formatters = {"Courses": _display_courses, "roles": _display_roles}
+    column_formatters = {"course_names": _display_names, "role_names": _display_names}
+
+    list_template = "admin/user_list.html"
+
+    # Customized from BaseModelView: the names of the roles and courses of
+    #   each user come from subqueries, evaluated for the rows of the page only
+    def get_query(self):
+        return (
+            super()
+            .get_query()
+            .options(
+                with_expression(User.role_names, _joined_names(Role, UserRoles)),
+                with_expression(User.course_names, _joined_names(Course, UserCourse)),
+            )
+            # The logged in administrator is already in the session
+            .execution_options(populate_existing=True)
+        )
+
+    # Customized from BaseModelView
+    def get_list(
+        self,
+        page,
+        sort_column,
+        sort_desc,
+        search,
+        filters,
+        execute=True,
+        page_size=None,
+    ):
+        if search or filters:
+            return super().get_list(
+                page, sort_column, sort_desc, search, filters, execute, page_size
+            )
+        # Unfiltered, the total comes from the users counter instead of a
+        #   COUNT(*) over the whole table
+        query, _ = self._apply_sorting(self.get_query(), {}, sort_column, sort_desc)
+        query = self._apply_pagination(query, page, page_size)
+        return totals()["users"], query.all() if execute else query
+
+    # Customized from BaseModelView: "?after=<username>" starts the page right
+    #   after that user, in username order, instead of skipping OFFSET rows
+    def _apply_pagination(self, query, page, page_size):
+        after = request.args.get("after")
+        if after is None or "sort" in request.args:
+            return super()._apply_pagination(query, page, page_size)
+        return super()._apply_pagination(
+            query.filter(User.username > after), 0, page_size
+        )
+
+    def next_page_url(self, data):
+        """URL of the page after the last user of "data", or None."""
+        page_size = self.page_size
+        if "sort" in request.args or not data or len(data) < page_size:
+            return None
+        args = request.args.to_dict()
+        args.pop("page", None)
+        args["after"] = data[-1].username
+        return self.get_url(".index_view", **args)
 
     form = ExtendedRegisterForm
 
     # Customized from BaseModelView
     def on_model_change(self, form, model, is_created):
         # Check if the model being changed is a User model and the current user is an administrator
-        if isinstance(model, User) and "administrator" in [
-            role.name for role in current_user.roles
-        ]:
+        if isinstance(model, User) and can(Permission.ADMIN):
             # Check if password field is present in the form and has a value
             if "password" in form and form.password.data:
                 # Hash the password before saving it to the database
                 model.password = hash_password(form.password.data)
+                if not is_created:
+                    audit_log.record("user.password_reset", target=model.username)
 
     # Actual columns' title as seen in the website
-    column_list = ("username", "Courses", "active", "roles")
-
-    # Link the columns' title and the model class attribute, so to make data sortable
-    column_sortable_list = (
-        "username",
-        ("Courses", "courses.name"),
-        "active",
-        ("roles", "roles.name"),
+    column_list = ("username", "course_names", "active", "role_names")
+    column_labels = {"course_names": "Courses", "role_names": "Roles"}
+
+    # Sorting by the aggregated names would have to compute them for every user
+    column_sortable_list = ("username", "active")
+    column_default_sort = "username"
+
+    column_filters = (
+        NameFilter(Role, UserRoles, "Role"),
+        NameFilter(Course, UserCourse, "Course"),
     )
 
 
@@ -84,7 +210,7 @@ class CourseAdminView(BaseView):
 
     @expose("/admin/course/", methods=["GET", "POST"])
     @login_required
-    @roles_required("administrator")
+    @permission_required(Permission.ADMIN)
     def courses_default_table(self):
         search_form = CourseSearchForm()
 
@@ -144,7 +270,7 @@ class CourseAdminView(BaseView):
 
     @expose("/users-table/<selected_user>", methods=["GET", "POST"])
     @login_required
-    @roles_required("administrator")
+    @permission_required(Permission.ADMIN)
     def selected_user(self, selected_user):
         search_form = CourseSearchForm()
 
@@ -154,6 +280,7 @@ class CourseAdminView(BaseView):
         # Check if the provided selected_user exists in the list of all users
         if selected_user not in all_users:
             flash("Selected user not found.", "error")
+            flash_suggestions(selected_user, "user")
             return redirect(url_for("course_admin.courses_default_table"))
 
         # Find the index of the selected user in the list
@@ -219,38 +346,30 @@ class CourseAdminView(BaseView):
 
     @expose("/course/<course_name>", methods=["GET", "POST"])
     @login_required
-    @roles_required("administrator")
+    @permission_required(Permission.ADMIN)
     def selected_course_name(self, course_name):
         search_form = CourseSearchForm()
-        all_courses = sorted(Course.query.all(), key=lambda d: d.name, reverse=False)
-        all_users = {
-            course: sorted(
-                [user.username for user in course.users],
-                key=lambda x: tuple(
-                    int(part) if part.isdigit() else part
-                    for part in re.findall(r"\d+|\D+", x)
-                ),
-            )
-            for course in all_courses
-        }
         filtered_course = Course.query.filter_by(name=course_name).first()
         if filtered_course:
             return self.render(
                 "admin/matrix_course.html",
                 courses=[filtered_course],
-                all_users=all_users,
+                enrollments=enrollment_page(
+                    filtered_course,
+                    after=request.args.get("after", type=int),
+                    before=request.args.get("before", type=int),
+                    per_page=current_app.config["ENROLLMENTS_PER_PAGE"],
+                ),
+                course_stats=courses_stats([filtered_course.course_id]),
                 search_form=search_form,
             )
         else:
             flash("No courses found.", "error")
+            flash_suggestions(course_name, "course")
             return redirect(url_for("course_admin.courses_default_table"))
 
     def is_accessible(self):
-        return (
-            current_user.is_active
-            and current_user.is_authenticated
-            and any(role.name == "administrator" for role in current_user.roles)
-        )
+        return can(Permission.ADMIN)
 
     def _handle_view(self, name, **kwargs):
         # Adjust _handle_view to accept additional arguments
@@ -270,12 +389,12 @@ class UploadAdminView(BaseView):
 
     @expose("/admin/upload/", methods=["GET", "POST"])
     @login_required
-    @roles_required("administrator")
+    @permission_required(Permission.ADMIN)
     def upload(self):
         upload_form = UploadExerciseForm()
 
-        # Get list of courses from file system and sort them
-        courses = sorted(os.listdir(os.path.join(basedir, Config.UPLOAD_FOLDER)))
+        # List the course folders of the storage, sorted
+        courses = get_storage().listdir()
 
         upload_form.courses.choices = [(course, course) for course in courses]
         selected_course = None
@@ -311,11 +430,7 @@ class UploadAdminView(BaseView):
         return self.render("admin/upload.html", upload_form=upload_form)
 
     def is_accessible(self):
-        return (
-            current_user.is_active
-            and current_user.is_authenticated
-            and any(role.name == "administrator" for role in current_user.roles)
-        )
+        return can(Permission.ADMIN)
 
     def _handle_view(self, name, **kwargs):
         if not self.is_accessible():
@@ -329,12 +444,12 @@ class DownloadAdminView(BaseView):
 
     @expose("/admin/download/", methods=["GET", "POST"])
     @login_required
-    @roles_required("administrator")
+    @permission_required(Permission.ADMIN)
     def download(self):
         download_form = DownloadForm()
 
-        # Get list of courses from file system and sort them
-        courses = sorted(os.listdir(os.path.join(basedir, Config.UPLOAD_FOLDER)))
+        # List the course folders of the storage, sorted
+        courses = get_storage().listdir()
 
         # Handle file download if the form is submitted and valid
         process_download_form(download_form, courses)
@@ -349,12 +464,34 @@ class DownloadAdminView(BaseView):
         return self.render("admin/download.html", download_form=download_form)
 
     def is_accessible(self):
-        return (
-            current_user.is_active
-            and current_user.is_authenticated
-            and any(role.name == "administrator" for role in current_user.roles)
+        return can(Permission.ADMIN)
+
+    def _handle_view(self, name, **kwargs):
+        if not self.is_accessible():
+            return redirect(url_for("security.login"))
+
+
+class AnalyticsAdminView(BaseView):
+    @expose("/")
+    @login_required
+    @permission_required(Permission.ADMIN)
+    def index(self):
+        window = request.args.get("window", "24h")
+        if window not in WINDOWS:
+            window = "24h"
+        # Read from the rollups only: the cost doesn't grow with the downloads
+        return self.render(
+            "admin/analytics.html",
+            windows=WINDOWS,
+            window=window,
+            resolution=WINDOWS[window][0],
+            exercises=top_exercises(window),
+            courses=course_load(window),
         )
 
+    def is_accessible(self):
+        return can(Permission.ADMIN)
+
     def _handle_view(self, name, **kwargs):
         if not self.is_accessible():
             return redirect(url_for("security.login"))
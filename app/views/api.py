@@ -0,0 +1,224 @@
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
+from flask_login import login_required
+
+from app.analytics import WINDOWS, analytics, course_load, top_exercises
+from app.audit import audit_log
+from app.events import events_response
+from app.extensions import db
+from app.filecache import get_file_cache
+from app.helpers import exercise_download_name, exercise_file_path, send_exercise_file
+from app.manifests import course_manifests, manifests_etag
+from app.models import Course, Exercise, Job
+from app.natsort import natural_key
+from app.ratelimit import limiter
+from app.rbac import (
+    Permission,
+    can_access_course,
+    courses_in_scope,
+    permission_required,
+)
+from app.search import KINDS, search
+from app.stats import courses_stats, totals
+from app.sync import plan_sync, tar_stream
+from app.versions import delta_response
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+
+@api.route("/jobs/<int:job_id>")
+@login_required
+@permission_required(Permission.JOBS)
+def job_status(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+
+def _search_kinds():
+    kinds = request.args.getlist("kind")
+    if any(kind not in KINDS for kind in kinds):
+        abort(400)
+    return kinds or None
+
+
+@api.route("/search")
+@login_required
+@permission_required(Permission.ADMIN)
+def search_documents():
+    page = search(
+        request.args.get("q", ""),
+        kinds=_search_kinds(),
+        page=max(request.args.get("page", 1, type=int), 1),
+        per_page=max(min(request.args.get("per_page", 20, type=int), 100), 1),
+    )
+    return jsonify(page.to_dict())
+
+
+@api.route("/search/typeahead")
+@login_required
+@permission_required(Permission.ADMIN)
+def typeahead():
+    # Only the first few prefix matches: this is called on every keystroke
+    page = search(
+        request.args.get("q", ""),
+        kinds=_search_kinds(),
+        per_page=max(min(request.args.get("limit", 8, type=int), 20), 1),
+    )
+    return jsonify([result.to_dict() for result in page.results])
+
+
+@api.route("/stats")
+@login_required
+@permission_required(Permission.ADMIN)
+def stats():
+    return jsonify(
+        totals=totals(), courses=[course.to_dict() for course in courses_stats()]
+    )
+
+
+@api.route("/manifest")
+@login_required
+def manifest():
+    """The exercises of every course the user can reach, by course."""
+    courses = course_manifests(courses_in_scope())
+    response = jsonify(courses=courses)
+    response.set_etag(manifests_etag(courses))
+    return response.make_conditional(request)
+
+
+@api.route("/exercises/<int:exercise_id>/file")
+@login_required
+@permission_required(Permission.DOWNLOAD)
+def exercise_file(exercise_id):
+    """
+    The file of an exercise, or the delta from the version the client holds
+    (see app/versions.py).
+    """
+    exercise = db.session.get(Exercise, exercise_id)
+    if exercise is None or not can_access_course(exercise.course_id):
+        abort(404)
+    limiter.hit("download")
+
+    response = delta_response(exercise)
+    if response is None:
+        response = send_exercise_file(exercise, tag_version=True)
+    audit_log.record(
+        "exercise.download",
+        target=f"{exercise.course.name}/{exercise.number}",
+        status=response.status_code,
+    )
+    # A 304 sends nothing: the client already had the file
+    if response.status_code in (200, 226):
+        analytics.count_download(exercise, sent=response.content_length)
+    return limiter.hold("transfer", response)
+
+
+def _course_in_scope(course_id):
+    course = db.session.get(Course, course_id)
+    if course is None or not can_access_course(course_id):
+        abort(404)
+    return course
+
+
+@api.route("/courses/<int:course_id>/sync", methods=["POST"])
+@login_required
+@permission_required(Permission.DOWNLOAD)
+def sync_course(course_id):
+    """
+    What a mirror of the course holding the posted {number: sha256} files
+    has to change (see app/sync.py).
+    """
+    course = _course_in_scope(course_id)
+    have = request.get_json(silent=True)
+    if not isinstance(have, dict) or not all(
+        isinstance(sha256, str) for sha256 in have.values()
+    ):
+        abort(400)
+    [manifest] = course_manifests([course])
+    return jsonify(
+        course=course.name,
+        digest=manifest["digest"],
+        **plan_sync(manifest["exercises"], have),
+    )
+
+
+@api.route("/courses/<int:course_id>/files", methods=["POST"])
+@login_required
+@permission_required(Permission.DOWNLOAD)
+def course_files(course_id):
+    """The files of the posted list of exercise numbers, in one tar archive."""
+    course = _course_in_scope(course_id)
+    numbers = request.get_json(silent=True)
+    if not isinstance(numbers, list) or not all(
+        isinstance(number, str) for number in numbers
+    ):
+        abort(400)
+    limiter.hit("download")
+    # Numbers deleted since the plan was made are left out
+    exercises = sorted(
+        Exercise.query.filter(
+            Exercise.course_id == course.course_id, Exercise.number.in_(numbers)
+        ),
+        key=lambda exercise: natural_key(exercise.number),
+    )
+    audit_log.record("course.sync", target=course.name, files=len(exercises))
+    for exercise in exercises:
+        analytics.count_download(exercise)
+
+    def files():
+        for exercise in exercises:
+            pax_headers = {"EXERCISE.number": exercise.number}
+            if exercise.sha256:
+                pax_headers["EXERCISE.sha256"] = exercise.sha256
+            yield (
+                exercise_download_name(exercise),
+                exercise_file_path(exercise),
+                pax_headers,
+            )
+
+    response = Response(
+        stream_with_context(tar_stream(files())),
+        mimetype="application/x-tar",
+        headers={"Content-Disposition": f"attachment; filename=course-{course_id}.tar"},
+    )
+    return limiter.hold("transfer", response)
+
+
+@api.route("/courses/<int:course_id>/events")
+@login_required
+@permission_required(Permission.DOWNLOAD)
+def course_events(course_id):
+    """
+    The digests of the manifest of the course as it changes, as Server-Sent
+    Events or by long polling (see app/events.py).
+    """
+    return events_response(_course_in_scope(course_id))
+
+
+@api.route("/analytics/downloads")
+@login_required
+@permission_required(Permission.ADMIN)
+def download_analytics():
+    window = request.args.get("window", "24h")
+    if window not in WINDOWS:
+        abort(400)
+    return jsonify(
+        window=window,
+        resolution=WINDOWS[window][0],
+        exercises=top_exercises(
+            window, limit=min(request.args.get("limit", 10, type=int), 100)
+        ),
+        courses=course_load(window),
+    )
+
+
+@api.route("/cache")
+@login_required
+@permission_required(Permission.ADMIN)
+def file_cache_stats():
+    cache = get_file_cache()
+    if cache is None:
+        abort(404)
+    # The hits and misses are those of the worker process serving the request
+    return jsonify(cache.stats())
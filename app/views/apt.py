@@ -0,0 +1,63 @@
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    redirect,
+    send_file,
+    send_from_directory,
+)
+from flask_security import auth_required
+
+from app.analytics import analytics
+from app.apt import index_folder
+from app.models import Course, Exercise
+from app.ratelimit import limiter
+from app.rbac import Permission, can_access_course, permission_required
+from app.storage import get_storage, storage_key, upload_path
+
+apt = Blueprint("apt", __name__, url_prefix="/apt")
+
+INDEX_FILES = {"Packages", "Packages.gz", "Release"}
+
+
+# In production, the web server in front of the app can serve the same two
+#   folders directly (e.g. with nginx "alias"), without calling Python at all,
+#   as long as it asks the app first (e.g. with nginx "auth_request").
+# apt sends the credentials of /etc/apt/auth.conf with HTTP basic auth.
+@apt.route("/<course_name>/<filename>")
+@auth_required("basic", "session")
+@permission_required(Permission.DOWNLOAD)
+def repository_file(course_name, filename):
+    if not current_app.config["APT_REPOSITORY_ENABLED"]:
+        abort(404)
+    course = Course.query.filter_by(name=course_name).first()
+    if course is None or not can_access_course(course.course_id):
+        abort(404)
+
+    if filename in INDEX_FILES:
+        return send_from_directory(index_folder(course_name), filename, max_age=60)
+    if not filename.endswith(".deb"):
+        abort(404)
+
+    try:
+        key = storage_key(course_name, filename)
+    except ValueError:
+        abort(404)
+    exercise = Exercise.query.filter(
+        Exercise.course_id == course.course_id,
+        Exercise.exercise_path.in_([key, upload_path(course_name, filename)]),
+    ).first()
+    storage = get_storage()
+    if exercise is None or not storage.exists(key):
+        abort(404)
+    limiter.hit("download")
+    if current_app.config["STORAGE_PRESIGNED_DOWNLOADS"]:
+        url = storage.url(key)
+        if url:
+            analytics.count_download(exercise)
+            return redirect(url)
+    # Conditional responses (ETag / Last-Modified) are handled by Flask
+    response = send_file(storage.local_path(key), max_age=60)
+    if response.status_code == 200:
+        analytics.count_download(exercise)
+    return limiter.hold("transfer", response)
@@ -0,0 +1,19 @@
+import os
+
+from flask import Blueprint, jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.extensions import db
+
+health = Blueprint("health", __name__)
+
+
+# Polled by load balancers and "flask serve" deployments: no login, no HTML
+@health.route("/readyz")
+def readiness():
+    try:
+        db.session.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        return jsonify(status="unavailable", pid=os.getpid()), 503
+    return jsonify(status="ready", pid=os.getpid())
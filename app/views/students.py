@@ -4,12 +4,10 @@ import re
 from flask import Blueprint, flash, redirect, render_template, request, session, url_for
 from flask_login import current_user, login_required, login_user, logout_user
 from flask_security import verify_password
-from flask_wtf import FlaskForm
-from wtforms import PasswordField, StringField, SubmitField
-from wtforms.validators import InputRequired, Length
 
+from app.audit import audit_log
 from app.extensions import db
-from app.forms import DownloadForm, UploadExerciseForm
+from app.forms import DownloadForm, StudentLoginForm, UploadExerciseForm
 from app.helpers import (
     handle_download,
     process_download_form,
@@ -18,15 +16,10 @@ from app.helpers import (
     save_exercise_file,
 )
 from app.models import Course, Exercise, User
+from app.rbac import Permission, can, courses_in_scope
 from config import Config, basedir
 
 
-class LoginForm(FlaskForm):
-    username = StringField("Username", [InputRequired(), Length(min=4, max=20)])
-    password = PasswordField("Password", [InputRequired(), Length(min=8, max=20)])
-    submit = SubmitField("Login", render_kw={"class": "btn btn-primary"})
-
-
 students = Blueprint("students", __name__)
 
 
@@ -38,7 +31,7 @@ def home():
 
 @students.route("/student_login", methods=["GET", "POST"])
 def login():
-    form = LoginForm()
+    form = StudentLoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user and user.is_active:
@@ -46,17 +39,16 @@ def login():
                 login_user(user)
                 flash("Logged in successfully.")
                 next_page = request.args.get("next")
-                if next_page == url_for("admin.index") and "administrator" in [
-                    role.name for role in user.roles
-                ]:
+                if next_page == url_for("admin.index") and can(Permission.ADMIN, user):
                     next_page = url_for("admin.index")
                 elif next_page is None:
-                    if "administrator" in [role.name for role in user.roles]:
+                    if can(Permission.ADMIN, user):
                         next_page = url_for("admin.index")
                     else:
                         next_page = url_for("students.profile", username=user.username)
                 return redirect(next_page)
             else:
+                audit_log.record("login.failed", target=user.username)
                 flash("Wrong password - Try Again...")
         else:
             flash("Specified user does not exist")
@@ -70,11 +62,11 @@ def profile(username):
     if current_user.username != username:
         return render_template("errors/403.html"), 403
 
-    if "student" in current_user.roles:
+    if can(Permission.DOWNLOAD):
         download_form = DownloadForm()
 
-        # Get list of courses for the current user
-        courses = current_user.courses
+        # Get list of courses the current user may download from
+        courses = courses_in_scope()
 
         # Handle file download if the form is submitted and valid
         exercises = process_download_form(download_form, courses)
@@ -93,7 +85,7 @@ def profile(username):
             download_form=download_form,
         )
 
-    elif "teacher" in current_user.roles:
+    elif can(Permission.UPLOAD):
         upload_form = UploadExerciseForm()
 
         # Get list of courses for the current user
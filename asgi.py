@@ -0,0 +1,6 @@
+# ASGI entry point for the optional async download server.
+# Run it with any ASGI server, e.g. "uvicorn asgi:application --port 8001",
+#   and set ASYNC_DOWNLOAD_URL (e.g. "http://localhost:8001") for the Flask app.
+from app.async_downloads import create_asgi_app
+
+application = create_asgi_app()
@@ -0,0 +1,91 @@
+"""
+Measure the online copy of the database by "flask backup create", and what
+it costs the writers: a thread commits a row every few milliseconds during
+the copy, like uploads and the job workers would.
+
+The copy is made in steps of BACKUP_PAGES_PER_STEP pages, or in one step,
+of a database in the default rollback journal mode and in WAL mode.
+
+    python benchmarks/backup.py [database size in MiB]
+"""
+
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.backup import copy_database  # noqa: E402
+from config import Config  # noqa: E402
+
+WRITE_EVERY = 0.005  # seconds between two commits of the writer
+
+
+def populate(path, size, journal_mode):
+    connection = sqlite3.connect(path)
+    connection.execute(f"PRAGMA journal_mode={journal_mode}")
+    connection.execute("CREATE TABLE data (payload BLOB)")
+    connection.executemany(
+        "INSERT INTO data VALUES (randomblob(4000))",
+        ((),) * (size * 1024**2 // 4096),
+    )
+    connection.commit()
+    connection.close()
+
+
+def writer(path, stop, latencies):
+    connection = sqlite3.connect(path, timeout=60)
+    while not stop.is_set():
+        start = time.perf_counter()
+        connection.execute("INSERT INTO data VALUES (randomblob(100))")
+        connection.commit()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(WRITE_EVERY)
+    connection.close()
+
+
+def timed_copy(source, target, pages):
+    stop, latencies = threading.Event(), []
+    thread = threading.Thread(target=writer, args=(source, stop, latencies))
+    thread.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    size = copy_database(source, target, pages, Config.BACKUP_STEP_SLEEP)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    thread.join()
+    os.remove(target)
+    return elapsed, size, latencies
+
+
+def main(size=200):
+    print(f"{size} MiB database, a commit every {WRITE_EVERY * 1000:.0f} ms")
+    with tempfile.TemporaryDirectory() as tmp:
+        for journal_mode in ("delete", "wal"):
+            source = os.path.join(tmp, f"{journal_mode}.sqlite3")
+            populate(source, size, journal_mode)
+            for label, pages in (
+                (
+                    f"steps of {Config.BACKUP_PAGES_PER_STEP}",
+                    Config.BACKUP_PAGES_PER_STEP,
+                ),
+                ("one step", -1),
+            ):
+                elapsed, copied, latencies = timed_copy(
+                    source, os.path.join(tmp, "copy.sqlite3"), pages
+                )
+                print(
+                    f"{journal_mode:6} {label:14} {elapsed:6.2f}s "
+                    f"({copied / 1024**2 / elapsed:6.1f} MiB/s), "
+                    f"{len(latencies)} commits meanwhile, "
+                    f"median {statistics.median(latencies) * 1000:5.1f} ms, "
+                    f"max {max(latencies) * 1000:7.1f} ms"
+                )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
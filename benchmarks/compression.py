@@ -0,0 +1,124 @@
+"""
+Measure the pre-compressed variants of app/compression.py on text exercises
+of several sizes: the CPU spent once per upload to compress each encoding,
+the bytes saved, and what a download costs the server and the client, sending
+the stored variant, the plain file, or compressing it on the fly at gzip -6
+(what a compressing proxy would do on every download).
+
+The transfer times assume a client on a LINK_SPEED link. Files below
+COMPRESSION_MIN_SIZE show why they are skipped: compressed or not, a few
+hundred bytes fit in one packet.
+
+    python benchmarks/compression.py [downloads]
+"""
+
+import gzip
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import send_file  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.compression import compress, supported  # noqa: E402
+from config import TestConfig  # noqa: E402
+
+SIZES = (256, 4 * 1024, 64 * 1024, 1024 * 1024)
+LINK_SPEED = 10 * 1000**2 / 8  # bytes per second, a 10 Mbit/s connection
+WORDS = (
+    "def return for while if else print input list range len exercise "
+    "number string value result function course student write read"
+).split()
+
+
+class BenchConfig(TestConfig):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SECRET_KEY = "benchmark"
+
+
+def exercise_text(size):
+    """Text looking like an exercise: source code and sentences."""
+    lines, total = [], 0
+    while total < size:
+        line = " ".join(random.choices(WORDS, k=random.randint(3, 12))) + "\n"
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode()[:size]
+
+
+def compressed(encoding, level, data):
+    target = io.BytesIO()
+    compress(encoding, io.BytesIO(data), target, level)
+    return target.getvalue()
+
+
+def send(app, path, downloads):
+    """Median milliseconds of the app's CPU to send a file."""
+    timings = []
+    for _ in range(downloads):
+        with app.test_request_context():
+            start = time.perf_counter()
+            response = send_file(path, as_attachment=True, download_name="1.0.txt")
+            response.direct_passthrough = False
+            response.get_data()
+            response.close()
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def on_the_fly(data, downloads):
+    start = time.perf_counter()
+    for _ in range(downloads):
+        gzip.compress(data, compresslevel=6)
+    return (time.perf_counter() - start) * 1000 / downloads
+
+
+def main(downloads=200):
+    app = create_app(config_class=BenchConfig)
+    random.seed(0)
+    levels = app.config["COMPRESSION_LEVELS"]
+    encodings = [e for e in app.config["COMPRESSION_ENCODINGS"] if supported(e)]
+    print(
+        f"encodings: {', '.join(encodings)}, link at {LINK_SPEED * 8 / 1e6:.0f} Mbit/s"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in SIZES:
+            data = exercise_text(size)
+            path = os.path.join(tmp, f"{size}.txt")
+            with open(path, "wb") as file:
+                file.write(data)
+            plain_ms = send(app, path, downloads)
+            print(
+                f"\n{size:>8} bytes   plain: sent in {plain_ms:6.3f} ms of CPU, "
+                f"{size / LINK_SPEED * 1000:8.2f} ms on the link"
+            )
+            print(
+                f"{'':17}gzip -6 per download: {on_the_fly(data, downloads):6.3f}"
+                " ms of CPU each time"
+            )
+
+            for encoding in encodings:
+                start = time.perf_counter()
+                variant = compressed(encoding, levels[encoding], data)
+                compress_ms = (time.perf_counter() - start) * 1000
+                variant_path = f"{path}.{encoding}"
+                with open(variant_path, "wb") as file:
+                    file.write(variant)
+                print(
+                    f"{'':17}{encoding + ' -' + str(levels[encoding]):9}"
+                    f"{len(variant) / size:6.1%} of the size, compressed once in "
+                    f"{compress_ms:8.2f} ms, sent in "
+                    f"{send(app, variant_path, downloads):6.3f} ms of CPU, "
+                    f"{len(variant) / LINK_SPEED * 1000:8.2f} ms on the link"
+                )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
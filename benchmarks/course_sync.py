@@ -0,0 +1,139 @@
+"""
+Compare the two ways a lab machine can mirror a course folder: one form post
+of the student profile page per exercise (what the mirroring scripts did), and
+the sync protocol of app/sync.py, a plan then one tar archive of the changes.
+
+Both run through the Flask test client, so the times are those of the server.
+Each request also costs the client ROUND_TRIP seconds on the network, added
+to the totals. Three mirrors are timed: an empty one, one with a tenth of
+the exercises changed, and one already up to date.
+
+    python benchmarks/course_sync.py [exercises] [file size]
+"""
+
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_security import hash_password  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import Course, Exercise, Role, User  # noqa: E402
+from app.server import worker_exit  # noqa: E402
+from app.tasks import process_exercise  # noqa: E402
+from config import Config, TestConfig  # noqa: E402
+from create_tables import create_roles  # noqa: E402
+
+ROUND_TRIP = 0.002  # seconds, a busy lab network
+
+
+def populate(app, exercises, size):
+    folder = os.path.join(app.config["UPLOAD_FOLDER"], "Bench")
+    os.makedirs(folder)
+    course = Course(name="Bench")
+    for number in range(exercises):
+        path = os.path.join(folder, f"{number}.txt")
+        with open(path, "wb") as file:
+            file.write(os.urandom(size))
+        course.exercises.append(
+            Exercise(number=f"1.{number}", exercise_path=f"Bench/{number}.txt")
+        )
+    student = User(
+        username="mirror",
+        password=hash_password("12345678"),
+        roles=[Role.query.filter_by(name="student").one()],
+        courses=[course],
+        active=True,
+    )
+    db.session.add_all([course, student])
+    db.session.commit()
+    for exercise in course.exercises:
+        process_exercise(exercise.exercise_id)
+    return course
+
+
+def form_posts(client, numbers):
+    """The old way: select the course, then one post per exercise."""
+    url = "/student/mirror/"
+    client.post(url, data={"select": True, "course": "Bench"})
+    received = 0
+    for number in numbers:
+        response = client.post(
+            url, data={"submit": True, "course": "Bench", "exercise": number}
+        )
+        received += len(response.data)
+    return 1 + len(numbers), received
+
+
+def sync(client, course, have):
+    plan = client.post(f"/api/courses/{course.course_id}/sync", json=have).json
+    numbers = [entry["number"] for entry in plan["add"] + plan["update"]]
+    if not numbers:
+        return 1, 0
+    response = client.post(f"/api/courses/{course.course_id}/files", json=numbers)
+    with tarfile.open(fileobj=io.BytesIO(response.data), mode="r|") as archive:
+        received = sum(len(archive.extractfile(member).read()) for member in archive)
+    return 2, received
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    requests, received = function(*args)
+    elapsed = time.perf_counter() - start + requests * ROUND_TRIP
+    return elapsed, requests, received
+
+
+def main(exercises=1000, size=16 * 1024):
+    with tempfile.TemporaryDirectory() as tmp:
+
+        class BenchConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp}/sync.sqlite3"
+            UPLOAD_FOLDER = os.path.join(tmp, "uploads")
+            SECRET_KEY = "benchmark"
+            # Buffered like in production, not written on every event
+            AUDIT_FLUSH_INTERVAL = Config.AUDIT_FLUSH_INTERVAL
+            ANALYTICS_FLUSH_INTERVAL = Config.ANALYTICS_FLUSH_INTERVAL
+
+        app = create_app(config_class=BenchConfig)
+        with app.app_context():
+            db.create_all()
+            create_roles(app=app)
+            course = populate(app, exercises, size)
+            hashes = {e.number: e.sha256 for e in course.exercises}
+
+        client = app.test_client()
+        client.post(
+            "/student_login", data={"username": "mirror", "password": "12345678"}
+        )
+        stale = {n: h if i % 10 else "stale" for i, (n, h) in enumerate(hashes.items())}
+        mirrors = {
+            "empty mirror:": {},
+            "10% changed:": stale,
+            "up to date:": hashes,
+        }
+        print(
+            f"{exercises} exercises of {size // 1024} KiB, {ROUND_TRIP * 1000:.0f} ms RTT"
+        )
+        with app.app_context():
+            for label, have in mirrors.items():
+                changed = [n for n in hashes if have.get(n) != hashes[n]]
+                # The old scripts had no way to tell what changed
+                old = timed(form_posts, client, list(hashes))
+                new = timed(sync, client, course, have)
+                print(
+                    f"{label:15} form posts {old[0]:7.2f}s ({old[1]} requests), "
+                    f"sync {new[0]:6.2f}s ({new[1]} requests, "
+                    f"{len(changed)} files, {new[2] // 1024} KiB)"
+                )
+        # Write the buffered events while the database still exists
+        worker_exit(app)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,122 @@
+"""
+Compare how many concurrent exercise downloads the sync (send_file in a WSGI
+worker) and the async (asgi.py) paths can carry.
+
+Every simulated client reads at CLIENT_BANDWIDTH bytes per second. The sync
+path gets a fixed pool of WORKERS threads, like a gunicorn/uWSGI worker pool,
+while the async path runs every transfer on a single event loop.
+
+    python benchmarks/download_capacity.py [clients] [workers]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import send_file  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.async_downloads import create_asgi_app, issue_download_token  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import Course, Exercise  # noqa: E402
+from config import TestConfig  # noqa: E402
+
+FILE_SIZE = 512 * 1024
+CLIENT_BANDWIDTH = 4 * 1024 * 1024  # bytes per second
+
+
+class BenchConfig(TestConfig):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SECRET_KEY = "benchmark"
+    ASYNC_DOWNLOAD_MAX_PER_EXERCISE = 10_000
+
+
+def sync_download(app, path):
+    with app.test_request_context():
+        response = send_file(path_or_file=path, as_attachment=True)
+        response.direct_passthrough = False
+        received = 0
+        for chunk in response.response:
+            # The worker is blocked while the slow client drains the socket
+            time.sleep(len(chunk) / CLIENT_BANDWIDTH)
+            received += len(chunk)
+        response.close()
+        return received
+
+
+async def async_download(asgi_app, token):
+    received = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        nonlocal received
+        chunk = message.get("body", b"")
+        received += len(chunk)
+        await asyncio.sleep(len(chunk) / CLIENT_BANDWIDTH)
+
+    scope = {"type": "http", "method": "GET", "path": f"/{token}"}
+    await asgi_app(scope, receive, send)
+    return received
+
+
+def main(clients=200, workers=8):
+    app = create_app(config_class=BenchConfig)
+    with tempfile.TemporaryDirectory() as tmp, app.app_context():
+        # Keys are relative to the upload folder
+        app.config["UPLOAD_FOLDER"] = tmp
+        path = os.path.join(tmp, "Bench", "bench.deb")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as file:
+            file.write(os.urandom(FILE_SIZE))
+
+        db.create_all()
+        course = Course(name="Bench")
+        exercise = Exercise(
+            number="1.0.0", course=course, exercise_path="Bench/bench.deb"
+        )
+        db.session.add_all([course, exercise])
+        db.session.commit()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            total = sum(pool.map(lambda _: sync_download(app, path), range(clients)))
+        sync_time = time.perf_counter() - start
+        assert total == clients * FILE_SIZE
+
+        asgi_app = create_asgi_app(app)
+        with app.test_request_context():
+            token = issue_download_token(exercise)
+
+        async def run_all():
+            return await asyncio.gather(
+                *(async_download(asgi_app, token) for _ in range(clients))
+            )
+
+        start = time.perf_counter()
+        total = sum(asyncio.run(run_all()))
+        async_time = time.perf_counter() - start
+        assert total == clients * FILE_SIZE
+
+    print(
+        f"{clients} clients x {FILE_SIZE // 1024} KiB at "
+        f"{CLIENT_BANDWIDTH // 1024} KiB/s each"
+    )
+    print(
+        f"sync  ({workers} workers): {sync_time:6.2f}s "
+        f"{clients / sync_time:8.1f} downloads/s"
+    )
+    print(
+        f"async (1 event loop): {async_time:6.2f}s "
+        f"{clients / async_time:8.1f} downloads/s"
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
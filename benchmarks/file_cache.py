@@ -0,0 +1,123 @@
+"""
+Measure the file cache (app/filecache.py) in front of slow storage: the
+throughput of exercise downloads read straight from the storage, through a
+cold cache and through a warm one.
+
+The storage is simulated: every access costs LATENCY seconds and files are
+read at STORAGE_BANDWIDTH, like a busy network share. Requests follow a
+Zipf-like popularity: a few exercises get most of the downloads.
+
+    python benchmarks/file_cache.py [downloads] [exercises]
+"""
+
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.filecache import FileCache  # noqa: E402
+from app.storage import LocalStorage  # noqa: E402
+from config import TestConfig  # noqa: E402
+
+FILE_SIZE = 256 * 1024
+LATENCY = 0.002  # seconds per access to the storage
+STORAGE_BANDWIDTH = 100 * 1024 * 1024  # bytes per second
+CHUNK_SIZE = 64 * 1024
+
+
+class BenchConfig(TestConfig):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SECRET_KEY = "benchmark"
+
+
+class SlowReader(io.RawIOBase):
+    def __init__(self, file):
+        self.file = file
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.file.readinto(buffer)
+        time.sleep(size / STORAGE_BANDWIDTH)
+        return size
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class SlowStorage(LocalStorage):
+    def version(self, key):
+        time.sleep(LATENCY)
+        return super().version(key)
+
+    def open(self, key):
+        time.sleep(LATENCY)
+        return SlowReader(super().open(key))
+
+
+def read(path_or_file):
+    if isinstance(path_or_file, str):
+        path_or_file = open(path_or_file, "rb")
+    with path_or_file as file:
+        while file.read(CHUNK_SIZE):
+            pass
+
+
+def run(storage, keys, versions=None):
+    start = time.perf_counter()
+    for key in keys:
+        if storage.cache is None:
+            read(storage.open(key))
+        else:
+            read(storage.local_path(key, version=versions and versions[key]))
+    return len(keys) / (time.perf_counter() - start)
+
+
+def main(downloads=2000, exercises=200):
+    app = create_app(config_class=BenchConfig)
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp, app.app_context():
+        root = os.path.join(tmp, "uploads")
+        all_keys = [f"Bench/{number}.deb" for number in range(exercises)]
+        for key in all_keys:
+            LocalStorage(root).save(key, io.BytesIO(os.urandom(FILE_SIZE)))
+        weights = [1 / (rank + 1) for rank in range(exercises)]
+        keys = random.choices(all_keys, weights, k=downloads)
+        # Known content hashes spare the cache a stat() of the storage
+        versions = {key: f"sha-{key}" for key in all_keys}
+
+        print(
+            f"{downloads} downloads of {exercises} exercises x {FILE_SIZE // 1024} "
+            f"KiB, storage at {STORAGE_BANDWIDTH // 2**20} MiB/s, "
+            f"{LATENCY * 1000:.0f} ms per access"
+        )
+        print(f"no cache:          {run(SlowStorage(root), keys):8.1f} downloads/s")
+
+        budgets = {
+            "cache, all fits:": 2**30,
+            "cache, 25% fits:": exercises * FILE_SIZE // 4,
+        }
+        for label, budget in budgets.items():
+            cache = FileCache(os.path.join(tmp, f"cache-{budget}"), budget)
+            storage = SlowStorage(root, cache=cache)
+            cold = run(storage, keys)
+            cache.hits = cache.misses = 0
+            warm = run(storage, keys)
+            hit_ratio = cache.stats()["hit_ratio"]
+            run(storage, keys, versions)  # entries named after the hashes
+            hashed = run(storage, keys, versions)
+            print(
+                f"{label:18} {cold:8.1f} downloads/s cold, {warm:8.1f} warm "
+                f"(hit ratio {hit_ratio:.2f}), {hashed:8.1f} warm with known hashes"
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
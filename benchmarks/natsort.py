@@ -0,0 +1,102 @@
+"""
+Measure the natural sort of exercise numbers (app/natsort.py): the regex
+lambda the views used to build per element and request, the memoized key
+cold and warm, and the database sorting with the NATURAL collation or the
+natsort_key() function.
+
+    python benchmarks/natsort.py [numbers] [repeats]
+"""
+
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import Course, Exercise  # noqa: E402
+from app.natsort import natural_key, natural_order  # noqa: E402
+from config import TestConfig  # noqa: E402
+
+
+def regex_key(number):
+    return tuple(
+        int(part) if part.isdigit() else part for part in re.findall(r"\d+|\D+", number)
+    )
+
+
+def timed(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+
+def main(numbers=100_000, repeats=5):
+    rng = random.Random(0)
+    # Numbers like the uploads: "8.0.122", all starting with digits, so that
+    #   the regex key doesn't fail on comparing str and int
+    values = [
+        ".".join(str(rng.randint(0, 200)) for _ in range(rng.randint(2, 4)))
+        for _ in range(numbers)
+    ]
+    print(f"{numbers} exercise numbers, {len(set(values))} distinct")
+
+    regex, expected = timed(lambda: sorted(values, key=regex_key), repeats)
+    print(f"regex lambda:         {regex:8.1f} ms")
+
+    natural_key.cache_clear()
+    cold, result = timed(lambda: sorted(values, key=natural_key), 1)
+    assert result == expected
+    warm, _ = timed(lambda: sorted(values, key=natural_key), repeats)
+    print(f"natural_key, cold:    {cold:8.1f} ms")
+    print(f"natural_key, warm:    {warm:8.1f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        class BenchConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp}/natsort.sqlite3"
+
+        app = create_app(config_class=BenchConfig)
+        with app.app_context():
+            db.create_all()
+            course = Course(name="Bench")
+            db.session.add(course)
+            db.session.flush()
+            db.session.execute(
+                insert(Exercise),
+                [{"course_id": course.course_id, "number": value} for value in values],
+            )
+            db.session.commit()
+
+            query = db.select(Exercise.number)
+            orders = {
+                "SELECT, python sort:": None,
+                "ORDER BY NATURAL:": Exercise.number.collate("NATURAL"),
+                "ORDER BY natsort_key:": natural_order(Exercise.number),
+            }
+            for label, order in orders.items():
+                if order is None:
+                    elapsed, result = timed(
+                        lambda: sorted(
+                            db.session.scalars(query).all(), key=natural_key
+                        ),
+                        repeats,
+                    )
+                else:
+                    elapsed, result = timed(
+                        lambda: db.session.scalars(query.order_by(order)).all(),
+                        repeats,
+                    )
+                assert result == expected, label
+                print(f"{label:22}{elapsed:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
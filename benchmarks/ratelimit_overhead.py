@@ -0,0 +1,84 @@
+"""
+Measure the cost of the rate limiter (app/ratelimit.py): the time of one
+token bucket update for each backend, alone and from concurrent threads, and
+the slowdown of a login POST with the limits enabled.
+
+    python benchmarks/ratelimit_overhead.py [operations] [threads]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.ratelimit import MemoryBackend, SQLiteBackend  # noqa: E402
+from config import TestConfig  # noqa: E402
+from create_tables import create_roles  # noqa: E402
+
+# Never empty: the benchmark measures the bookkeeping, not the rejections
+RATE, BURST = 1e9, 1e9
+
+
+class BenchConfig(TestConfig):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SECRET_KEY = "benchmark"
+    RATELIMITS = {"login": "1000000000/second", "login_account": "1000000000/second"}
+
+
+def time_takes(backend, operations, threads):
+    def run(thread):
+        for i in range(operations // threads):
+            # 1000 clients, so that the buckets don't all share one key
+            backend.take(f"ip:{thread}.{i % 1000}", RATE, BURST)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(run, range(threads)))
+    return (time.perf_counter() - start) / operations
+
+
+def time_logins(app, enabled, requests):
+    app.config["RATELIMIT_ENABLED"] = enabled
+    client = app.test_client()
+    data = dict(username="nobody", password="12345678")
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.post("/student_login", data=data)
+    return (time.perf_counter() - start) / requests
+
+
+def main(operations=100_000, threads=8):
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "memory": MemoryBackend(),
+            "sqlite": SQLiteBackend(os.path.join(tmp, "ratelimit.db")),
+        }
+        for name, backend in backends.items():
+            single = time_takes(backend, operations, 1)
+            shared = time_takes(backend, operations, threads)
+            print(
+                f"{name:6} take(): {single * 1e6:6.1f} us, "
+                f"{shared * 1e6:6.1f} us with {threads} threads"
+            )
+
+    app = create_app(config_class=BenchConfig)
+    with app.app_context():
+        db.create_all()
+        create_roles(app)
+    requests = max(operations // 100, 100)
+    time_logins(app, True, 10)  # warm up
+    without = time_logins(app, False, requests)
+    with_limits = time_logins(app, True, requests)
+    print(
+        f"login POST: {without * 1e3:.2f} ms without limits, "
+        f"{with_limits * 1e3:.2f} ms with ({(with_limits - without) * 1e6:+.0f} us)"
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
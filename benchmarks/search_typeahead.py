@@ -0,0 +1,78 @@
+"""
+Measure the latency of typeahead queries against a large user table.
+
+The users are bulk inserted (ORM bulk inserts skip the mapper events), then the search
+index is rebuilt once and random prefixes are queried like a typeahead would.
+
+    python benchmarks/search_typeahead.py [users]
+"""
+
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import User  # noqa: E402
+from app.search import rebuild_index, search  # noqa: E402
+from config import TestConfig  # noqa: E402
+
+
+def random_name(rng):
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12)))
+
+
+def main(users=1_000_000, queries=2_000):
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+
+        class BenchConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp}/search.sqlite3"
+
+        app = create_app(config_class=BenchConfig)
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            batch = []
+            for i in range(users):
+                batch.append(
+                    {
+                        "username": f"{random_name(rng)} {random_name(rng)} {i}",
+                        "fs_uniquifier": str(i),
+                        "active": True,
+                    }
+                )
+                if len(batch) == 50_000:
+                    db.session.execute(insert(User), batch)
+                    batch = []
+            if batch:
+                db.session.execute(insert(User), batch)
+            db.session.commit()
+            count = rebuild_index()
+            print(f"indexed {count} users in {time.perf_counter() - start:.1f}s")
+
+            timings = []
+            for _ in range(queries):
+                prefix = random_name(rng)[: rng.randint(1, 4)]
+                start = time.perf_counter()
+                search(prefix, kinds=["user"], per_page=8)
+                timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        print(
+            f"typeahead over {queries} queries: "
+            f"p50 {timings[len(timings) // 2]:.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95)]:.2f} ms, "
+            f"p99 {timings[int(len(timings) * 0.99)]:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,129 @@
+"""
+Measure how the throughput of the pre-fork server (app/server.py) grows with
+the number of worker processes, on the student profile and download routes.
+
+Every client thread logs in as a student once, then alternates between
+loading its profile page and downloading an exercise. With enough CPU cores,
+requests per second should grow linearly with the workers.
+
+    python benchmarks/server_scaling.py [requests per client] [clients]
+"""
+
+import http.cookiejar
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_security import hash_password  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import Course, Exercise, Role, User  # noqa: E402
+from app.server import PreforkServer, preload  # noqa: E402
+from config import TestConfig  # noqa: E402
+from create_tables import create_roles  # noqa: E402
+
+FILE_SIZE = 64 * 1024
+
+
+def make_app(tmp):
+    class BenchConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp}/bench.db"
+        SECRET_KEY = "benchmark"
+        UPLOAD_FOLDER = os.path.join(tmp, "uploads")
+
+    return create_app(config_class=BenchConfig)
+
+
+def populate(app, tmp):
+    os.makedirs(os.path.join(tmp, "uploads", "Bench"))
+    with open(os.path.join(tmp, "uploads", "Bench", "1.0.txt"), "wb") as file:
+        file.write(os.urandom(FILE_SIZE))
+
+    with app.app_context():
+        db.create_all()
+        create_roles(app)
+        course = Course(name="Bench")
+        db.session.add_all(
+            [
+                Exercise(number="1.0", course=course, exercise_path="Bench/1.0.txt"),
+                User(
+                    username="bench",
+                    password=hash_password("12345678"),
+                    active=True,
+                    roles=[Role.query.filter_by(name="student").one()],
+                    courses=[course],
+                ),
+            ]
+        )
+        db.session.commit()
+
+
+def serve(app, workers, queue):
+    server = PreforkServer(app, port=0, workers=workers)
+    queue.put(server.address)
+    server.run()
+
+
+def client(address, requests):
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+    )
+
+    def post(path, **data):
+        body = urllib.parse.urlencode(data).encode()
+        with opener.open(address + path, body) as response:
+            return response.read()
+
+    post("/student_login", username="bench", password="12345678")
+    post("/student/bench/", course="Bench", select="Select")
+    for i in range(requests):
+        if i % 2:
+            downloaded = post(
+                "/student/bench/", course="Bench", exercise="1.0", submit="Download"
+            )
+            assert len(downloaded) == FILE_SIZE
+        else:
+            with opener.open(f"{address}/student/bench/") as response:
+                response.read()
+
+
+def main(requests=100, clients=16):
+    cpus = len(os.sched_getaffinity(0))
+    counts = sorted({1, 2, 4, cpus, 2 * cpus + 1})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(tmp)
+        populate(app, tmp)
+        preload(app)
+
+        print(f"{clients} clients x {requests} requests, {cpus} CPUs")
+        context = multiprocessing.get_context("fork")
+        for workers in counts:
+            queue = context.Queue()
+            process = context.Process(target=serve, args=(app, workers, queue))
+            process.start()
+            address = queue.get()
+
+            try:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=clients) as pool:
+                    list(pool.map(lambda _: client(address, requests), range(clients)))
+                elapsed = time.perf_counter() - start
+            finally:
+                process.terminate()
+                process.join()
+            print(
+                f"{workers:3} workers: {clients * requests / elapsed:8.1f} requests/s"
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,75 @@
+"""
+Time "flask store verify" over a course of processed exercises, with one
+hashing thread and with SCRUB_WORKERS, and the memory it takes.
+
+The files were just written, so they are read from the page cache: the
+times are those of hashing, not of the disk.
+
+    python benchmarks/store_verify.py [exercises] [file size in KiB]
+"""
+
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import Course, Exercise  # noqa: E402
+from app.scrub import verify_store  # noqa: E402
+from app.tasks import file_sha256  # noqa: E402
+from config import TestConfig  # noqa: E402
+
+
+def populate(app, exercises, size):
+    folder = os.path.join(app.config["UPLOAD_FOLDER"], "Bench")
+    os.makedirs(folder)
+    course = Course(name="Bench")
+    for number in range(exercises):
+        path = os.path.join(folder, f"{number}.txt")
+        with open(path, "wb") as file:
+            file.write(os.urandom(size))
+        course.exercises.append(
+            Exercise(
+                number=f"1.{number}",
+                exercise_path=f"Bench/{number}.txt",
+                sha256=file_sha256(path),
+                size=size,
+            )
+        )
+    db.session.add(course)
+    db.session.commit()
+
+
+def main(exercises=2000, size=1024):
+    with tempfile.TemporaryDirectory() as tmp:
+
+        class BenchConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp}/verify.sqlite3"
+            UPLOAD_FOLDER = os.path.join(tmp, "uploads")
+            SCRUB_CHECKPOINT = os.path.join(tmp, "checkpoint.json")
+            SECRET_KEY = "benchmark"
+
+        app = create_app(config_class=BenchConfig)
+        with app.app_context():
+            db.create_all()
+            populate(app, exercises, size * 1024)
+            total = exercises * size / 1024
+            print(f"{exercises} files of {size} KiB ({total:.0f} MiB)")
+            for workers in sorted({1, app.config["SCRUB_WORKERS"]}):
+                start = time.perf_counter()
+                counts = verify_store(workers=workers)
+                elapsed = time.perf_counter() - start
+                assert counts["hashed"] == exercises
+                print(
+                    f"{workers} workers: {elapsed:6.2f}s ({total / elapsed:7.1f} MiB/s)"
+                )
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"Peak memory of the process: {peak:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,106 @@
+"""
+Measure the list query of the Users admin (UserAdminView.get_list) against a
+large user table: the first page, a deep page reached by OFFSET and by the
+"?after=<username>" keyset, and the pages filtered by course and by role.
+
+Every user is a student enrolled in one of 100 courses. The rows are bulk
+inserted, then the counters are rebuilt like "flask stats rebuild" does.
+
+    python benchmarks/users_admin.py [users] [queries]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import insert, select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import Course, Role, User, UserCourse, UserRoles  # noqa: E402
+from app.stats import rebuild_stats  # noqa: E402
+from app.views.admin_pages import UserAdminView  # noqa: E402
+from config import TestConfig  # noqa: E402
+from create_tables import create_roles  # noqa: E402
+
+COURSES = 100
+BATCH = 50_000
+
+
+def populate(users):
+    courses = [Course(name=f"course{i:03}") for i in range(COURSES)]
+    db.session.add_all(courses)
+    db.session.flush()
+    course_ids = [course.course_id for course in courses]
+    student = db.session.scalar(select(Role.role_id).where(Role.name == "student"))
+    for start in range(0, users, BATCH):
+        ids = range(start + 1, min(start + BATCH, users) + 1)
+        db.session.execute(
+            insert(User),
+            [
+                {
+                    "user_id": i,
+                    "username": f"user{i:07}",
+                    "fs_uniquifier": str(i),
+                    "active": True,
+                }
+                for i in ids
+            ],
+        )
+        db.session.execute(
+            insert(UserRoles), [{"user_id": i, "role_id": student} for i in ids]
+        )
+        db.session.execute(
+            insert(UserCourse),
+            [{"user_id": i, "course_id": course_ids[i % COURSES]} for i in ids],
+        )
+    db.session.commit()
+    rebuild_stats()
+
+
+def timed(app, view, queries, page=0, url="/", filters=()):
+    # Filters are (index, name, value), the first filter of the view is the role
+    filters = [(index, view._filters[index].name, value) for index, value in filters]
+    timings = []
+    for _ in range(queries):
+        with app.test_request_context(url):
+            start = time.perf_counter()
+            count, rows = view.get_list(page, None, False, None, filters)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], count, len(rows)
+
+
+def main(users=1_000_000, queries=20):
+    with tempfile.TemporaryDirectory() as tmp:
+
+        class BenchConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp}/users.sqlite3"
+
+        app = create_app(config_class=BenchConfig)
+        with app.app_context():
+            db.create_all()
+            create_roles(app=app)
+            start = time.perf_counter()
+            populate(users)
+            print(f"{users} users inserted in {time.perf_counter() - start:.1f}s")
+
+            view = UserAdminView(User, db.session, endpoint="bench_user")
+            middle = f"user{users // 2:07}"
+            cases = {
+                "first page:": {},
+                "middle page, OFFSET:": {"page": users // 2 // view.page_size},
+                "middle page, keyset:": {"url": f"/?after={middle}"},
+                "filtered by course:": {"filters": [(1, "course042")]},
+                "filtered by role:": {"filters": [(0, "student")]},
+            }
+            for label, case in cases.items():
+                median, count, rows = timed(app, view, queries, **case)
+                print(f"{label:22}{median:8.2f} ms ({rows} of {count} users)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -21,10 +21,131 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = "uploads/"
+    # Storage of the uploaded files (see app/storage.py): "local" keeps them
+    #   in UPLOAD_FOLDER, "s3" in a bucket shared by all the nodes (needs
+    #   boto3; set the endpoint for MinIO and other S3-compatible stores).
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+    STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET")
+    STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "uploads/")
+    STORAGE_S3_ENDPOINT_URL = os.getenv("STORAGE_S3_ENDPOINT_URL")
+    STORAGE_PRESIGNED_DOWNLOADS = True  # redirect downloads to the store
+    STORAGE_PRESIGNED_EXPIRES = 300  # seconds
+    # Local copies of the stored files (see app/filecache.py), always used for
+    #   remote storage. FILE_CACHE_LOCAL also copies the files of a local
+    #   UPLOAD_FOLDER, for when it is a slow network share.
+    FILE_CACHE_FOLDER = "instance/file-cache/"
+    FILE_CACHE_MAX_BYTES = 2 * 1024**3
+    FILE_CACHE_LOCAL = False
     ALLOWED_EXTENSIONS = {"txt", "deb"}
+    # Students listed per page of a course in the course admin
+    ENROLLMENTS_PER_PAGE = 50
+    # Pre-compressed variants of the exercise files (see app/compression.py),
+    #   sent to the clients whose Accept-Encoding takes them
+    COMPRESSION_ENCODINGS = ("zstd", "gzip")  # in order of preference
+    COMPRESSION_LEVELS = {"zstd": 19, "gzip": 9}  # compressed once, sent often
+    COMPRESSION_EXTENSIONS = {"txt"}  # .deb packages are compressed already
+    COMPRESSION_MIN_SIZE = 1024  # bytes, smaller files fit in a few packets
+    COMPRESSION_MAX_SIZE = 64 * 1024**2  # bytes, bigger ones would tie a job up
+    COMPRESSION_MIN_SAVING = 0.1  # fraction of the size a variant must save
+    # Deltas between consecutive versions of the exercise files (see
+    #   app/versions.py), both versions are held in memory to compute them
+    DELTA_MAX_SIZE = 64 * 1024**2  # bytes
+    DELTA_MAX_RATIO = 0.5  # a delta is kept if smaller than this part of the file
+    # Optional ASGI download server (see asgi.py). When the URL is set, downloads
+    #   are redirected to it instead of being streamed by the Flask worker.
+    ASYNC_DOWNLOAD_URL = os.getenv("ASYNC_DOWNLOAD_URL")
+    ASYNC_DOWNLOAD_TOKEN_MAX_AGE = 300  # seconds
+    ASYNC_DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes
+    ASYNC_DOWNLOAD_RATE_LIMIT = 0  # bytes per second per client, 0 = unlimited
+    ASYNC_DOWNLOAD_MAX_PER_EXERCISE = 50  # concurrent transfers of one exercise
+    ASYNC_DOWNLOAD_QUEUE_TIMEOUT = 10  # seconds to wait for a free transfer slot
+    # Background jobs (see app/jobs.py). Disable the in-process thread when
+    #   running dedicated workers with "flask jobs work".
+    JOBS_INLINE = False
+    JOBS_BACKGROUND_THREAD = True
+    JOBS_POLL_INTERVAL = 1.0  # seconds
+    JOBS_MAX_ATTEMPTS = 3
+    JOBS_RETRY_BACKOFF = 5  # seconds, doubled after every failed attempt
+    JOBS_LEASE_SECONDS = 600  # a running job older than this is retried
+    # APT repository indexes of the courses (see app/apt.py), served to the
+    #   enrolled users with HTTP basic auth once enabled.
+    APT_REPOSITORY_ENABLED = False
+    APT_INDEX_FOLDER = "instance/apt/"
+    APT_ORIGIN = "Your Company"
+    # Set up the admin pages right before the first request instead of in
+    #   create_app (see app/startup.py), so CLI commands start faster.
+    LAZY_ADMIN = True
+    # Production server (see app/server.py and "flask serve")
+    SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", 0))  # 0 = 2 * CPUs + 1
+    SERVER_GRACEFUL_TIMEOUT = 30  # seconds given to the running requests
+    # Course scopes of the recent users, kept by each process (see app/rbac.py)
+    RBAC_SCOPE_CACHE_SIZE = 10_000  # users
+    # Admission control of logins and downloads (see app/ratelimit.py). Use a
+    #   shared storage ("sqlite:///instance/ratelimit.db" or "redis://...")
+    #   when running several worker processes.
+    RATELIMIT_ENABLED = True
+    RATELIMIT_STORAGE = os.getenv("RATELIMIT_STORAGE", "memory://")
+    RATELIMITS = {
+        "login": "10/minute",  # per IP address
+        "login_account": "30/hour",  # per user name, whatever the address
+        "download": "60/minute",  # per user (or IP address)
+    }
+    RATELIMIT_CONCURRENCY = {  # per process
+        "password_hash": 4,
+        "transfer": 32,
+        "events": 16,  # open event streams and long polls
+    }
+    RATELIMIT_QUEUE_TIMEOUT = 5  # seconds to wait for a free slot
+    # Audit trail of logins, password resets, uploads and downloads (see
+    #   app/audit.py): events are buffered and written in batches, to the
+    #   "audit_events" table ("database") or to rotated files ("ndjson").
+    AUDIT_SINK = os.getenv("AUDIT_SINK", "database")
+    AUDIT_NDJSON_FOLDER = "instance/audit/"
+    AUDIT_NDJSON_MAX_BYTES = 64 * 1024 * 1024
+    AUDIT_NDJSON_BACKUPS = 0  # rotated files kept, 0 = all of them
+    AUDIT_BATCH_SIZE = 500  # events per write
+    AUDIT_FLUSH_INTERVAL = 1.0  # seconds an event may wait in memory
+    AUDIT_BUFFER_SIZE = 10_000  # events held before the requests write them
+    AUDIT_BACKGROUND_THREAD = True
+    # Download counters of each worker, summed into per-minute and per-hour
+    #   rollups (see app/analytics.py) by the same kind of writer thread.
+    ANALYTICS_FLUSH_INTERVAL = 10  # seconds
+    ANALYTICS_BUFFER_SIZE = 50_000  # exercises counted between two flushes
+    ANALYTICS_MINUTE_RETENTION = 48  # hours, the hourly rollups are kept
+    ANALYTICS_BACKGROUND_THREAD = True
+    # Notifications of the changes to the courses (see app/events.py): "local"
+    #   only sees the changes made by its own process, "database" also polls
+    #   the manifests of the courses clients are waiting on.
+    EVENTS_BROKER = os.getenv("EVENTS_BROKER", "database")
+    EVENTS_POLL_INTERVAL = 1.0  # seconds
+    EVENTS_STREAM_SECONDS = 60  # an event stream is then closed, and reopened
+    EVENTS_KEEPALIVE_SECONDS = 15  # between two comments on an idle stream
+    EVENTS_RETRY_SECONDS = 1  # asked of the clients before they reconnect
+    EVENTS_LONG_POLL_SECONDS = 25
+    # Snapshots of the database and the uploaded files (see app/backup.py)
+    BACKUP_FOLDER = "instance/backups/"
+    BACKUP_PAGES_PER_STEP = 256  # database pages copied while it is locked
+    BACKUP_STEP_SLEEP = 0.01  # seconds left to the workers between two steps
+    # "flask store verify" (see app/scrub.py)
+    SCRUB_WORKERS = min(8, os.cpu_count() or 1)  # files hashed in parallel
+    SCRUB_MMAP_MIN_SIZE = 16 * 1024**2  # bytes, bigger files are mapped
+    SCRUB_CHECKPOINT = "instance/store-verify.json"
+    SCRUB_CHECKPOINT_EVERY = 10_000  # files checked between two saves
 
 
 class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///test_db.sqlite3"
     WTF_CSRF_ENABLED = False
+    JOBS_INLINE = True
+    # Hashing dominates the run time of the login tests: use the cheapest scheme
+    SECURITY_PASSWORD_HASH = "plaintext"
+    # Tests log in many times from the same address
+    RATELIMIT_ENABLED = False
+    # Write the audit events right away, in the test's transaction
+    AUDIT_BACKGROUND_THREAD = False
+    AUDIT_FLUSH_INTERVAL = 0
+    ANALYTICS_BACKGROUND_THREAD = False
+    ANALYTICS_FLUSH_INTERVAL = 0
+    # No other process commits: no polling thread
+    EVENTS_BROKER = "local"
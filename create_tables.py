@@ -1,12 +1,16 @@
+import io
 import os
 import random
 import shutil
-import subprocess
 import sys
 
+import flask_migrate
+from flask import current_app
+
 from app import create_app
-from app.extensions import db
+from app.extensions import db, init_migrate
 from app.models import Course, Exercise, Role, User
+from app.storage import get_storage, storage_key
 from faker import Faker
 from flask_security import SQLAlchemyUserDatastore, hash_password
 
@@ -18,6 +22,7 @@ ROLES = [
     "administrator",
     "student",
     "teacher",
+    "application",
 ]
 
 COURSES = ["C#", "C++", "PHP", "Python", "Java", "JavaScript"]
@@ -46,16 +51,13 @@ def delete_folders():
 
 
 def setup_database():
-    # Log into the shell and execute commands
-    subprocess.run(
-        ["flask", "shell"],
-        input="from app.extensions import db\n" "db.create_all()\n" "exit()\n",
-        text=True,
-    )
+    # Run in this process: every "flask" subprocess would start the app again
+    db.create_all()
 
     # Initiating and migrating the database
-    subprocess.run(["flask", "db", "init"])
-    subprocess.run(["flask", "db", "migrate"])
+    init_migrate(current_app)
+    flask_migrate.init()
+    flask_migrate.migrate()
 
 
 def create_roles(app=None):
@@ -96,8 +98,11 @@ def populate_tables(courses, exercises):
     random.seed(22)
 
     course_map = {}
+    storage = get_storage()
 
     for course_name in courses:
+        # Courses without exercises are listed too
+        storage.makedirs(course_name)
         course = Course(
             name=course_name,
         )
@@ -119,13 +124,11 @@ def populate_tables(courses, exercises):
                     flag_visible=visible,
                 )
 
-                os.makedirs(f"uploads/{course_name}", exist_ok=True)
-                exr_path = os.path.join(course_name, exercise.number)
-
-                exercise.exercise_path = f"{exr_path}.txt"
-
-                with open(f"uploads/{exercise.exercise_path}", "w") as file:
-                    file.write(f"This is the exercise {exercise.number}")
+                exercise.exercise_path = storage_key(
+                    course_name, f"{exercise.number}.txt"
+                )
+                content = f"This is the exercise {exercise.number}".encode()
+                storage.save(exercise.exercise_path, io.BytesIO(content))
 
                 db.session.add(exercise)
 
@@ -0,0 +1,23 @@
+# Settings of "gunicorn wsgi:app" (see app/server.py)
+import os
+
+from app.server import after_fork, worker_count, worker_exit as flush_worker
+
+bind = os.getenv("BIND", "127.0.0.1:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", 0)) or worker_count()
+# Load the app once in the master, the workers share it copy-on-write
+preload_app = True
+# Time given to the running requests on SIGTERM, and to old workers on SIGHUP
+graceful_timeout = 30
+
+
+def post_fork(server, worker):
+    from wsgi import app
+
+    after_fork(app)
+
+
+def worker_exit(server, worker):
+    from wsgi import app
+
+    flush_worker(app)
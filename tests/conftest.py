@@ -1,12 +1,14 @@
 # Pytest's configuration file
+import io
 import os
 import shutil
-from pathlib import Path
+import tarfile
 from unittest.mock import MagicMock
 
 import pytest
 from flask_security import hash_password
 from flask_wtf import FlaskForm
+from sqlalchemy import event
 from wtforms import StringField
 
 from app import create_app
@@ -14,40 +16,101 @@ from app.extensions import db
 from app.forms import username_validator, ValidationError
 from app.helpers import validate_upload_form
 from app.models import Course, Exercise, Role, User
-from config import TestConfig, basedir
+from config import TestConfig
 from create_tables import create_roles
 
 
+def worker_config(database_uri):
+    """
+    Return the configuration class of the current pytest-xdist worker.
+    """
+
+    class WorkerConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        # The async download tests resolve paths from an executor thread
+        SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"check_same_thread": False}}
+
+    return WorkerConfig
+
+
+def enable_sqlite_savepoints(engine):
+    """
+    Let SQLAlchemy emit BEGIN itself: the sqlite3 module's implicit transactions
+    would otherwise commit the test's transaction when a SAVEPOINT is released.
+    """
+
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+
+@pytest.fixture(scope="session")
+def database_uri(tmp_path_factory):
+    """
+    This fixture creates, once per worker, a database file with all the tables
+    and roles. Each pytest-xdist worker gets its own temporary directory, so
+    workers never share a database.
+    Sessions bound to a connection which is already in a transaction then
+    work inside a SAVEPOINT, instead of committing the test's transaction.
+    """
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "main")
+    database_path = tmp_path_factory.mktemp(f"db-{worker}") / "test_db.sqlite3"
+    database_uri = f"sqlite:///{database_path}"
+
+    app = create_app(config_class=worker_config(database_uri))
+    with app.app_context():
+        # Create all database tables defined by the models
+        db.create_all()
+        create_roles(app=app)
+        db.engine.dispose()
+        db.session.configure(join_transaction_mode="create_savepoint")
+
+    yield database_uri
+
+    with app.app_context():
+        db.session.configure(join_transaction_mode="conservative_savepoint")
+
+
 @pytest.fixture()
-def app():
+def app(database_uri, tmp_path, monkeypatch):
     """
     This fixture creates a Flask application instance with a specific
-    configuration class for testing purposes. It then sets up the
-    application context, creates necessary database tables and roles.
-    After yielding the application instance to the test function, it
-    performs teardown actions by removing the test database file.
+    configuration class for testing purposes, connected to the worker's
+    database. Everything the test writes happens inside one transaction
+    which is rolled back afterwards, so the database needs no cleanup.
     """
 
     # Use the application factory to create an instance of the app
-    # Specify "TestConfig" as the configuration class
-    app = create_app(config_class=TestConfig)
+    # Specify the worker's configuration class
+    app = create_app(config_class=worker_config(database_uri))
+    # Keep uploads and generated files (APT indexes...) out of the source tree
+    app.config["UPLOAD_FOLDER"] = str(tmp_path / "uploads")
+    app.config["APT_INDEX_FOLDER"] = str(tmp_path / "apt")
+    os.makedirs(app.config["UPLOAD_FOLDER"])
 
     # Sets up an application context
     # (necessary for certain operations in Flask, such as interacting with DB)
     with app.app_context():
-        # Create all database tables defined by the models
-        db.create_all()
-
-        create_roles(app=app)
+        engine = db.engine
+        enable_sqlite_savepoints(engine)
+        connection = engine.connect()
+        transaction = connection.begin()
+        # Every session of this app now runs on the test's connection, and each
+        #   commit only releases a SAVEPOINT (see database_uri above)
+        monkeypatch.setitem(db.engines, None, connection)
 
     # Provide the application instance to the test function
     #   and allow additional actions to be performed
     yield app
 
-    # Cleanup: Remove SQLite database file used for testing
-    test_db_path = Path.cwd() / "instance" / "test_db.sqlite3"
-    if test_db_path.exists():
-        os.remove(test_db_path)
+    # Cleanup: Undo everything the test wrote into the database
+    transaction.rollback()
+    connection.close()
+    engine.dispose()
 
 
 @pytest.fixture()
@@ -163,7 +226,7 @@ def setup_course_and_exercise_data(app):
     with app.app_context():
         # Create a test course directory
         course_name = "Test Course"
-        course_path = os.path.join(basedir, TestConfig.UPLOAD_FOLDER, course_name)
+        course_path = os.path.join(app.config["UPLOAD_FOLDER"], course_name)
         os.makedirs(course_path, exist_ok=True)
 
         exercise_file_path = os.path.join(course_path, "test_file.txt")
@@ -192,6 +255,40 @@ def setup_course_and_exercise_data(app):
         db.session.commit()
 
 
+@pytest.fixture()
+def make_deb():
+    """
+    Fixture returning a function that writes a minimal .deb package
+    (an ar archive with debian-binary, control.tar.gz and data.tar.gz).
+    """
+
+    def tar_gz(files):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+            for name, content in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        return buffer.getvalue()
+
+    def _make_deb(path, package="exercise", version="1.0", **fields):
+        control = f"Package: {package}\nVersion: {version}\n"
+        control += "".join(f"{key}: {value}\n" for key, value in fields.items())
+        members = [
+            ("debian-binary", b"2.0\n"),
+            ("control.tar.gz", tar_gz({"./control": control.encode()})),
+            ("data.tar.gz", tar_gz({"./usr/share/doc/README": b"Exercise"})),
+        ]
+        with open(path, "wb") as file:
+            file.write(b"!<arch>\n")
+            for name, data in members:
+                header = f"{name + '/':<16}{0:<12}{0:<6}{0:<6}{100644:<8}{len(data):<10}`\n"
+                file.write(header.encode() + data + (b"\n" if len(data) % 2 else b""))
+        return path
+
+    return _make_deb
+
+
 @pytest.fixture()
 def mock_security(app):
     """
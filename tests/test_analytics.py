@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.analytics import DownloadCounters, RollupSink, course_load, top_exercises
+from app.extensions import db
+from app.models import DownloadRollup, utcnow
+
+DOWNLOAD_URL = "/admin/download_admin/admin/download/"
+
+
+@pytest.fixture()
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+def rollups():
+    return {
+        (row.period, row.bucket.minute, row.exercise_id): row.downloads
+        for row in DownloadRollup.query
+    }
+
+
+def test_rollups(app, app_context):
+    """
+    Test that a batch is summed per minute and per hour, on top of the
+    previous batches, with the bytes, and that old minutes are pruned.
+    """
+    hour = datetime(2024, 1, 1, 10)
+    sink = RollupSink(app)
+
+    sink.write(
+        [
+            (hour, 1, 7, 1, 100, 0),
+            (hour, 1, 7, 1, 100, 0),
+            (hour.replace(minute=5), 1, 7, 1, 100, 0),
+        ]
+    )
+    sink.write([(hour, 1, 7, 1, 30, 70), (hour, 1, 8, 1, 100, 0)])
+
+    assert rollups() == {
+        ("hour", 0, 7): 4,
+        ("hour", 0, 8): 1,
+    }
+    row = DownloadRollup.query.filter_by(period="hour", exercise_id=7).one()
+    assert (row.bytes_sent, row.bytes_saved) == (330, 70)
+
+    now = utcnow().replace(second=0, microsecond=0)
+    sink.write([(now, 1, 7, 1, 100, 0), (now, 1, 7, 1, 100, 0)])
+    assert rollups()[("minute", now.minute, 7)] == 2
+
+
+def test_counters(app, app_context):
+    """
+    Test that downloads are summed per minute and exercise before the flush,
+    and that a full buffer is flushed instead of dropping downloads.
+    """
+    minute = utcnow().replace(second=0, microsecond=0)
+    counters = DownloadCounters(
+        RollupSink(app), batch_size=10, interval=60, capacity=2, background=False
+    )
+
+    for _ in range(100):
+        counters.put((minute, 1, 7, 100, 0))
+    counters.put((minute, 1, 7, 30, 70))
+    assert len(counters) == 1
+
+    counters.put((minute, 1, 8, 100, 0))  # full: flushed now
+    assert len(counters) == 0
+    assert counters.dropped == 0
+    assert rollups()[("minute", minute.minute, 7)] == 101
+    row = DownloadRollup.query.filter_by(period="hour", exercise_id=7).one()
+    assert (row.bytes_sent, row.bytes_saved) == (10_030, 70)
+
+
+def test_reports(app, app_context):
+    """
+    Test the top exercises and the load per course, for two windows.
+    """
+    now = utcnow().replace(second=0, microsecond=0)
+    earlier = now - timedelta(hours=3)
+    RollupSink(app).write(
+        [(now, 1, 7, 1, 100, 0)] * 2
+        + [(now, 2, 8, 1, 100, 0)]
+        + [(earlier, 2, 8, 1, 100, 0)] * 5,
+    )
+
+    assert [(e["exercise_id"], e["downloads"]) for e in top_exercises("1h")] == [
+        (7, 2),
+        (8, 1),
+    ]
+    assert [(e["exercise_id"], e["downloads"]) for e in top_exercises("24h")] == [
+        (8, 6),
+        (7, 2),
+    ]
+    assert top_exercises("24h", limit=1)[0]["exercise"] is None  # deleted
+    assert [(c["course_id"], c["downloads"], c["peak"]) for c in course_load()] == [
+        (2, 6, 5),
+        (1, 2, 2),
+    ]
+
+
+def test_downloads_counted(app, admin_login, setup_course_and_exercise_data):
+    """
+    Test that downloads are counted and reported by the JSON endpoint and
+    the admin page.
+    """
+    client, _ = admin_login
+    course, exercise = setup_course_and_exercise_data
+    client.post(DOWNLOAD_URL, data={"select": True, "course": course.name})
+    for _ in range(2):
+        client.post(
+            DOWNLOAD_URL,
+            data=dict(submit="download", course=course.name, exercise="1.0.1"),
+        ).close()
+
+    response = client.get("/api/analytics/downloads?window=1h")
+
+    assert response.status_code == 200
+    assert response.json["exercises"] == [
+        {
+            "exercise_id": exercise.exercise_id,
+            "exercise": "1.0.1",
+            "course": course.name,
+            "downloads": 2,
+            "bytes_sent": 2 * len("Test content"),
+            "bytes_saved": 0,
+        }
+    ]
+    assert response.json["courses"][0]["downloads"] == 2
+    assert client.get("/api/analytics/downloads?window=1y").status_code == 400
+    page = client.get("/admin/analytics_admin/?window=7d")
+    assert page.status_code == 200
+    assert b"Most downloaded exercises" in page.data
@@ -0,0 +1,165 @@
+import base64
+import os
+
+import pytest
+
+from app.apt import build_course_index
+from app.extensions import db
+from app.models import Course, Exercise, Package, User
+from app.tasks import process_exercise
+
+
+@pytest.fixture()
+def deb_course(app, tmp_path, setup_course_and_exercise_data, make_deb):
+    """
+    Fixture adding a processed .deb exercise to the test course, with the APT
+    indexes written to a temporary folder.
+    """
+    app.config["APT_INDEX_FOLDER"] = str(tmp_path)
+    app.config["APT_REPOSITORY_ENABLED"] = True
+    course, _ = setup_course_and_exercise_data
+    course_path = os.path.dirname(course.exercises[0].exercise_path)
+
+    deb_path = make_deb(
+        os.path.join(course_path, "hello_1.0_all.deb"),
+        "hello",
+        "1.0",
+        Architecture="all",
+    )
+    exercise = Exercise(number="1.0.2", course=course, exercise_path=deb_path)
+    db.session.add(exercise)
+    db.session.commit()
+    # Indexes the package, which in turn rebuilds the course index
+    exercise_id = exercise.exercise_id
+    process_exercise(exercise_id)
+
+    yield course, exercise, tmp_path / course.name
+
+    # Some tests delete the exercise themselves
+    exercise = db.session.get(Exercise, exercise_id)
+    if exercise is not None:
+        db.session.delete(exercise)
+        db.session.commit()
+
+
+def test_index_is_built_after_upload(deb_course):
+    """
+    Test that processing a .deb exercise generates the course's APT index.
+    """
+    course, exercise, folder = deb_course
+
+    packages = (folder / "Packages").read_text()
+    release = (folder / "Release").read_text()
+
+    assert "Package: hello\nVersion: 1.0\nArchitecture: all\n" in packages
+    assert "Filename: ./hello_1.0_all.deb\n" in packages
+    assert f"SHA256: {exercise.sha256}\n" in packages
+    assert "Packages.gz\n" in release
+    assert (folder / "Packages.gz").exists()
+
+
+def test_index_is_rebuilt_after_delete(deb_course):
+    """
+    Test that deleting a .deb exercise removes it from the course's index.
+    """
+    _, exercise, folder = deb_course
+
+    db.session.delete(db.session.get(Exercise, exercise.exercise_id))
+    db.session.commit()
+
+    assert "Package: hello" not in (folder / "Packages").read_text()
+
+
+def test_index_is_rebuilt_after_replacing_deb(deb_course):
+    """
+    Test that replacing a .deb exercise by another kind of file deletes its
+    package and removes it from the course's index.
+    """
+    _, exercise, folder = deb_course
+    exercise = db.session.get(Exercise, exercise.exercise_id)
+    txt_path = os.path.join(os.path.dirname(exercise.exercise_path), "hello.txt")
+    with open(txt_path, "w") as file:
+        file.write("Not a package")
+    exercise.exercise_path = txt_path
+    db.session.commit()
+
+    process_exercise(exercise.exercise_id)
+
+    assert Package.query.filter_by(exercise_id=exercise.exercise_id).count() == 0
+    assert "Package: hello" not in (folder / "Packages").read_text()
+
+
+def test_unchanged_index_is_not_rewritten(deb_course):
+    """
+    Test that rebuilding an up-to-date course leaves its files untouched.
+    """
+    course, _, folder = deb_course
+    mtime = os.path.getmtime(folder / "Release")
+
+    assert build_course_index(course) is False
+    assert os.path.getmtime(folder / "Release") == mtime
+
+
+@pytest.fixture()
+def apt_auth(app, deb_course, student_user):
+    """
+    Fixture enrolling the test student in the course of the .deb exercise and
+    returning the HTTP basic auth header apt sends for them.
+    """
+    course, _, _ = deb_course
+    # student_user runs in an app context of its own
+    student = User.query.filter_by(username="test_student").one()
+    student.courses.append(db.session.get(Course, course.course_id))
+    db.session.commit()
+    credentials = base64.b64encode(b"test_student:12345678").decode()
+    return {"Authorization": f"Basic {credentials}"}
+
+
+def test_index_served_with_etag(client, deb_course, apt_auth):
+    """
+    Test that the index files support conditional requests.
+    """
+    course, _, _ = deb_course
+
+    response = client.get(f"/apt/{course.name}/Packages", headers=apt_auth)
+    assert response.status_code == 200
+    assert response.headers["ETag"]
+
+    response = client.get(
+        f"/apt/{course.name}/Packages",
+        headers={**apt_auth, "If-None-Match": response.headers["ETag"]},
+    )
+    assert response.status_code == 304
+
+    response = client.get(f"/apt/{course.name}/hello_1.0_all.deb", headers=apt_auth)
+    assert response.status_code == 200
+    assert response.data.startswith(b"!<arch>\n")
+
+
+def test_repository_needs_access(app, client, deb_course, student_user):
+    """
+    Test that the repository asks for credentials, and hides the courses the
+    user isn't enrolled in.
+    """
+    course, _, _ = deb_course
+    credentials = base64.b64encode(b"test_student:12345678").decode()
+
+    response = client.get(f"/apt/{course.name}/Packages")
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"].startswith("Basic")
+    response = client.get(
+        f"/apt/{course.name}/hello_1.0_all.deb",
+        headers={"Authorization": f"Basic {credentials}"},
+    )
+    assert response.status_code == 404
+
+
+def test_repository_disabled(app, client, deb_course, apt_auth):
+    """
+    Test that the repository is not served unless enabled.
+    """
+    course, _, _ = deb_course
+    app.config["APT_REPOSITORY_ENABLED"] = False
+
+    response = client.get(f"/apt/{course.name}/Packages", headers=apt_auth)
+    assert response.status_code == 404
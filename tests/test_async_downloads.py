@@ -0,0 +1,142 @@
+import asyncio
+import gzip
+
+from app.async_downloads import create_asgi_app, issue_download_token
+from app.extensions import db
+
+
+def asgi_get(asgi_app, path, method="GET", headers=()):
+    """
+    Helper function to run a single request through an ASGI app and collect
+    the response status, headers and body.
+    """
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": list(headers),
+        "client": ("1.2.3.4", 0),
+    }
+    asyncio.run(asgi_app(scope, receive, send))
+
+    start = messages[0]
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+def test_async_download_streams_file(app, setup_course_and_exercise_data):
+    """
+    Test that a valid token streams the exercise file as an attachment.
+    """
+    _, exercise = setup_course_and_exercise_data
+    asgi_app = create_asgi_app(app)
+
+    with app.test_request_context():
+        token = issue_download_token(exercise)
+
+    status, headers, body = asgi_get(asgi_app, f"/{token}")
+
+    assert status == 200
+    assert b"attachment" in headers[b"content-disposition"]
+    assert body == b"Test content"
+    assert asgi_app.active_transfers == 0
+
+
+def test_async_download_sends_compressed_variant(app, setup_course_and_exercise_data):
+    """
+    Test that the async server sends the pre-compressed variant a client takes.
+    """
+    _, exercise = setup_course_and_exercise_data
+    with open(exercise.exercise_path + ".gz", "wb") as file:
+        file.write(gzip.compress(b"Test content"))
+    exercise.encodings = "gzip"
+    db.session.commit()
+    asgi_app = create_asgi_app(app)
+
+    with app.test_request_context():
+        token = issue_download_token(exercise)
+
+    status, headers, body = asgi_get(
+        asgi_app, f"/{token}", headers=[(b"accept-encoding", b"gzip, br")]
+    )
+
+    assert status == 200
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert gzip.decompress(body) == b"Test content"
+
+
+def test_async_download_rejects_bad_token(app):
+    """
+    Test that a tampered token is refused without touching the database.
+    """
+    status, _, _ = asgi_get(create_asgi_app(app), "/not-a-valid-token")
+
+    assert status == 403
+
+
+def test_async_download_busy_exercise(app, setup_course_and_exercise_data):
+    """
+    Test that a full exercise slot answers 503 with a Retry-After header.
+    """
+    _, exercise = setup_course_and_exercise_data
+    app.config["ASYNC_DOWNLOAD_MAX_PER_EXERCISE"] = 0
+    app.config["ASYNC_DOWNLOAD_QUEUE_TIMEOUT"] = 0.01
+    asgi_app = create_asgi_app(app)
+
+    with app.test_request_context():
+        token = issue_download_token(exercise)
+
+    status, headers, _ = asgi_get(asgi_app, f"/{token}")
+
+    assert status == 503
+    assert headers[b"retry-after"] == b"5"
+    assert asgi_app.slots == {}
+
+
+def test_async_download_forgets_idle_slots(app, setup_course_and_exercise_data):
+    """
+    Test that the slot and throttle of a download are dropped once it's done.
+    """
+    _, exercise = setup_course_and_exercise_data
+    asgi_app = create_asgi_app(app)
+
+    with app.test_request_context():
+        token = issue_download_token(exercise)
+
+    status, _, _ = asgi_get(asgi_app, f"/{token}")
+
+    assert status == 200
+    assert asgi_app.slots == {}
+    assert asgi_app.throttles == {}
+
+
+def test_download_redirects_to_async_server(
+    admin_login, app, setup_course_and_exercise_data
+):
+    """
+    Test that the download form hands the transfer over to the async server.
+    """
+    client, _ = admin_login
+    course, _ = setup_course_and_exercise_data
+    app.config["ASYNC_DOWNLOAD_URL"] = "http://downloads.local/"
+
+    client.post(
+        "/admin/download_admin/admin/download/",
+        data={"select": True, "course": course.name},
+    )
+    response = client.post(
+        "/admin/download_admin/admin/download/",
+        data=dict(submit="download", course=course.name, exercise="1.0.1"),
+    )
+
+    assert response.status_code == 302
+    assert response.location.startswith("http://downloads.local/")
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+
+from app.audit import EventBuffer, NDJSONSink
+from app.models import AuditEvent
+
+DOWNLOAD_URL = "/admin/download_admin/admin/download/"
+
+
+class ListSink:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.written = threading.Event()
+
+    def write(self, events):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.batches.append([event["n"] for event in events])
+        self.written.set()
+
+
+def actions(app):
+    with app.app_context():
+        return [
+            (event.action, event.username, event.target)
+            for event in AuditEvent.query.order_by(AuditEvent.event_id)
+        ]
+
+
+def test_logins_and_downloads_recorded(
+    app, admin_login, setup_course_and_exercise_data
+):
+    """
+    Test that logins and downloads leave a trace in the audit_events table.
+    """
+    client, _ = admin_login
+    course, _ = setup_course_and_exercise_data
+    client.post(DOWNLOAD_URL, data={"select": True, "course": course.name})
+    client.post(
+        DOWNLOAD_URL,
+        data=dict(submit="download", course=course.name, exercise="1.0.1"),
+    ).close()
+    client.post(
+        "/student_login", data=dict(username="admin", password="wrong password")
+    )
+
+    assert actions(app) == [
+        ("login", "test_admin", None),
+        ("exercise.download", "test_admin", "Test Course/1.0.1"),
+        ("login.failed", "test_admin", "admin"),
+    ]
+
+
+def test_batches_and_latency():
+    """
+    Test that a full batch is written at once, and a lone event after the
+    flush interval.
+    """
+    sink = ListSink()
+    buffer = EventBuffer(sink, batch_size=3, interval=0.2)
+
+    for n in range(3):
+        buffer.put({"n": n})
+    assert sink.written.wait(1)
+    assert sink.batches == [[0, 1, 2]]
+
+    sink.written.clear()
+    start = time.monotonic()
+    buffer.put({"n": 3})
+    assert sink.written.wait(2)
+    assert time.monotonic() - start >= 0.2
+    assert sink.batches == [[0, 1, 2], [3]]
+    buffer.close()
+
+
+def test_close_writes_everything():
+    """
+    Test that closing the buffer writes the waiting events, in order.
+    """
+    sink = ListSink()
+    buffer = EventBuffer(sink, batch_size=2, interval=60)
+    buffer.put({"n": 0})
+
+    buffer.close()
+    buffer.put({"n": 1})
+
+    assert sink.batches == [[0], [1]]
+
+
+def test_failing_sink_keeps_events():
+    """
+    Test that the events of a failed write are kept, in order, and that only
+    the oldest are dropped once the buffer is full.
+    """
+    sink = ListSink(failures=3)
+    buffer = EventBuffer(sink, batch_size=10, interval=60, capacity=3, background=False)
+    buffer.put({"n": 0})
+    buffer.put({"n": 1})
+
+    assert not buffer.flush()
+    buffer.put({"n": 2})  # full: written by put(), which fails again
+    buffer.put({"n": 3})  # and again: one over capacity
+
+    assert buffer.dropped == 1
+    assert buffer.flush()
+    assert sink.batches == [[1, 2, 3]]
+
+
+def test_ndjson_rotation(tmp_path):
+    """
+    Test that the NDJSON file is rotated once it is full and that only the
+    newest rotated files are kept.
+    """
+    sink = NDJSONSink(str(tmp_path), max_bytes=30, backups=1)
+    for n in range(3):
+        sink.write([{"n": n, "text": "x" * 10}])
+        time.sleep(1.01)  # rotated files are named after the second
+
+    rotated = sorted(path.name for path in tmp_path.glob("audit-*.ndjson"))
+    assert len(rotated) == 1
+    lines = (tmp_path / "audit.ndjson").read_text().splitlines()
+    assert [json.loads(line)["n"] for line in lines] == [2]
+    assert json.loads((tmp_path / rotated[0]).read_text())["n"] == 1
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+
+import pytest
+
+from app.backup import (
+    BackupError,
+    create_command,
+    create_snapshot,
+    restore_snapshot,
+    verify_snapshot,
+)
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Replaced, never rewritten, like the storage does
+    with open(f"{path}.new", "wb") as file:
+        file.write(content)
+    os.replace(f"{path}.new", path)
+
+
+@pytest.fixture()
+def uploads(app, tmp_path):
+    """
+    Fixture putting two files and an upload in progress in the upload
+    folder, and the snapshots in a temporary folder.
+    """
+    app.config["BACKUP_FOLDER"] = str(tmp_path / "backups")
+    root = app.config["UPLOAD_FOLDER"]
+    write(os.path.join(root, "Python", "1.txt"), b"one")
+    write(os.path.join(root, "Python", ".versions", "abc.txt"), b"old one")
+    write(os.path.join(root, "Python", ".tmp-upload"), b"half a fi")
+    return root
+
+
+def test_snapshot(app, uploads):
+    """
+    Test that a snapshot links the files and hashes only the changed ones.
+    """
+    with app.app_context():
+        first = create_snapshot()
+        write(os.path.join(uploads, "Python", "1.txt"), b"one, again")
+        second = create_snapshot()
+        assert verify_snapshot(first["path"]) == []
+
+    assert sorted(first["files"]) == ["Python/.versions/abc.txt", "Python/1.txt"]
+    assert first["stats"]["hashed"] == 2
+    assert second["stats"]["hashed"] == 1
+    linked = os.path.join(second["path"], "uploads", "Python", ".versions", "abc.txt")
+    assert os.path.samefile(
+        linked, os.path.join(uploads, "Python", ".versions", "abc.txt")
+    )
+    with open(os.path.join(first["path"], "uploads", "Python", "1.txt"), "rb") as file:
+        assert file.read() == b"one"
+
+
+def test_verify_and_restore(app, uploads, tmp_path):
+    """
+    Test that a damaged snapshot is refused, and an intact one put back.
+    """
+    with app.app_context():
+        snapshot = create_snapshot()["path"]
+        write(os.path.join(uploads, "Python", "1.txt"), b"changed")
+        os.remove(os.path.join(uploads, "Python", ".versions", "abc.txt"))
+        restored = str(tmp_path / "restored.sqlite3")
+        restore_snapshot(snapshot, database=restored)
+
+        write(os.path.join(snapshot, "uploads", "Python", "1.txt"), b"damaged")
+        with pytest.raises(BackupError):
+            verify_snapshot(snapshot)
+
+    with open(os.path.join(uploads, "Python", "1.txt"), "rb") as file:
+        assert file.read() == b"one"
+    assert os.path.exists(os.path.join(uploads, "Python", ".versions", "abc.txt"))
+    with sqlite3.connect(restored) as connection:
+        roles = connection.execute("SELECT count(*) FROM roles").fetchone()[0]
+    assert roles == 4
+
+
+def test_create_command(runner, uploads):
+    """
+    Test that the command reports the duration and throughput of the backup.
+    """
+    result = runner.invoke(create_command)
+
+    assert result.exit_code == 0, result.output
+    assert "Database:" in result.output
+    assert "Files: 2 (0.0 MiB, 2 hashed)" in result.output
+    assert "MiB/s" in result.output
@@ -0,0 +1,104 @@
+import gzip
+import os
+
+from app.compression import backfill_command, compress_exercise, negotiate
+from app.extensions import db
+from app.tasks import process_exercise
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+CONTENT = b"Write a function returning the n-th Fibonacci number.\n" * 100
+
+
+def download(client, **headers):
+    client.post(
+        "/admin/download_admin/admin/download/",
+        data={"select": True, "course": "Test Course"},
+    )
+    return client.post(
+        "/admin/download_admin/admin/download/",
+        data=dict(submit="download", course="Test Course", exercise="1.0.1"),
+        headers=headers,
+    )
+
+
+def test_processed_exercise_is_compressed(app, setup_course_and_exercise_data):
+    """
+    Test that post-processing a large enough text exercise stores a gzip
+    variant next to it, and that small files are left alone.
+    """
+    _, exercise = setup_course_and_exercise_data
+    with open(exercise.exercise_path, "wb") as file:
+        file.write(CONTENT)
+
+    process_exercise(exercise.exercise_id)
+
+    assert "gzip" in exercise.encodings.split()
+    with open(exercise.exercise_path + ".gz", "rb") as file:
+        assert gzip.decompress(file.read()) == CONTENT
+
+    # A new upload too small to gain anything drops the stale variant
+    with open(exercise.exercise_path, "wb") as file:
+        file.write(b"Test content")
+    process_exercise(exercise.exercise_id)
+
+    assert exercise.encodings is None
+    assert not os.path.exists(exercise.exercise_path + ".gz")
+
+
+def test_negotiate(app, setup_course_and_exercise_data):
+    """
+    Test that the client's qualities decide, then the order of preference.
+    """
+    _, exercise = setup_course_and_exercise_data
+    exercise.encodings = "zstd gzip"
+
+    def negotiated(header):
+        return negotiate(exercise, parse_accept_header(header, Accept))
+
+    assert negotiated("gzip, deflate, br, zstd") == "zstd"
+    assert negotiated("gzip;q=1, zstd;q=0.5") == "gzip"
+    assert negotiated("*;q=0.1, zstd;q=0") == "gzip"
+    assert negotiated("identity") is None
+    assert negotiated("") is None
+
+
+def test_compressed_download(admin_login, setup_course_and_exercise_data):
+    """
+    Test that the download sends the variant the client accepts, encoded.
+    """
+    client, _ = admin_login
+    _, exercise = setup_course_and_exercise_data
+    with open(exercise.exercise_path, "wb") as file:
+        file.write(CONTENT)
+    process_exercise(exercise.exercise_id)
+
+    response = download(client, **{"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert "attachment" in response.headers["Content-Disposition"]
+    assert response.mimetype == "text/plain"
+    assert int(response.headers["Content-Length"]) < len(CONTENT)
+    assert gzip.decompress(response.data) == CONTENT
+
+    response = download(client)
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.data == CONTENT
+
+
+def test_backfill_command(app, runner, setup_course_and_exercise_data):
+    """
+    Test that "flask compression backfill" compresses the existing exercises.
+    """
+    _, exercise = setup_course_and_exercise_data
+    with open(exercise.exercise_path, "wb") as file:
+        file.write(CONTENT)
+    exercise.size = len(CONTENT)
+    db.session.commit()
+
+    result = runner.invoke(backfill_command)
+
+    assert "1 exercises compressed, 0 failed." in result.output
+    assert "gzip" in exercise.encodings.split()
+    assert compress_exercise(exercise) == exercise.encodings.split()
@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+from app.events import DatabaseBroker, LocalBroker
+from app.extensions import db
+from app.manifests import course_manifests
+from app.models import Course, User
+from app.tasks import process_exercise
+
+
+def test_broker():
+    """
+    Test that a publication wakes up the clients of its course only, and
+    only those waiting from before it.
+    """
+    broker = LocalBroker()
+    broker.publish(1, "a")
+    broker.publish(2, "b")
+    assert broker.wait(1, "old", timeout=5, after=0) == ("a", 1)
+    # The client read a digest the broker hasn't seen yet
+    assert broker.wait(1, "new", timeout=0.05) is None
+
+    threading.Timer(0.1, broker.publish, (2, "c")).start()
+    assert broker.wait(1, "a", timeout=0.3) is None
+    threading.Timer(0.1, broker.publish, (1, "d")).start()
+    assert broker.wait(1, "a", timeout=5) == ("d", 2)
+    assert broker.awaited() == []
+
+
+@pytest.fixture()
+def watched_course(app, student_login, setup_course_and_exercise_data):
+    """
+    Fixture enrolling the logged in student in a course, and returning the
+    client, the ids of the course and of its exercise, and the URL of the
+    events of the course. The requests close the session of the test.
+    """
+    client, _ = student_login
+    course, exercise = setup_course_and_exercise_data
+    student = User.query.filter_by(username="test_student").one()
+    student.courses.append(course)
+    db.session.commit()
+    app.config.update(EVENTS_LONG_POLL_SECONDS=0.2, EVENTS_STREAM_SECONDS=0.3)
+    course_id, exercise_id = course.course_id, exercise.exercise_id
+    return client, course_id, exercise_id, f"/api/courses/{course_id}/events"
+
+
+def test_long_poll(app, watched_course):
+    """
+    Test that a poll returns as soon as the manifest differs from the
+    client's, after a committed change, or after the timeout.
+    """
+    client, course_id, exercise_id, url = watched_course
+    digest = client.get(url).json["digest"]
+
+    assert client.get(url, query_string={"since": digest}).status_code == 204
+
+    process_exercise(exercise_id)
+    changed = client.get(url, query_string={"since": digest}).json
+    assert changed == {"course_id": course_id, "digest": changed["digest"]}
+    assert changed["digest"] != digest
+    # The commit published it
+    broker = app.extensions["events"]
+    assert broker.wait(course_id, digest, timeout=0, after=0)[0] == changed["digest"]
+
+    app.config["EVENTS_LONG_POLL_SECONDS"] = 5
+    threading.Timer(0.1, broker.publish, (course_id, "new")).start()
+    response = client.get(url, query_string={"since": changed["digest"]})
+    assert response.json["digest"] == "new"
+
+    assert client.get("/api/courses/9999/events").status_code == 404
+
+
+def test_database_brokers(app, setup_course_and_exercise_data):
+    """
+    Test that the brokers of two processes sharing a database see each
+    other's commits, and never wake up a client on an older digest.
+    """
+    course, exercise = setup_course_and_exercise_data
+    course_id, exercise_id = course.course_id, exercise.exercise_id
+    first, second = DatabaseBroker(app, 0.01), DatabaseBroker(app, 0.01)
+
+    def digest():
+        return course_manifests([db.session.get(Course, course_id)])[0]["digest"]
+
+    old = digest()
+    first.publish(course_id, old)
+    # Committed by the other process: only the database knows it
+    process_exercise(exercise_id)
+    new = digest()
+    assert new != old
+
+    after = second.position(course_id)
+    assert second.wait(course_id, old, timeout=5, after=after)[0] == new
+    # "first" still holds the old digest, which isn't news to a client
+    #   holding the new one
+    assert first.wait(course_id, new, timeout=0.2) is None
+    assert first.wait(course_id, old, timeout=5, after=0)[0] == new
+
+
+def test_event_stream(watched_course):
+    """
+    Test that a stream starts with the digest the client lacks, and is
+    closed after EVENTS_STREAM_SECONDS.
+    """
+    client, course_id, _, url = watched_course
+    headers = {"Accept": "text/event-stream"}
+
+    response = client.get(url, headers=headers)
+
+    assert response.mimetype == "text/event-stream"
+    retry, event, *rest = response.get_data(as_text=True).split("\n\n")
+    assert retry == "retry: 1000"
+    digest = event.split("\n")[0].removeprefix("id: ")
+    assert event == (
+        f"id: {digest}\nevent: manifest\n"
+        f'data: {{"course_id": {course_id}, "digest": "{digest}"}}'
+    )
+    assert "event:" not in "".join(rest)
+
+    headers["Last-Event-ID"] = digest
+    assert "event:" not in client.get(url, headers=headers).get_data(as_text=True)
@@ -0,0 +1,140 @@
+import io
+import os
+
+import pytest
+
+from app.analytics import RollupSink
+from app.filecache import FileCache, warm_command
+from app.models import utcnow
+from app.storage import LocalStorage
+
+DOWNLOAD_URL = "/admin/download_admin/admin/download/"
+
+
+class Source:
+    """Contents by key, counting the fetches."""
+
+    def __init__(self, **contents):
+        self.contents = contents
+        self.fetches = 0
+
+    def fetch(self, key):
+        def open_stream():
+            self.fetches += 1
+            return io.BytesIO(self.contents[key])
+
+        return open_stream
+
+
+@pytest.fixture()
+def cached_app(app, tmp_path):
+    """
+    Fixture giving the local storage of the app a file cache.
+    """
+    cache = FileCache(str(tmp_path / "cache"), 1024**2)
+    app.extensions["file_cache"] = cache
+    app.extensions["storage"] = LocalStorage(cache=cache)
+    return app
+
+
+def test_hits_and_versions(tmp_path):
+    """
+    Test that a file is fetched once per version, keeping its extension.
+    """
+    cache = FileCache(str(tmp_path), 1024)
+    source = Source(a=b"hello")
+
+    path = cache.path("c/a.txt", "v1", source.fetch("a"))
+    assert cache.path("c/a.txt", "v1", source.fetch("a")) == path
+    assert path.endswith(".txt")
+    with open(path, "rb") as file:
+        assert file.read() == b"hello"
+
+    source.contents["a"] = b"bye"
+    assert cache.path("c/a.txt", "v2", source.fetch("a")) != path
+    assert source.fetches == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_lru_eviction(tmp_path):
+    """
+    Test that the least recently used files go once over the byte budget.
+    """
+    cache = FileCache(str(tmp_path), 250)
+    source = Source(a=b"a" * 100, b=b"b" * 100, c=b"c" * 100)
+    a = cache.path("a", "1", source.fetch("a"))
+    b = cache.path("b", "1", source.fetch("b"))
+    # "a" was used last, long after "b"
+    os.utime(b, (1000, 1000))
+    os.utime(a, (2000, 2000))
+
+    c = cache.path("c", "1", source.fetch("c"))
+
+    assert os.path.exists(a) and os.path.exists(c)
+    assert not os.path.exists(b)
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 200
+
+
+def test_failed_fetch_leaves_nothing(tmp_path):
+    """
+    Test that a fetch failing half way leaves neither entry nor temporary file.
+    """
+    cache = FileCache(str(tmp_path), 1024)
+
+    class Broken(io.BytesIO):
+        def read(self, size=-1):
+            raise OSError("connection reset")
+
+    with pytest.raises(OSError):
+        cache.path("a", "1", lambda: Broken())
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_downloads_served_from_cache(
+    cached_app, admin_login, setup_course_and_exercise_data
+):
+    """
+    Test that downloads of a local file go through the cache.
+    """
+    client, _ = admin_login
+    course, _ = setup_course_and_exercise_data
+    client.post(DOWNLOAD_URL, data={"select": True, "course": course.name})
+
+    for _ in range(2):
+        response = client.post(
+            DOWNLOAD_URL,
+            data=dict(submit="download", course=course.name, exercise="1.0.1"),
+        )
+        assert response.data == b"Test content"
+        assert "test_file.txt" in response.headers["Content-Disposition"]
+        response.close()
+
+    stats = client.get("/api/cache").json
+    assert (stats["misses"], stats["hits"]) == (1, 1)
+
+
+def test_warm_command(cached_app, runner, setup_course_and_exercise_data):
+    """
+    Test that "flask cache warm" fetches the most downloaded exercises.
+    """
+    course, exercise = setup_course_and_exercise_data
+    RollupSink(cached_app).write(
+        [
+            (
+                utcnow().replace(second=0, microsecond=0),
+                course.course_id,
+                exercise.exercise_id,
+                12,
+                0,
+                0,
+            )
+        ]
+    )
+
+    result = runner.invoke(warm_command)
+
+    assert "1 exercises cached." in result.output
+    assert cached_app.extensions["file_cache"].stats()["entries"] == 1
@@ -0,0 +1,149 @@
+import hashlib
+import io
+from datetime import timedelta
+
+import pytest
+
+from app.extensions import db
+from app.jobs import TASKS, claim_next_job, enqueue, run_job, task
+from app.models import Exercise
+
+
+@pytest.fixture()
+def flaky_task():
+    """
+    Register a task that fails on its first call, and unregister it afterwards.
+    """
+    calls = []
+
+    @task("flaky")
+    def flaky(value):
+        calls.append(value)
+        if len(calls) == 1:
+            raise RuntimeError("first attempt fails")
+
+    yield calls
+
+    TASKS.pop("flaky")
+
+
+def test_enqueue_runs_inline(app, flaky_task):
+    """
+    Test that with JOBS_INLINE the job runs (and fails once) during enqueue.
+    """
+    with app.app_context():
+        job = enqueue("flaky", value=1)
+
+        assert flaky_task == [1]
+        assert job.status == "queued"
+        assert job.attempts == 1
+        assert "first attempt fails" in job.last_error
+
+
+def test_worker_retries_until_done(app, flaky_task):
+    """
+    Test that a worker claims due jobs and retries failed ones.
+    """
+    app.config["JOBS_INLINE"] = False
+    app.config["JOBS_BACKGROUND_THREAD"] = False
+    app.config["JOBS_RETRY_BACKOFF"] = 0
+
+    with app.app_context():
+        job = enqueue("flaky", value=2)
+        assert job.status == "queued"
+
+        run_job(claim_next_job())
+        assert job.status == "queued"
+
+        run_job(claim_next_job())
+        assert job.status == "done"
+        assert job.attempts == 2
+        assert claim_next_job() is None
+
+
+def test_job_fails_after_max_attempts(app, flaky_task):
+    """
+    Test that a job is given up once it has used all its attempts.
+    """
+    app.config["JOBS_INLINE"] = False
+    app.config["JOBS_BACKGROUND_THREAD"] = False
+
+    with app.app_context():
+        job = enqueue("flaky", value=3, max_attempts=1)
+        run_job(claim_next_job())
+
+        assert job.status == "failed"
+
+
+def test_expired_lease(app, flaky_task):
+    """
+    Test that a job whose worker died is queued again, and failed once it
+    has used all its attempts.
+    """
+    app.config["JOBS_INLINE"] = False
+    app.config["JOBS_BACKGROUND_THREAD"] = False
+
+    lease = timedelta(seconds=app.config["JOBS_LEASE_SECONDS"] + 1)
+
+    with app.app_context():
+        job = enqueue("flaky", value=4, max_attempts=2)
+        assert claim_next_job() is job
+        # The worker never comes back
+        job.locked_at -= lease
+        db.session.commit()
+        assert claim_next_job() is job
+        assert job.attempts == 2
+        job.locked_at -= lease
+        db.session.commit()
+
+        assert claim_next_job() is None
+        db.session.refresh(job)
+        assert job.status == "failed"
+        assert "worker stopped" in job.last_error
+
+
+def test_upload_computes_checksum(admin_login, app, setup_course_and_exercise_data):
+    """
+    Test that uploading an exercise enqueues its post-processing.
+    """
+    client, _ = admin_login
+    course, _ = setup_course_and_exercise_data
+    content = b"This is the exercise 2.0.1"
+
+    client.post(
+        "/admin/upload_admin/admin/upload/",
+        data={"courses": course.name, "select": "Submit"},
+    )
+    client.post(
+        "/admin/upload_admin/admin/upload/",
+        data={
+            "courses": course.name,
+            "submit": "Upload",
+            "exercise": (io.BytesIO(content), "2.0.1.txt"),
+        },
+        content_type="multipart/form-data",
+    )
+
+    exercise = Exercise.query.filter_by(number="2.0.1").first()
+    assert exercise.sha256 == hashlib.sha256(content).hexdigest()
+    assert exercise.size == len(content)
+
+    db.session.delete(exercise)
+    db.session.commit()
+
+
+def test_job_status_endpoint(admin_login, app, flaky_task):
+    """
+    Test the JSON status endpoint of a job.
+    """
+    client, _ = admin_login
+
+    with app.app_context():
+        job_id = enqueue("flaky", value=4).job_id
+
+    response = client.get(f"/api/jobs/{job_id}")
+
+    assert response.status_code == 200
+    assert response.json["name"] == "flaky"
+    assert response.json["attempts"] == 1
+    assert client.get("/api/jobs/999").status_code == 404
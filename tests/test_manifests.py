@@ -0,0 +1,131 @@
+import pytest
+from sqlalchemy import event
+
+from app.extensions import db
+from app.manifests import course_manifests, rebuild_command
+from app.models import Course, CourseManifest, Exercise, Role, User
+
+
+@pytest.fixture()
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+@pytest.fixture()
+def enrolled_student(student_user):
+    """
+    Fixture enrolling the student in a course of three exercises.
+    """
+    course = Course(name="Python")
+    course.exercises = [
+        Exercise(number=number, exercise_path=f"Python/{number}.txt")
+        for number in ("1.10", "1.2", "2")
+    ]
+    student_user.courses.append(course)
+    db.session.commit()
+    return course
+
+
+def numbers(course):
+    return [entry["number"] for entry in course_manifests([course])[0]["exercises"]]
+
+
+def test_manifest_follows_exercises(app_context):
+    """
+    Test that the manifest is rebuilt when exercises are added, processed,
+    hidden, moved or deleted.
+    """
+    python, java = Course(name="Python"), Course(name="Java")
+    exercise = Exercise(number="1.10", course=python)
+    db.session.add_all([python, java, exercise, Exercise(number="1.2", course=python)])
+    db.session.commit()
+    assert numbers(python) == ["1.2", "1.10"]
+    digest = db.session.get(CourseManifest, python.course_id).digest
+
+    exercise.sha256, exercise.size, exercise.flag_visible = "abc", 3, True
+    db.session.commit()
+    entry = course_manifests([python])[0]["exercises"][1]
+    assert (entry["sha256"], entry["size"], entry["visible"]) == ("abc", 3, True)
+    assert db.session.get(CourseManifest, python.course_id).digest != digest
+
+    exercise.course = java
+    db.session.commit()
+    assert numbers(python) == ["1.2"]
+    assert numbers(java) == ["1.10"]
+
+    db.session.delete(exercise)
+    db.session.commit()
+    assert numbers(java) == []
+
+
+def test_rebuild_command(app_context, runner):
+    """
+    Test that "flask manifests rebuild" repairs a missing manifest.
+    """
+    course = Course(name="Python")
+    db.session.add_all([course, Exercise(number="1.0", course=course)])
+    db.session.commit()
+    db.session.query(CourseManifest).delete()
+    db.session.commit()
+
+    result = runner.invoke(rebuild_command)
+
+    assert "manifests rebuilt." in result.output
+    assert db.session.get(CourseManifest, course.course_id) is not None
+
+
+def test_profile_reads_no_exercises(app, student_login, enrolled_student):
+    """
+    Test that the student's download form is filled from the manifest.
+    """
+    client, _ = student_login
+    client.post("/student/test_student/", data={"select": True, "course": "Python"})
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/student/test_student/")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    assert response.data.index(b'"1.2"') < response.data.index(b'"1.10"')
+    assert not any("FROM exercises" in statement for statement in statements)
+
+
+def test_manifest_api(student_login, enrolled_student):
+    """
+    Test that the API serves the manifests of the student's courses, with an ETag.
+    """
+    client, _ = student_login
+
+    response = client.get("/api/manifest")
+    [course] = response.json["courses"]
+    assert [entry["number"] for entry in course["exercises"]] == ["1.2", "1.10", "2"]
+
+    again = client.get(
+        "/api/manifest", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert again.status_code == 304
+
+
+def test_user_numbers(app_context):
+    """
+    Test that User.numbers() lists the exercises of every course of the user.
+    """
+    student = User(
+        username="ada",
+        fs_uniquifier="ada",
+        roles=[Role.query.filter_by(name="student").one()],
+        courses=[
+            Course(name="Python", exercises=[Exercise(number="1.0")]),
+            Course(name="Java", exercises=[Exercise(number="2.0")]),
+        ],
+    )
+    db.session.add(student)
+    db.session.commit()
+
+    assert student.numbers() == "1.0, 2.0"
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from app.extensions import db
+from app.models import Exercise
+from app import natsort
+from app.natsort import natural_key, natural_order, natural_sort_key, natural_sorted
+
+NUMBERS = ["10", "1.10", "a", "1.2", "2", "1.01", "1.1", "b2", "b10", "", "1a", "01"]
+ORDERED = ["", "01", "1.01", "1.1", "1.2", "1.10", "1a", "2", "10", "a", "b2", "b10"]
+
+
+@pytest.fixture()
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+def test_natural_key():
+    """
+    Test the natural order, mixing values starting with digits and with text.
+    """
+    assert sorted(NUMBERS, key=natural_key) == ORDERED
+
+
+def test_sort_key_matches_natural_key():
+    """
+    Test that the string encoding for SQL sorts like the Python key.
+    """
+    random.seed(0)
+    alphabet = "0123456789.ab-"
+    values = [
+        "".join(random.choices(alphabet, k=random.randint(0, 8))) for _ in range(2000)
+    ]
+
+    assert sorted(values, key=natural_sort_key) == sorted(values, key=natural_key)
+
+
+def test_sql_order(app_context, setup_course_and_exercise_data, monkeypatch):
+    """
+    Test that the database sorts with the NATURAL collation and natsort_key().
+    """
+    course, _ = setup_course_and_exercise_data
+    for number in NUMBERS:
+        db.session.add(Exercise(number=f"x{number}", course=course, exercise_path="x"))
+    db.session.flush()
+    numbers = Exercise.query.filter(Exercise.number.startswith("x"))
+
+    by_collation = numbers.order_by(Exercise.number.collate("NATURAL")).all()
+    by_function = numbers.order_by(natural_order(Exercise.number)).all()
+
+    expected = [f"x{number}" for number in ORDERED]
+    assert [exercise.number for exercise in by_collation] == expected
+    assert [exercise.number for exercise in by_function] == expected
+
+    # Databases without the function sort in Python
+    monkeypatch.setattr(natsort, "_in_sql", lambda: False)
+    by_python = natural_sorted(numbers, Exercise.number)
+    assert [exercise.number for exercise in by_python] == expected
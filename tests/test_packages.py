@@ -0,0 +1,134 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from app.debian import DebError, read_control, version_sort_key
+from app.extensions import db
+from app.models import Exercise, Package
+from app.packages import backfill_command, latest_packages, package_versions
+from app.tasks import process_exercise
+
+
+def test_read_control(tmp_path, make_deb):
+    """
+    Test that the control fields are read from the ar/tar members.
+    """
+    path = make_deb(
+        tmp_path / "hello.deb",
+        package="hello",
+        version="2.10-3",
+        Architecture="amd64",
+        Depends="libc6 (>= 2.34)",
+    )
+
+    with open(path, "rb") as file:
+        fields = read_control(file)
+
+    assert fields["Package"] == "hello"
+    assert fields["Version"] == "2.10-3"
+    assert fields["Architecture"] == "amd64"
+    assert fields["Depends"] == "libc6 (>= 2.34)"
+
+
+def test_read_control_rejects_other_files(tmp_path):
+    """
+    Test that a file which is not an ar archive raises DebError.
+    """
+    path = tmp_path / "fake.deb"
+    path.write_bytes(b"This is not a package")
+
+    with open(path, "rb") as file, pytest.raises(DebError):
+        read_control(file)
+
+
+def ar_header(name, size):
+    return f"{name:<16}{0:<12}{0:<6}{0:<6}{100644:<8}{size:<10}`\n".encode()
+
+
+@pytest.mark.parametrize("problem", ["ar header", "control encoding"])
+def test_read_control_rejects_corrupted_packages(tmp_path, problem):
+    """
+    Test that a corrupted ar header or a control file which isn't UTF-8
+    raise DebError, which the indexing expects, and nothing else.
+    """
+    if problem == "ar header":
+        content = b"!<arch>\n" + ar_header("debian-binary/", 4)[:48] + b"four".ljust(10)
+        content += b"`\n2.0\n"
+    else:
+        control = b"Package: caf\xe9\nVersion: 1.0\n"
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            info = tarfile.TarInfo("./control")
+            info.size = len(control)
+            tar.addfile(info, io.BytesIO(control))
+        data = buffer.getvalue()
+        content = b"!<arch>\n" + ar_header("control.tar/", len(data)) + data
+    path = tmp_path / "corrupted.deb"
+    path.write_bytes(content)
+
+    with open(path, "rb") as file, pytest.raises(DebError):
+        read_control(file)
+
+
+def test_version_sort_key_follows_dpkg_order():
+    """
+    Test that the encoded versions sort like "dpkg --compare-versions".
+    """
+    ordered = ["0.9", "1.0~rc1", "1.0", "1.0-1", "1.0a", "1.0.1", "1.10", "1:0.1"]
+
+    assert sorted(reversed(ordered), key=version_sort_key) == ordered
+    assert version_sort_key("1.0") == version_sort_key("1.0-0")
+
+
+def add_deb_exercise(course, path, number):
+    exercise = Exercise(number=number, course=course, exercise_path=str(path))
+    db.session.add(exercise)
+    db.session.commit()
+    return exercise
+
+
+def test_processed_exercise_is_indexed(app, setup_course_and_exercise_data, make_deb):
+    """
+    Test that post-processing a .deb exercise stores its package metadata.
+    """
+    course, _ = setup_course_and_exercise_data
+    course_path = os.path.dirname(course.exercises[0].exercise_path)
+
+    old = add_deb_exercise(
+        course, make_deb(os.path.join(course_path, "a.deb"), "tool", "1.9"), "1.9"
+    )
+    new = add_deb_exercise(
+        course, make_deb(os.path.join(course_path, "b.deb"), "tool", "1.10"), "1.10"
+    )
+    process_exercise(old.exercise_id)
+    process_exercise(new.exercise_id)
+
+    assert [p.version for p in package_versions("tool")] == ["1.9", "1.10"]
+    assert [p.version for p in latest_packages(course.course_id)] == ["1.10"]
+    assert new.package.size == os.path.getsize(new.exercise_path)
+
+    db.session.delete(old)
+    db.session.delete(new)
+    db.session.commit()
+    assert Package.query.count() == 0
+
+
+def test_backfill_command(app, runner, setup_course_and_exercise_data, make_deb):
+    """
+    Test that "flask packages backfill" indexes the existing .deb exercises.
+    """
+    course, _ = setup_course_and_exercise_data
+    course_path = os.path.dirname(course.exercises[0].exercise_path)
+    exercise = add_deb_exercise(
+        course, make_deb(os.path.join(course_path, "c.deb"), "old", "0.1"), "0.1"
+    )
+
+    result = runner.invoke(backfill_command)
+
+    assert "1 packages indexed, 0 failed." in result.output
+    assert Package.query.filter_by(exercise_id=exercise.exercise_id).one().name == "old"
+
+    db.session.delete(exercise)
+    db.session.commit()
@@ -0,0 +1,133 @@
+from threading import BoundedSemaphore
+
+import pytest
+
+from app.ratelimit import MemoryBackend, SQLiteBackend, parse_limit
+
+DOWNLOAD_URL = "/admin/download_admin/admin/download/"
+
+
+@pytest.fixture()
+def limited_app(app):
+    """
+    Fixture enabling the rate limits, which are off in the tests.
+    """
+    app.config["RATELIMIT_ENABLED"] = True
+    app.config["RATELIMITS"] = dict(
+        app.config["RATELIMITS"], login="2/minute", download="1/minute"
+    )
+    return app
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_token_bucket(tmp_path, backend):
+    """
+    Test that a bucket allows a burst, then refills at the given rate.
+    """
+    if backend == "memory":
+        bucket = MemoryBackend()
+    else:
+        bucket = SQLiteBackend(str(tmp_path / "ratelimit.db"))
+    rate, burst = parse_limit("3/minute")
+
+    assert [bucket.take("k", rate, burst, now=100) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take("k", rate, burst, now=100) == pytest.approx(20)
+    assert bucket.take("other", rate, burst, now=100) == 0
+    assert bucket.take("k", rate, burst, now=120) == 0
+
+
+def test_sqlite_buckets_are_shared(tmp_path):
+    """
+    Test that two processes (here: two backends) draw from the same bucket.
+    """
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+
+    assert first.take("k", 1, 1, now=100) == 0
+    assert second.take("k", 1, 1, now=100) == pytest.approx(1)
+
+
+def test_memory_buckets_are_pruned(monkeypatch):
+    """
+    Test that the buckets which are full again are forgotten, and the others
+    kept.
+    """
+    monkeypatch.setattr(MemoryBackend, "PRUNE_EVERY", 10)
+    bucket = MemoryBackend()
+    rate, burst = parse_limit("3/minute")
+
+    bucket.take("busy", rate, burst, now=100)
+    bucket.take("busy", rate, burst, now=100)
+    for i in range(7):
+        bucket.take(f"login:{i}", rate, burst, now=100)
+    # One token is back 20s later: only "busy" still misses one
+    bucket.take("login:new", rate, burst, now=125)
+
+    assert set(bucket._buckets) == {"busy", "login:new"}
+    assert bucket.take("busy", rate, burst, now=125) == 0
+    assert bucket.take("busy", rate, burst, now=125) == 0
+    assert bucket.take("busy", rate, burst, now=125) == pytest.approx(15)
+
+
+def test_login_rate_limited(limited_app, client):
+    """
+    Test that too many login attempts from one address get a 429.
+    """
+    data = dict(username="nobody", password="wrong password")
+
+    for _ in range(2):
+        assert client.post("/student_login", data=data).status_code == 200
+    response = client.post("/student_login", data=data)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    # Showing the form is not limited
+    assert client.get("/student_login").status_code == 200
+
+
+def download(client, course):
+    return client.post(
+        DOWNLOAD_URL,
+        data=dict(submit="download", course=course.name, exercise="1.0.1"),
+    )
+
+
+def test_download_rate_limited(
+    limited_app, admin_login, setup_course_and_exercise_data
+):
+    """
+    Test that the downloads of one user are rate limited.
+    """
+    client, _ = admin_login
+    course, _ = setup_course_and_exercise_data
+    client.post(DOWNLOAD_URL, data={"select": True, "course": course.name})
+
+    assert download(client, course).status_code == 200
+    assert download(client, course).status_code == 429
+
+
+def test_transfer_slots(limited_app, admin_login, setup_course_and_exercise_data):
+    """
+    Test that a download waiting for a transfer slot in vain gets a 503, and
+    that the slot is released once the response is closed.
+    """
+    client, _ = admin_login
+    course, _ = setup_course_and_exercise_data
+    client.post(DOWNLOAD_URL, data={"select": True, "course": course.name})
+    limited_app.config["RATELIMITS"]["download"] = "10/minute"
+    limited_app.config["RATELIMIT_QUEUE_TIMEOUT"] = 0.01
+    slot = BoundedSemaphore(1)
+    limited_app.extensions["ratelimit"]["slots"]["transfer"] = slot
+
+    slot.acquire()
+    response = download(client, course)
+    slot.release()
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    response = download(client, course)
+    assert response.status_code == 200
+    # The slot is held until the file has been sent
+    assert not slot.acquire(blocking=False)
+    response.close()
+    assert slot.acquire(blocking=False)
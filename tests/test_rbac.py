@@ -0,0 +1,121 @@
+import pytest
+
+from app.extensions import db
+from app.models import Course, Role, User
+from app.rbac import SESSION_KEY, Permission, compile_grants, grants
+
+
+@pytest.fixture()
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+def make_user(name, *role_names, **fields):
+    roles = Role.query.filter(Role.name.in_(role_names)).all()
+    user = User(username=name, active=True, fs_uniquifier=name, roles=roles, **fields)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_compiled_grants(app_context):
+    """
+    Test the permissions and course scope compiled from the roles.
+    """
+    python, java = Course(name="Python"), Course(name="Java")
+    student = make_user("ada", "student")
+    student.courses.append(python)
+    admin = make_user("root", "administrator")
+    db.session.add(java)
+    db.session.commit()
+
+    student_grants = compile_grants(student)
+    assert student_grants.can(Permission.DOWNLOAD)
+    assert not student_grants.can(Permission.ADMIN)
+    assert student_grants.can_access_course(python.course_id)
+    assert not student_grants.can_access_course(java.course_id)
+
+    admin_grants = compile_grants(admin)
+    assert admin_grants.can(Permission.ADMIN | Permission.JOBS)
+    assert admin_grants.can_access_course(java.course_id)
+
+
+def test_region_scope_and_versions(app_context):
+    """
+    Test that "application" users reach the courses of their region, and that
+    changes of roles or regions bump the version of the users concerned.
+    """
+    north = Course(name="North", region="north")
+    south = Course(name="South", region="south")
+    db.session.add_all([north, south])
+    user = make_user("app", "application", region="north")
+    version = user.rbac_version
+
+    scope = compile_grants(user)
+    assert scope.can_access_course(north.course_id)
+    assert not scope.can_access_course(south.course_id)
+
+    south.region = "north"
+    db.session.commit()
+    db.session.refresh(user)
+    assert user.rbac_version == version + 1
+    assert compile_grants(user).can_access_course(south.course_id)
+
+    user.roles.append(Role.query.filter_by(name="teacher").one())
+    db.session.commit()
+    assert user.rbac_version == version + 2
+
+
+def test_grants_cached_in_session(student_login):
+    """
+    Test that the grants are compiled once per identity version: the
+    permissions in the session, the course scope in the process.
+    """
+    client, _ = student_login
+
+    assert client.get("/api/stats").status_code == 403
+    with client.session_transaction() as session:
+        _, version, _, permissions = session[SESSION_KEY]
+    assert permissions == Permission.DOWNLOAD
+
+    # The requests run in the app context of the student_user fixture
+    user = User.query.filter_by(username="test_student").one()
+    user.roles.append(Role.query.filter_by(name="administrator").one())
+    db.session.commit()
+
+    assert client.get("/api/stats").status_code == 200
+    with client.session_transaction() as session:
+        assert session[SESSION_KEY][1] == version + 1
+
+
+def test_deleted_course_leaves_scope(app_context):
+    """
+    Test that deleting a course bumps the version of its users, so that a new
+    course getting its id isn't in their cached scope.
+    """
+    python = Course(name="Python", region="north")
+    db.session.add(python)
+    student = make_user("ada", "student")
+    student.courses.append(python)
+    application = make_user("app", "application", region="north")
+    db.session.commit()
+    versions = student.rbac_version, application.rbac_version
+
+    db.session.delete(python)
+    db.session.commit()
+    db.session.refresh(application)
+
+    assert (student.rbac_version, application.rbac_version) == (
+        versions[0] + 1,
+        versions[1] + 1,
+    )
+    assert compile_grants(student).scope == frozenset()
+
+
+def test_anonymous_has_no_grants(app):
+    """
+    Test that anonymous users get no permission.
+    """
+    with app.test_request_context():
+        assert grants() == (0, frozenset())
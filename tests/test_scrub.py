@@ -0,0 +1,115 @@
+import json
+import os
+
+import pytest
+
+from app.extensions import db
+from app.models import Exercise
+from app.scrub import verify_command, verify_store
+from app.tasks import file_sha256, process_exercise
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def test_mapped_files_hash_alike(tmp_path):
+    """
+    Test that mapped and read files hash alike.
+    """
+    path = str(tmp_path / "file")
+    write(path, os.urandom(100_000))
+
+    assert file_sha256(path, mmap_min_size=1) == file_sha256(path)
+    assert file_sha256(path, mmap_min_size=10**9) == file_sha256(path)
+    write(path, b"")
+    assert file_sha256(path, mmap_min_size=0) == file_sha256(path)
+
+
+def test_verify_store(app, setup_course_and_exercise_data):
+    """
+    Test that the missing, damaged and orphaned files are all reported, and
+    that the files of the versions aren't orphans.
+    """
+    course, exercise = setup_course_and_exercise_data
+    process_exercise(exercise.exercise_id)
+    root = app.config["UPLOAD_FOLDER"]
+    db.session.add(
+        Exercise(number="1.0.2", exercise_path="Test Course/gone.txt", course=course)
+    )
+    db.session.commit()
+    # Same size, other content
+    write(exercise.exercise_path, b"Test_content")
+    write(os.path.join(root, "Test Course", "stray.txt"), b"stray")
+    write(os.path.join(root, "Test Course", ".tmp-upload"), b"half")
+    write(os.path.join(root, "Old Course", "1.txt"), b"old")
+    problems = []
+
+    with app.app_context():
+        counts = verify_store(report=lambda *problem: problems.append(problem[:2]))
+
+    assert sorted(problems) == [
+        ("mismatch", "Test Course/test_file.txt"),
+        ("missing", "Test Course/gone.txt"),
+        ("orphan", "Old Course/1.txt"),
+        ("orphan", "Test Course/stray.txt"),
+    ]
+    # The exercise and its version
+    assert counts["hashed"] == 2
+    assert counts["files"] == 4
+
+
+def test_verify_resume(app, runner, setup_course_and_exercise_data, tmp_path):
+    """
+    Test that a resumed check skips the folders done, and that a clean
+    store passes.
+    """
+    checkpoint = tmp_path / "checkpoint.json"
+    app.config["SCRUB_CHECKPOINT"] = str(checkpoint)
+    write(os.path.join(app.config["UPLOAD_FOLDER"], "A", "1.txt"), b"orphan")
+    checkpoint.write_text(
+        json.dumps({"folder": "A", "after": None, "counts": {"files": 7}})
+    )
+
+    result = runner.invoke(verify_command, ["--resume"])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("8 files")
+    assert "0 missing, 0 mismatch, 0 orphan" in result.output
+    assert not checkpoint.exists()
+
+    result = runner.invoke(verify_command)
+    assert result.exit_code == 1
+    assert "orphan   A/1.txt" in result.output
+
+
+def test_resume_inside_folder(app, tmp_path):
+    """
+    Test that the progress is saved inside a folder, and that a resumed
+    check starts after the last file checked.
+    """
+    checkpoint = tmp_path / "checkpoint.json"
+    app.config.update(SCRUB_CHECKPOINT=str(checkpoint), SCRUB_CHECKPOINT_EVERY=1)
+    for name in ("1.txt", "2/1.txt", "2.txt"):
+        write(os.path.join(app.config["UPLOAD_FOLDER"], "A", *name.split("/")), b"x")
+    problems = []
+
+    def interrupt(kind, key, detail):
+        if key == "A/2.txt":
+            raise KeyboardInterrupt
+        problems.append(key)
+
+    with app.app_context():
+        with pytest.raises(KeyboardInterrupt):
+            verify_store(report=interrupt)
+        saved = json.loads(checkpoint.read_text())
+        counts = verify_store(
+            resume=True, report=lambda kind, key, detail: problems.append(key)
+        )
+
+    # In walk order, the folder "2" comes before "2.txt"
+    assert saved["folder"] == "A" and saved["after"] == "A/2/1.txt"
+    assert problems == ["A/1.txt", "A/2/1.txt", "A/2.txt"]
+    assert (counts["files"], counts["orphan"]) == (3, 3)
@@ -0,0 +1,134 @@
+import pytest
+
+from app.extensions import db
+from app.models import Course, Exercise, User
+from app.search import rebuild_index, search
+
+
+@pytest.fixture()
+def search_data(app):
+    """
+    Fixture adding a few users, courses and exercises to the search index.
+    """
+    with app.app_context():
+        python = Course(name="Python")
+        db.session.add_all(
+            [
+                python,
+                Course(name="C++"),
+                Exercise(number="3.1.4", course=python),
+                Exercise(number="3.10.1", course=python),
+            ]
+            + [User(username=f"student{i:02}", active=True) for i in range(30)]
+        )
+        db.session.commit()
+        yield
+
+
+def labels(page):
+    return [result.label for result in page.results]
+
+
+def test_prefix_search(search_data):
+    """
+    Test that labels are found by prefix, per kind, best match first.
+    """
+    assert labels(search("pyt")) == ["Python"]
+    assert labels(search("c+", kinds=["course"])) == ["C++"]
+    assert labels(search("3.1.", kinds=["exercise"])) == ["3.1.4"]
+    assert labels(search("3.1", kinds=["exercise"])) == ["3.1.4", "3.10.1"]
+    assert search("3.1.4").results[0].detail == "Python"
+
+
+def test_fuzzy_fallback(search_data):
+    """
+    Test that substrings and misspellings are found when nothing starts with
+    the query, and that labels with little in common are not.
+    """
+    assert labels(search("ython")) == ["Python"]
+    assert labels(search("pyton")) == ["Python"]
+    assert labels(search("honey")) == []
+
+
+def test_fuzzy_pagination(search_data):
+    """
+    Test that the pages of fuzzy-only results follow each other.
+    """
+    db.session.add_all([Course(name=f"Python {i}") for i in range(4)])
+    db.session.commit()
+
+    first = search("pyton", kinds=["course"], per_page=3)
+    second = search("pyton", kinds=["course"], page=2, per_page=3)
+
+    assert len(first.results) == 3 and first.has_next
+    assert len(second.results) == 2 and not second.has_next
+    assert not set(labels(first)) & set(labels(second))
+
+
+def test_pagination(search_data):
+    """
+    Test that results are paginated.
+    """
+    first = search("student", per_page=20)
+    second = search("student", page=2, per_page=20)
+
+    assert len(first.results) == 20 and first.has_next
+    assert len(second.results) == 10 and not second.has_next
+    assert not set(labels(first)) & set(labels(second))
+
+
+def test_index_follows_model_changes(search_data):
+    """
+    Test that renames and deletions are applied to the index.
+    """
+    course = Course.query.filter_by(name="Python").first()
+    course.name = "Ruby"
+    user = User.query.filter_by(username="student00").first()
+    db.session.delete(user)
+    db.session.commit()
+
+    assert labels(search("pyt")) == []
+    assert labels(search("rub")) == ["Ruby"]
+    assert search("3.1.4").results[0].detail == "Ruby"
+    assert "student00" not in labels(search("student00"))
+
+
+def test_rebuild_index(search_data):
+    """
+    Test that rebuilding the index from the tables finds every document.
+    """
+    assert rebuild_index() == 34
+    assert labels(search("pyt")) == ["Python"]
+
+
+def test_typeahead_endpoint(admin_login, search_data):
+    """
+    Test the JSON typeahead endpoint.
+    """
+    client, _ = admin_login
+
+    response = client.get("/api/search/typeahead?q=stud&kind=user&limit=3")
+
+    assert response.status_code == 200
+    assert len(response.json) == 3
+    assert response.json[0]["kind"] == "user"
+    assert client.get("/api/search/typeahead?q=x&kind=nope").status_code == 400
+    # Not a way around the limit
+    response = client.get("/api/search?q=stud&per_page=-2&page=-1")
+    assert response.json["page"] == 1
+    assert len(response.json["results"]) == response.json["per_page"] == 1
+
+
+def test_course_search_miss_suggests(admin_login, search_data):
+    """
+    Test that a course search miss suggests the closest course names.
+    """
+    client, _ = admin_login
+
+    response = client.get("/admin/course_admin/course/Pyth")
+
+    with client.session_transaction() as sess:
+        messages = [message for _, message in sess["_flashes"]]
+
+    assert response.status_code == 302
+    assert messages == ["No courses found.", "Did you mean: Python?"]
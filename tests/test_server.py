@@ -0,0 +1,101 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from sqlalchemy.exc import OperationalError
+
+from app.extensions import db
+from app.server import worker_count
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVE = """\
+from app import create_app
+from app.extensions import db
+from app.server import PreforkServer, preload
+from create_tables import create_roles
+
+app = create_app()
+with app.app_context():
+    db.create_all()
+    create_roles(app)
+preload(app)
+server = PreforkServer(app, port=0, workers=2, timeout=5)
+print(server.address, flush=True)
+server.run()
+"""
+
+
+def test_readiness(client):
+    """
+    Test that the readiness endpoint answers without logging in.
+    """
+    response = client.get("/readyz")
+
+    assert response.status_code == 200
+    assert response.json == {"status": "ready", "pid": os.getpid()}
+
+
+def test_readiness_without_database(client, monkeypatch):
+    """
+    Test that the readiness endpoint reports a database failure with a 503.
+    """
+
+    def execute(*args, **kwargs):
+        raise OperationalError("SELECT 1", {}, Exception("unable to open database"))
+
+    monkeypatch.setattr(db.session, "execute", execute)
+
+    assert client.get("/readyz").status_code == 503
+
+
+def test_worker_count():
+    """
+    Test that the default number of workers follows the usable CPUs.
+    """
+    assert worker_count() == 2 * len(os.sched_getaffinity(0)) + 1
+
+
+def worker_pids(address, requests=20):
+    pids = set()
+    for _ in range(requests):
+        with urllib.request.urlopen(f"{address}/readyz", timeout=5) as response:
+            pids.add(json.load(response)["pid"])
+    return pids
+
+
+def test_prefork_server_reload(tmp_path):
+    """
+    Test that the pre-fork server serves from its workers, replaces them all
+    on SIGHUP and exits cleanly on SIGTERM.
+    """
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'serve.db'}")
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVE],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        # create_roles() prints its progress first
+        address = next(line for line in server.stdout if line.startswith("http"))
+        address = address.strip()
+        before = worker_pids(address)
+        assert server.pid not in before
+
+        server.send_signal(signal.SIGHUP)
+        deadline = time.monotonic() + 20
+        after = worker_pids(address)
+        while after & before and time.monotonic() < deadline:
+            time.sleep(0.2)
+            after = worker_pids(address)
+
+        assert after and not after & before
+    finally:
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=20) == 0
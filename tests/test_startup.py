@@ -0,0 +1,81 @@
+from app import create_app
+from app.startup import measure_startup, parse_importtime
+from config import TestConfig
+
+# Only needed by "flask db" and the admin pages: never at startup
+LAZY_MODULES = {"alembic", "flask_migrate", "flask_admin"}
+
+
+def test_import_budget(monkeypatch):
+    """
+    Test that importing the app and calling create_app doesn't load the
+    modules which are set up lazily.
+    """
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", "sqlite://")
+
+    import_seconds, create_seconds, imports = measure_startup()
+
+    assert import_seconds > 0 and create_seconds > 0
+    assert not LAZY_MODULES & {item.name for item in imports}
+
+
+def test_parse_importtime():
+    """
+    Test that the "-X importtime" report is parsed into names and timings.
+    """
+    report = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |     _bisect\n"
+        "import time:       300 |        420 |   bisect\n"
+    )
+
+    assert [tuple(item) for item in parse_importtime(report)] == [
+        ("_bisect", 120, 120, 2),
+        ("bisect", 300, 420, 1),
+    ]
+
+
+def test_admin_set_up_on_first_request(app, client):
+    """
+    Test that the admin views are registered right before the first request.
+    """
+    assert "admin" not in app.extensions
+
+    assert client.get("/admin/").status_code == 200
+    assert len(app.extensions["admin"]) == 1
+
+
+def test_security_context_before_admin_set_up(app):
+    """
+    Test that the security templates can be rendered before the admin views
+    are set up, e.g. for a mail sent by a CLI command.
+    """
+    with app.test_request_context():
+        context = app.extensions["security"]._run_ctx_processor("login")
+
+    assert "admin" not in app.extensions
+    assert "search_form" in context
+    assert "admin_view" not in context
+
+
+def test_admin_set_up_eagerly():
+    """
+    Test that LAZY_ADMIN = False sets up the admin views in create_app.
+    """
+
+    class EagerConfig(TestConfig):
+        LAZY_ADMIN = False
+
+    app = create_app(config_class=EagerConfig)
+
+    assert "admin.index" in app.view_functions
+
+
+def test_db_command_loads_migrate(app, runner):
+    """
+    Test that "flask db" sets up Flask-Migrate when it's invoked.
+    """
+    result = runner.invoke(args=["db", "--help"])
+
+    assert "upgrade" in result.output
+    assert "migrate" in app.extensions
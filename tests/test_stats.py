@@ -0,0 +1,131 @@
+import pytest
+from sqlalchemy import update
+
+from app.extensions import db
+from app.models import Course, CourseStats, Exercise, User
+from app.stats import _fresh_course_stats, courses_stats, rebuild_command, totals
+
+
+@pytest.fixture()
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+def counters():
+    return {
+        stats.course.name: (
+            stats.enrollments,
+            stats.exercises,
+            stats.visible_exercises,
+        )
+        for stats in courses_stats()
+    }
+
+
+def assert_counters_match_tables():
+    names = dict(db.session.query(Course.course_id, Course.name))
+    fresh = {
+        names[course_id]: tuple(values)
+        for course_id, *values in db.session.execute(_fresh_course_stats())
+    }
+    assert counters() == fresh
+    assert totals()["users"] == User.query.count()
+
+
+def test_counters_follow_changes(app_context):
+    """
+    Test that the counters follow enrollments and exercises, whichever side
+    of the relationships the change is made on.
+    """
+    python, java = Course(name="Python"), Course(name="Java")
+    alice, bob = User(username="alice"), User(username="bob")
+    alice.courses.append(python)
+    java.users.append(bob)
+    db.session.add_all(
+        [
+            alice,
+            bob,
+            Exercise(number="1.0", course=python, flag_visible=True),
+            Exercise(number="1.1", course=python, flag_visible=False),
+            Exercise(number="2.0", course=java, flag_visible=True),
+        ]
+    )
+    db.session.commit()
+
+    assert counters() == {"Java": (1, 1, 1), "Python": (1, 2, 1)}
+    assert_counters_match_tables()
+
+    # Move an exercise, hide another one and change enrollments
+    moved = Exercise.query.filter_by(number="1.0").one()
+    moved.course = java
+    Exercise.query.filter_by(number="2.0").one().flag_visible = False
+    python.users.append(bob)
+    alice.courses.remove(python)
+    db.session.commit()
+
+    assert counters() == {"Java": (1, 2, 1), "Python": (1, 1, 0)}
+    assert_counters_match_tables()
+
+    # Deletions take their links and exercises with them
+    db.session.delete(bob)
+    db.session.delete(moved)
+    db.session.commit()
+
+    assert counters() == {"Java": (0, 1, 0), "Python": (0, 1, 0)}
+    assert_counters_match_tables()
+
+    db.session.delete(python)
+    db.session.commit()
+    assert "Python" not in counters()
+
+
+def test_totals(app_context):
+    """
+    Test the application-wide numbers.
+    """
+    course = Course(name="Python")
+    course.users.append(User(username="alice"))
+    db.session.add_all([course, Exercise(number="1.0", course=course)])
+    db.session.commit()
+
+    assert totals() == {
+        "users": User.query.count(),
+        "courses": 1,
+        "enrollments": 1,
+        "exercises": 1,
+        "visible_exercises": 0,
+        "hidden_exercises": 1,
+    }
+
+
+def test_rebuild_repairs_drift(app_context, runner):
+    """
+    Test that "flask stats rebuild" recomputes counters which drifted.
+    """
+    course = Course(name="Python")
+    db.session.add_all([course, Exercise(number="1.0", course=course)])
+    db.session.commit()
+    db.session.execute(update(CourseStats).values(exercises=42))
+    db.session.commit()
+
+    result = runner.invoke(rebuild_command)
+
+    assert "1 counters repaired." in result.output
+    assert counters() == {"Python": (0, 1, 0)}
+    assert "0 counters repaired." in runner.invoke(rebuild_command).output
+
+
+def test_stats_endpoint_and_dashboard(admin_login, setup_course_and_exercise_data):
+    """
+    Test that the statistics are served as JSON and on the admin dashboard.
+    """
+    client, _ = admin_login
+    course, _ = setup_course_and_exercise_data
+
+    response = client.get("/api/stats")
+
+    assert response.status_code == 200
+    assert response.json["totals"]["courses"] == 1
+    assert response.json["courses"][0]["course"] == course.name
+    assert b"Statistics" in client.get("/admin/").data
@@ -0,0 +1,185 @@
+import hashlib
+import io
+
+import pytest
+
+from app.extensions import db
+from app.models import Course, Exercise
+from app.filecache import FileCache
+from app.storage import LocalStorage, S3Storage, storage_key
+
+UPLOAD_URL = "/admin/upload_admin/admin/upload/"
+DOWNLOAD_URL = "/admin/download_admin/admin/download/"
+
+
+class FakeS3Client:
+    """
+    In-memory stand-in for the few calls of a boto3 S3 client that
+    S3Storage makes. Lists two keys per page, to exercise the pagination.
+    """
+
+    class exceptions:
+        class ClientError(Exception):
+            def __init__(self, code):
+                self.response = {"Error": {"Code": code}}
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = 0
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.ClientError("404")
+        data = self.objects[Bucket, Key]
+        return {
+            "ContentLength": len(data),
+            "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+        }
+
+    def get_object(self, Bucket, Key):
+        self.gets += 1
+        return {"Body": io.BytesIO(self.objects[Bucket, Key])}
+
+    def upload_fileobj(self, stream, bucket, key):
+        self.objects[bucket, key] = stream.read()
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Bucket, Key] = Body
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def list_objects_v2(self, Bucket, Prefix, Delimiter, ContinuationToken=None):
+        entries = []
+        for bucket, key in sorted(self.objects):
+            if bucket != Bucket or not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix) :]
+            if Delimiter in rest:
+                entry = ("CommonPrefixes", Prefix + rest.split(Delimiter)[0] + "/")
+            else:
+                entry = ("Contents", key)
+            if entry not in entries:
+                entries.append(entry)
+        start = int(ContinuationToken or 0)
+        page = {"CommonPrefixes": [], "Contents": []}
+        for kind, name in entries[start : start + 2]:
+            page[kind].append(
+                {"Prefix": name} if kind == "CommonPrefixes" else {"Key": name}
+            )
+        if start + 2 < len(entries):
+            page.update(IsTruncated=True, NextContinuationToken=str(start + 2))
+        return page
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+@pytest.fixture()
+def s3_storage(app, tmp_path):
+    """
+    Fixture replacing the app's storage with a bucket of a FakeS3Client.
+    """
+    storage = S3Storage(
+        "exercises",
+        prefix="uploads/",
+        client=FakeS3Client(),
+        cache=FileCache(str(tmp_path / "cache"), 1024**2),
+    )
+    app.extensions["storage"] = storage
+    return storage
+
+
+@pytest.mark.parametrize(
+    "parts", [("..", "x"), ("/etc", "passwd"), ("a", "../b"), ("a\\..\\b",), ("",)]
+)
+def test_storage_key_refuses_escapes(parts):
+    with pytest.raises(ValueError):
+        storage_key(*parts)
+
+
+@pytest.mark.parametrize("backend", ["local", "s3"])
+def test_backends(tmp_path, backend):
+    """
+    Test that both backends store, list and serve files alike.
+    """
+    if backend == "local":
+        storage = LocalStorage(str(tmp_path / "uploads"))
+    else:
+        storage = S3Storage(
+            "exercises",
+            client=FakeS3Client(),
+            cache=FileCache(str(tmp_path / "cache"), 1024**2),
+        )
+
+    storage.makedirs("Empty")
+    assert storage.save("Python/1.0.txt", io.BytesIO(b"one")) == 3
+    storage.save("Python/1.1.txt", io.BytesIO(b"two"))
+    storage.save("Java/2.0.txt", io.BytesIO(b"three"))
+
+    assert storage.listdir() == ["Empty", "Java", "Python"]
+    assert storage.listdir("Python") == ["1.0.txt", "1.1.txt"]
+    assert storage.exists("Python/1.0.txt")
+    assert not storage.exists("Python/9.9.txt")
+    with storage.open("Java/2.0.txt") as file:
+        assert file.read() == b"three"
+    with open(storage.local_path("Python/1.1.txt"), "rb") as file:
+        assert file.read() == b"two"
+
+    storage.delete("Python/1.1.txt")
+    assert storage.listdir("Python") == ["1.0.txt"]
+
+
+def test_read_through_cache(s3_storage):
+    """
+    Test that remote files are fetched once, and again after a new upload.
+    """
+    s3_storage.save("Python/1.0.txt", io.BytesIO(b"old"))
+
+    path = s3_storage.local_path("Python/1.0.txt")
+    assert s3_storage.local_path("Python/1.0.txt") == path
+    assert s3_storage.client.gets == 1
+
+    s3_storage.save("Python/1.0.txt", io.BytesIO(b"new"))
+    new_path = s3_storage.local_path("Python/1.0.txt")
+    with open(new_path, "rb") as file:
+        assert file.read() == b"new"
+    assert s3_storage.client.gets == 2
+
+
+def test_upload_and_presigned_download(app, admin_login, s3_storage):
+    """
+    Test that uploads go to the bucket and downloads are redirected to it.
+    """
+    client, _ = admin_login
+    with app.app_context():
+        db.session.add(Course(name="Python"))
+        db.session.commit()
+    s3_storage.makedirs("Python")
+
+    client.post(UPLOAD_URL, data={"courses": "Python", "select": "Submit"})
+    client.post(
+        UPLOAD_URL,
+        data={
+            "courses": "Python",
+            "exercise": (io.BytesIO(b"print(1)"), "1.0.txt"),
+            "submit": "Upload",
+        },
+        content_type="multipart/form-data",
+    )
+
+    with app.app_context():
+        exercise = Exercise.query.filter_by(number="1.0").one()
+        assert exercise.exercise_path == "Python/1.0.txt"
+    assert s3_storage.client.objects["exercises", "uploads/Python/1.0.txt"] == (
+        b"print(1)"
+    )
+
+    client.post(DOWNLOAD_URL, data={"select": True, "course": "Python"})
+    response = client.post(
+        DOWNLOAD_URL, data=dict(submit="download", course="Python", exercise="1.0")
+    )
+    assert response.status_code == 302
+    assert response.location.startswith(
+        "https://s3.test/exercises/uploads/Python/1.0.txt?"
+    )
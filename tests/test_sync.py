@@ -0,0 +1,98 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from app.extensions import db
+from app.models import Exercise, User
+from app.sync import plan_sync
+from app.tasks import process_exercise
+
+
+def entry(number, sha256):
+    return {"number": number, "sha256": sha256}
+
+
+def test_plan_sync():
+    """
+    Test that the plan holds the additions, updates and deletions only.
+    """
+    entries = [entry("1.0", "a"), entry("1.2", "b"), entry("1.10", None)]
+    entries.append(entry("2.0", "d"))
+
+    plan = plan_sync(entries, {"1.0": "a", "1.2": "old", "1.10": "c", "9.9": "z"})
+
+    assert plan["add"] == [entry("2.0", "d")]
+    assert plan["update"] == [entry("1.2", "b")]
+    assert plan["delete"] == ["9.9"]
+    assert plan["pending"] == ["1.10"]
+    assert plan["unchanged"] == 1
+
+
+@pytest.fixture()
+def mirrored_course(student_login, setup_course_and_exercise_data):
+    """
+    Fixture enrolling the logged in student in a course of two processed
+    exercises, and returning the client and the course.
+    """
+    client, _ = student_login
+    course, first = setup_course_and_exercise_data
+    path = os.path.join(os.path.dirname(first.exercise_path), "test_file_2.txt")
+    with open(path, "w") as file:
+        file.write("Second exercise")
+    second = Exercise(number="1.0.2", exercise_path=path, course=course)
+    db.session.add(second)
+    student = User.query.filter_by(username="test_student").one()
+    student.courses.append(course)
+    db.session.commit()
+    process_exercise(first.exercise_id)
+    process_exercise(second.exercise_id)
+    return client, course
+
+
+def test_sync_course(mirrored_course):
+    """
+    Test the plan of a mirror holding a stale and a deleted exercise.
+    """
+    client, course = mirrored_course
+    first, second = sorted(course.exercises, key=lambda exercise: exercise.number)
+    url = f"/api/courses/{course.course_id}/sync"
+
+    response = client.post(url, json={first.number: "stale", "0.9": "deleted"})
+
+    assert response.status_code == 200
+    assert [e["number"] for e in response.json["update"]] == [first.number]
+    assert [e["name"] for e in response.json["add"]] == ["test_file_2.txt"]
+    assert response.json["add"][0]["sha256"] == second.sha256
+    assert response.json["delete"] == ["0.9"]
+    assert client.post(url, json=["not", "a", "dict"]).status_code == 400
+    assert client.post("/api/courses/9999/sync", json={}).status_code == 404
+
+
+def test_course_files(mirrored_course):
+    """
+    Test that the files come in one tar archive, with their numbers and hashes.
+    """
+    client, course = mirrored_course
+    hashes = {exercise.number: exercise.sha256 for exercise in course.exercises}
+
+    response = client.post(
+        f"/api/courses/{course.course_id}/files", json=["1.0.2", "1.0.1", "7.7"]
+    )
+
+    assert response.mimetype == "application/x-tar"
+    with tarfile.open(fileobj=io.BytesIO(response.data), mode="r|") as archive:
+        members = [
+            (
+                member.name,
+                member.pax_headers["EXERCISE.number"],
+                member.pax_headers["EXERCISE.sha256"],
+                archive.extractfile(member).read(),
+            )
+            for member in archive
+        ]
+    assert members == [
+        ("test_file.txt", "1.0.1", hashes["1.0.1"], b"Test content"),
+        ("test_file_2.txt", "1.0.2", hashes["1.0.2"], b"Second exercise"),
+    ]
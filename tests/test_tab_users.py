@@ -1,3 +1,10 @@
+import re
+
+from app.extensions import db
+from app.helpers import enrollment_page
+from app.models import Course, User
+
+
 def test_users_button(admin_login):
     client, _ = admin_login
 
@@ -20,3 +27,97 @@ def test_handle_view_redirects_to_login(client):
     # Assert that the response is a redirect to the login route
     assert response.status_code == 302  # 302 status code means redirection
     assert response.location == "/login"
+
+
+def enroll(course_name, count):
+    course = Course(name=course_name)
+    course.users = [
+        User(
+            username=f"{course_name.lower()}{i}",
+            active=True,
+            fs_uniquifier=f"{course_name}-{i}",
+        )
+        for i in range(count)
+    ]
+    db.session.add(course)
+    db.session.commit()
+    return course
+
+
+def test_enrollment_pages(app):
+    """
+    Test that the enrollments of a course are paged forwards and backwards.
+    """
+    with app.app_context():
+        course = enroll("Paged", 5)
+        enroll("Other", 3)
+
+        first = enrollment_page(course, per_page=2)
+        second = enrollment_page(course, after=first.last_id, per_page=2)
+        last = enrollment_page(course, after=second.last_id, per_page=2)
+        back = enrollment_page(course, before=last.first_id, per_page=2)
+
+        names = [[name for _, name in page.users] for page in (first, second, last)]
+        assert names == [
+            ["paged0", "paged1"],
+            ["paged2", "paged3"],
+            ["paged4"],
+        ]
+        assert (first.has_previous, first.has_next) == (False, True)
+        assert (last.has_previous, last.has_next) == (True, False)
+        assert back == second
+
+
+def test_course_page(app, admin_login):
+    """
+    Test that the course page shows the enrollment count and one page of students.
+    """
+    client, _ = admin_login
+    app.config["ENROLLMENTS_PER_PAGE"] = 2
+    with app.app_context():
+        enroll("Paged", 3)
+
+    response = client.get("/admin/course_admin/course/Paged")
+
+    assert b"3 enrolled" in response.data
+    assert b"paged1" in response.data
+    assert b"paged2" not in response.data
+    assert b"next &raquo;" in response.data
+
+
+def listed_users(response):
+    return re.findall(r'<td class="col-username">\s*(\S+)', response.text)
+
+
+def test_users_list_columns(app, admin_login):
+    """
+    Test that the roles and courses of each user are listed, one row per user.
+    """
+    client, _ = admin_login
+    with app.app_context():
+        course = enroll("Paged", 2)
+        course.users[0].courses.append(Course(name="second"))
+        db.session.commit()
+
+    response = client.get("/admin/user/")
+
+    assert b"Paged, Second" in response.data
+    assert b"Administrator" in response.data
+    assert listed_users(response).count("paged0") == 1
+
+
+def test_users_list_filters_and_keyset(app, admin_login):
+    """
+    Test the course filter and the pages starting after a username.
+    """
+    client, _ = admin_login
+    with app.app_context():
+        enroll("Paged", 3)
+        enroll("Other", 2)
+
+    # The second filter is the course one
+    response = client.get("/admin/user/?flt0_1=Other")
+    assert listed_users(response) == ["other0", "other1"]
+
+    response = client.get("/admin/user/?after=paged0")
+    assert listed_users(response) == ["paged1", "paged2", "test_admin"]
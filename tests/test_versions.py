@@ -0,0 +1,106 @@
+import os
+import random
+
+import pytest
+
+from app.analytics import analytics, top_exercises
+from app.extensions import db
+from app.models import User
+from app.tasks import process_exercise
+from app.versions import DeltaError, apply_delta, make_delta
+
+LINES = [f"{number}. Print the numbers from 1 to {number}.\n" for number in range(400)]
+OLD = "".join(LINES).encode()
+NEW = "".join(LINES[:200] + ["200a. A new question.\n"] + LINES[210:]).encode()
+
+
+def upload(exercise, content):
+    with open(exercise.exercise_path, "wb") as file:
+        file.write(content)
+    process_exercise(exercise.exercise_id)
+
+
+def test_delta_round_trip():
+    """
+    Test that deltas rebuild text and binary files, and refuse other bases.
+    """
+    random.seed(0)
+    binary = random.randbytes(50_000)
+    changed = binary[:20_000] + b"inserted" + binary[20_100:]
+
+    for old, new in ((OLD, NEW), (binary, changed), (b"", NEW), (OLD, b"")):
+        assert apply_delta(old, make_delta(old, new)) == new
+    assert len(make_delta(OLD, NEW)) < len(NEW) / 10
+    assert len(make_delta(binary, changed)) < len(changed) / 10
+
+    with pytest.raises(DeltaError):
+        apply_delta(NEW, make_delta(OLD, NEW))
+    with pytest.raises(DeltaError):
+        apply_delta(OLD, b"not a delta")
+
+
+def test_versions_and_deltas(app, setup_course_and_exercise_data):
+    """
+    Test that each processed upload is kept as a version, with the delta
+    from the version before it.
+    """
+    _, exercise = setup_course_and_exercise_data
+
+    upload(exercise, OLD)
+    upload(exercise, OLD)  # the same file again
+    upload(exercise, NEW)
+
+    first, second = exercise.versions
+    assert first.delta_key is None
+    assert second.sha256 == exercise.sha256
+    assert second.base_sha256 == first.sha256
+    root = app.config["UPLOAD_FOLDER"]
+    with open(os.path.join(root, first.blob_key), "rb") as file:
+        assert file.read() == OLD
+    with open(os.path.join(root, second.delta_key), "rb") as file:
+        delta = file.read()
+    assert len(delta) == second.delta_size
+    assert apply_delta(OLD, delta) == NEW
+
+
+def test_delta_download(student_login, setup_course_and_exercise_data):
+    """
+    Test that a client holding the previous version downloads the delta,
+    and the others the file, and that the downloads and bytes sent are
+    counted.
+    """
+    client, _ = student_login
+    course, exercise = setup_course_and_exercise_data
+    upload(exercise, OLD)
+    old_sha256 = exercise.sha256
+    upload(exercise, NEW)
+    url = f"/api/exercises/{exercise.exercise_id}/file"
+
+    # The student isn't enrolled yet
+    assert client.get(url).status_code == 404
+    # The requests run in the app context of the student_user fixture
+    User.query.filter_by(username="test_student").one().courses.append(course)
+    db.session.commit()
+
+    delta = client.get(
+        url, headers={"If-None-Match": f'"{old_sha256}"', "A-IM": "exdelta"}
+    )
+    assert delta.status_code == 226
+    assert delta.headers["IM"] == "exdelta"
+    assert delta.headers["Delta-Base"] == f'"{old_sha256}"'
+    assert delta.headers["ETag"] == f'"{exercise.sha256}"'
+    assert apply_delta(OLD, delta.data) == NEW
+
+    full = client.get(url, headers={"If-None-Match": f'"{old_sha256}"'})
+    assert full.status_code == 200
+    assert full.data == NEW
+
+    current = client.get(url, headers={"If-None-Match": f'"{exercise.sha256}"'})
+    assert current.status_code == 304
+
+    analytics.flush()
+    [top] = top_exercises("1h")
+    # The 304 is not a download
+    assert top["downloads"] == 2
+    assert top["bytes_sent"] == len(delta.data) + len(NEW)
+    assert top["bytes_saved"] == 2 * len(NEW) - top["bytes_sent"]
@@ -0,0 +1,8 @@
+# WSGI entry point for production servers, e.g. "gunicorn wsgi:app" (settings
+#   in gunicorn.conf.py). "flask serve" does the same without gunicorn.
+from app import create_app
+from app.server import preload
+
+app = create_app()
+# Load everything before the server forks its workers
+preload(app)